@@ -4,91 +4,39 @@ import logging
 import os
 import time
 from datetime import datetime
+from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple, Union, cast
 
-import schedule
-import sentry_sdk
 import typer
-from aleph.sdk.chains.ethereum import ETHAccount
-from aleph.sdk.client import AuthenticatedAlephClient
-from aleph.sdk.types import Account
-from hexbytes import HexBytes
-
-from aleph_scoring.config import settings
-from aleph_scoring.metrics import measure_node_performance_sync
-from aleph_scoring.metrics.models import MetricsPost, NodeMetrics
-from aleph_scoring.scoring import compute_ccn_scores, compute_crn_scores
-from aleph_scoring.scoring.models import NodeScores, NodeScoresPost
-from aleph_scoring.utils import LogLevel, Period, get_latest_github_releases
-
-logger = logging.getLogger(__name__)
-aleph_account: Optional[ETHAccount] = None
-
-app = typer.Typer()
-
-
-def save_as_json(node_metrics: NodeMetrics, file: Path):
-    with file.open(mode="w") as f:
-        f.write(node_metrics.json(indent=4))
 
+from aleph_scoring.config import PartitionInterval, ScoringEngine, settings
+from aleph_scoring.profiling import phase, profile_run
+from aleph_scoring.utils import LogLevel, Period, parse_duration
 
-def get_aleph_account():
-    if not settings.ETHEREUM_PRIVATE_KEY:
-        raise ValueError(
-            "Could not read Ethereum private key from ETHEREUM_PRIVATE_KEY."
-        )
-
-    private_key = HexBytes(settings.ETHEREUM_PRIVATE_KEY)
-    account = ETHAccount(private_key)
-    return account
+if TYPE_CHECKING:
+    from aleph_scoring.metrics.models import NodeMetrics
+    from aleph_scoring.scoring.models import CcnScore, CrnScore, NodeScores
+    from aleph_scoring.scoring.rollups import NodeType
 
+# The modules of the commands are imported by the commands themselves: the
+# measurements do not need the database stack, the scoring does not need the
+# probes, and neither needs the Aleph SDK unless the results are published.
+# See tests/test_startup.py.
 
-async def publish_metrics_on_aleph(account: Account, node_metrics: NodeMetrics):
-    channel = settings.ALEPH_POST_TYPE_CHANNEL
-    aleph_api_server = settings.NODE_DATA_HOST
+logger = logging.getLogger(__name__)
 
-    metrics_post_data = MetricsPost(tags=["mainnet"], metrics=node_metrics)
-    async with AuthenticatedAlephClient(
-        account=account, api_server=aleph_api_server
-    ) as client:
-        metrics_post, status = await client.create_post(
-            post_content=metrics_post_data,
-            post_type=settings.ALEPH_POST_TYPE_METRICS,
-            channel=channel,
-        )
-    logger.info(
-        "Published metrics on Aleph with status %s: %s", status, metrics_post.item_hash
-    )
+app = typer.Typer()
 
 
-async def publish_scores_on_aleph(
-    account: Account, node_scores: NodeScores, period: Period
-):
-    channel = settings.ALEPH_POST_TYPE_CHANNEL
-    aleph_api_server = settings.NODE_DATA_HOST
+class NodeTypeOption(str, Enum):
+    CCN = "ccn"
+    CRN = "crn"
 
-    scores_post_data = NodeScoresPost(
-        tags=["mainnet"],
-        scores=node_scores,
-        period=period,
-    )
 
-    post_content = scores_post_data.dict()
-    # Force datetime conversion to string
-    post_content["period"] = json.loads(period.json())
-
-    async with AuthenticatedAlephClient(
-        account=account, api_server=aleph_api_server
-    ) as client:
-        scores_post, status = await client.create_post(
-            post_content=post_content,
-            post_type=settings.ALEPH_POST_TYPE_SCORES,
-            channel=channel,
-        )
-    logger.info(
-        "Published scores on Aleph with status %s: %s", status, scores_post.item_hash
-    )
+def save_as_json(node_metrics: "NodeMetrics", file: Path):
+    with file.open(mode="w") as f:
+        f.write(node_metrics.json(indent=4))
 
 
 def run_measurements(
@@ -101,17 +49,25 @@ def run_measurements(
         help="Publish the results on Aleph.",
     ),
 ):
+    from aleph_scoring.metrics import measure_node_performance_sync
+
     node_metrics = measure_node_performance_sync()
 
-    if output:
-        save_as_json(node_metrics=node_metrics, file=output)
-    if stdout:
-        print(node_metrics.json(indent=4))
+    with phase("serialization"):
+        if output:
+            save_as_json(node_metrics=node_metrics, file=output)
+        if stdout:
+            print(node_metrics.json(indent=4))
     if publish:
-        account = get_aleph_account()
-        asyncio.run(
-            publish_metrics_on_aleph(account=account, node_metrics=node_metrics)
-        )
+        from aleph_scoring.outbox import enqueue_metrics
+
+        with phase("publish"):
+            enqueue_metrics(node_metrics)
+    if settings.EXPORT_DATAFRAME:
+        from aleph_scoring.export import export_node_metrics
+
+        with phase("export"):
+            export_node_metrics(node_metrics)
 
 
 @app.command()
@@ -127,9 +83,29 @@ def measure(
         default=LogLevel.INFO.name,
         help="Logging level",
     ),
+    profile: Optional[Path] = typer.Option(
+        default=None, help="Write a profiling report of the run to this file."
+    ),
+    profile_cpu: bool = typer.Option(
+        default=False, help="Add a sampling CPU profile to the profiling report."
+    ),
 ):
+    from aleph_scoring.openmetrics import start_metrics_server
+
     logging.basicConfig(level=LogLevel[log_level])
-    run_measurements(output=output, publish=publish)
+    start_metrics_server()
+    with profile_run("measure", profile, cpu=profile_cpu):
+        run_measurements(output=output, publish=publish)
+        if settings.EXPORT_DATAFRAME:
+            from aleph_scoring.export import get_export_writer
+
+            with phase("export"):
+                get_export_writer().flush()
+        if publish:
+            from aleph_scoring.outbox import publish_pending
+
+            with phase("publish"):
+                publish_pending()
 
 
 @app.command()
@@ -146,20 +122,11 @@ def measure_on_schedule(
         help="Logging level",
     ),
 ):
-    logging.basicConfig(level=LogLevel[log_level])
-    compute_scores(output=output, publish=publish, log_level=log_level)
-
-    schedule.every(settings.DAEMON_MODE_PERIOD_HOURS).hours.at(":00").do(
-        compute_scores,
-        save=output,
-        publish=publish,
-        log_level=log_level,
-    )
+    """Measure the nodes every MEASUREMENT_INTERVAL."""
+    from aleph_scoring.daemon import run_daemon
 
-    logger.debug("Running the scheduler")
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    logging.basicConfig(level=LogLevel[log_level])
+    asyncio.run(run_daemon(measure=True, score=False, publish=publish, metrics_output=output))
 
 
 @app.command()
@@ -178,8 +145,14 @@ def measure_n_times(
     ),
 ):
     """Measure the performance n times."""
+    from aleph_scoring.openmetrics import start_metrics_server
 
     logging.basicConfig(level=LogLevel[log_level])
+    start_metrics_server()
+    if publish:
+        from aleph_scoring.outbox import start_background_publisher
+
+        start_background_publisher()
 
     for i in range(n):
         t0 = time.time()
@@ -215,13 +188,128 @@ def compute_scores(
         default=LogLevel.INFO.name,
         help="Logging level",
     ),
+    metrics_directory: Optional[Path] = typer.Option(
+        default=None,
+        help="Compute the scores from the metrics files of this directory "
+        "instead of the database.",
+    ),
+    software_versions: Optional[Path] = typer.Option(
+        default=None,
+        help="JSON export of the software_versions table, used with --metrics-directory. "
+        "Defaults to software_versions.json in the metrics directory.",
+    ),
+    to_date: Optional[datetime] = typer.Option(
+        default=None,
+        help="End of the scoring period (UTC), defaults to the current time rounded down "
+        "to SCORE_PERIOD_ALIGNMENT.",
+    ),
+    window: Optional[List[str]] = typer.Option(
+        default=None,
+        help="Compute the scores over this period (e.g. 1d, 7d, 2w) instead of "
+        "SCORE_METRICS_PERIOD. Can be repeated to compute several windows in one pass.",
+    ),
+    profile: Optional[Path] = typer.Option(
+        default=None, help="Write a profiling report of the run to this file."
+    ),
+    profile_cpu: bool = typer.Option(
+        default=False, help="Add a sampling CPU profile to the profiling report."
+    ),
 ):
+    from aleph_scoring.openmetrics import start_metrics_server
+
     logging.basicConfig(level=LogLevel[log_level])
+    start_metrics_server()
+
+    with profile_run("compute-scores", profile, cpu=profile_cpu):
+        run_scoring(
+            output=output,
+            stdout=stdout,
+            publish=publish,
+            metrics_directory=metrics_directory,
+            software_versions=software_versions,
+            to_date=to_date,
+            window=window,
+        )
 
-    to_date = datetime.utcnow()
+
+def run_scoring(
+    output: Optional[Path],
+    stdout: bool,
+    publish: bool,
+    metrics_directory: Optional[Path],
+    software_versions: Optional[Path],
+    to_date: Optional[datetime],
+    window: Optional[List[str]],
+):
+    from aleph_scoring.scoring.archive import (
+        MetricsArchive,
+        compute_archive_scores,
+        compute_archive_scores_for_periods,
+        load_version_classifiers,
+    )
+    from aleph_scoring.scoring.compute import (
+        compute_ccn_scores,
+        compute_crn_scores,
+        compute_scores_for_periods,
+    )
+    from aleph_scoring.scoring.cache import aligned_period_end
+    from aleph_scoring.scoring.models import NodeScores
+
+    to_date = to_date or aligned_period_end()
     from_date = to_date - settings.SCORE_METRICS_PERIOD
     current_period = Period(from_date=from_date, to_date=to_date)
 
+    if settings.SYNC_SOFTWARE_VERSIONS and not metrics_directory:
+        from aleph_scoring.releases import update_software_versions
+
+        with phase("software_versions_sync"):
+            asyncio.run(update_software_versions())
+    if settings.PARTITIONED_MEASUREMENTS and not metrics_directory:
+        from aleph_scoring.scoring.partitions import maintain_partitions
+
+        with phase("partition_maintenance"):
+            asyncio.run(maintain_partitions())
+    if settings.SCORING_ENGINE == ScoringEngine.ROLLUPS and not metrics_directory:
+        from aleph_scoring.scoring.rollups import update_all_rollups
+
+        with phase("rollups_update"):
+            asyncio.run(update_all_rollups())
+
+    if window:
+        periods = [
+            Period(from_date=to_date - parse_duration(duration), to_date=to_date)
+            for duration in window
+        ]
+        with phase("scoring_queries"):
+            if metrics_directory:
+                all_scores = compute_archive_scores_for_periods(
+                    archive=MetricsArchive(metrics_directory),
+                    periods=periods,
+                    classifiers=load_version_classifiers(
+                        software_versions or metrics_directory / "software_versions.json"
+                    ),
+                )
+            else:
+                all_scores = asyncio.run(compute_scores_for_periods(periods))
+        export_scores(
+            list(zip(periods, all_scores)), output=output, stdout=stdout, publish=publish
+        )
+        return
+
+    if metrics_directory:
+        with phase("scoring_queries"):
+            scores = compute_archive_scores(
+                archive=MetricsArchive(metrics_directory),
+                period=current_period,
+                classifiers=load_version_classifiers(
+                    software_versions or metrics_directory / "software_versions.json"
+                ),
+            )
+        export_scores(
+            [(current_period, scores)], output=output, stdout=stdout, publish=publish
+        )
+        return
+
     # (
     #     latest_ccn_release,
     #     previous_ccn_release,
@@ -233,33 +321,448 @@ def compute_scores(
     #     latest_crn_prerelease,
     # ) = get_latest_github_releases("aleph-im", "aleph-vm")
 
-    ccn_scores = asyncio.run(
-        compute_ccn_scores(
-            period=current_period,
+    with phase("scoring_queries"):
+        ccn_scores = asyncio.run(
+            compute_ccn_scores(
+                period=current_period,
+            )
         )
-    )
-    crn_scores = asyncio.run(
-        compute_crn_scores(
-            period=current_period,
+        crn_scores = asyncio.run(
+            compute_crn_scores(
+                period=current_period,
+            )
         )
-    )
 
     scores = NodeScores(
         ccn=ccn_scores,
         crn=crn_scores,
     )
+    export_scores(
+        [(current_period, scores)], output=output, stdout=stdout, publish=publish
+    )
+
+
+def export_scores(
+    windows: List[Tuple[Period, "NodeScores"]],
+    output: Optional[Path],
+    stdout: bool,
+    publish: bool,
+):
+    """Save, print, publish or export the scores of one or several windows."""
+    from aleph_scoring.scoring.models import MultiWindowScores, WindowScores
 
     if stdout or output:
-        result = scores.json(indent=4)
-        if stdout:
-            print(result)
-        if output:
-            with open(output, "w") as fd:
-                fd.write(result)
+        with phase("serialization"):
+            if len(windows) == 1:
+                result = windows[0][1].json(indent=4)
+            else:
+                result = MultiWindowScores(
+                    windows=[
+                        WindowScores(period=period, scores=scores)
+                        for period, scores in windows
+                    ]
+                ).json(indent=4)
+            if stdout:
+                print(result)
+            if output:
+                with open(output, "w") as fd:
+                    fd.write(result)
 
     if publish:
-        account = get_aleph_account()
-        asyncio.run(publish_scores_on_aleph(account, scores, current_period))
+        from aleph_scoring.outbox import enqueue_scores, publish_pending
+
+        with phase("publish"):
+            for period, scores in windows:
+                enqueue_scores(period, scores)
+            publish_pending()
+
+    if settings.EXPORT_DATAFRAME:
+        from aleph_scoring.export import export_node_scores, get_export_writer
+
+        with phase("export"):
+            for period, scores in windows:
+                export_node_scores(period, scores)
+            get_export_writer().flush()
+
+
+@app.command()
+def verify_engine(
+    tolerance: float = typer.Option(
+        default=1e-9, help="Maximum difference allowed between two values."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Check that the NumPy engine computes the same scores as the SQL queries."""
+    from aleph_scoring.scoring.compute import compute_ccn_scores, compute_crn_scores
+    from aleph_scoring.scoring.engine import compare_scores, compute_engine_scores
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    to_date = datetime.utcnow()
+    from_date = to_date - settings.SCORE_METRICS_PERIOD
+    current_period = Period(from_date=from_date, to_date=to_date)
+
+    settings.SCORING_ENGINE = ScoringEngine.SQL
+    sql_scores: Dict["NodeType", Sequence[Union["CcnScore", "CrnScore"]]] = {
+        "ccn": asyncio.run(compute_ccn_scores(period=current_period)),
+        "crn": asyncio.run(compute_crn_scores(period=current_period)),
+    }
+
+    differences = []
+    for node_type, expected in sql_scores.items():
+        actual: Sequence[Union["CcnScore", "CrnScore"]] = asyncio.run(
+            compute_engine_scores(node_type, current_period)
+        )
+        differences += [
+            f"{node_type} {difference}"
+            for difference in compare_scores(expected, actual, tolerance=tolerance)
+        ]
+
+    for difference in differences:
+        print(difference)
+    if differences:
+        raise typer.Exit(code=1)
+    print("The NumPy engine and the SQL queries computed the same scores.")
+
+
+@app.command()
+def score_whatif(
+    scenarios: Path = typer.Argument(
+        ..., help="JSON file with a list of scenarios, see aleph_scoring/scoring/whatif.py."
+    ),
+    node_type_option: NodeTypeOption = typer.Option(
+        NodeTypeOption.CRN, "--node-type", help="Type of node."
+    ),
+    output: Optional[Path] = typer.Option(
+        default=None, help="Path where to save the report in JSON format."
+    ),
+    metrics_directory: Optional[Path] = typer.Option(
+        default=None,
+        help="Read the measurements from the metrics files of this directory "
+        "instead of the database.",
+    ),
+    software_versions: Optional[Path] = typer.Option(
+        default=None,
+        help="JSON export of the software_versions table, used with --metrics-directory. "
+        "Defaults to software_versions.json in the metrics directory.",
+    ),
+    to_date: Optional[datetime] = typer.Option(
+        default=None, help="End of the scoring period (UTC), defaults to now."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Compare the total scores of the nodes under other formula parameters."""
+    from pydantic import parse_file_as
+
+    from aleph_scoring.scoring.archive import MetricsArchive, load_version_classifiers
+    from aleph_scoring.scoring.whatif import Scenario, load_measurements, run_scenarios
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    node_type = cast("NodeType", node_type_option.value)
+    to_date = to_date or datetime.utcnow()
+    period = Period(from_date=to_date - settings.SCORE_METRICS_PERIOD, to_date=to_date)
+
+    if metrics_directory:
+        archive = MetricsArchive(metrics_directory)
+        archive.update()
+        table = archive.load_table(node_type).select_period(period)
+        classifier = load_version_classifiers(
+            software_versions or metrics_directory / "software_versions.json"
+        )[node_type]
+    else:
+        table, classifier = asyncio.run(load_measurements(node_type, period))
+
+    reports = run_scenarios(
+        table, node_type, classifier, parse_file_as(List[Scenario], scenarios)
+    )
+    result = json.dumps([report.dict() for report in reports], indent=4)
+    if output:
+        with open(output, "w") as fd:
+            fd.write(result)
+    else:
+        print(result)
+
+
+@app.command()
+def ingest(
+    api_url: Optional[str] = typer.Option(
+        default=None,
+        help="Aleph API server to read the metrics posts from, defaults to NODE_DATA_HOST.",
+    ),
+    file: Optional[List[Path]] = typer.Option(
+        default=None,
+        help="Read the posts from this export file (JSON or JSONL) instead of an API "
+        "server. Can be repeated.",
+    ),
+    from_date: Optional[datetime] = typer.Option(
+        default=None,
+        help="Read the posts of the API server from this date instead of the last "
+        "checkpoint.",
+    ),
+    batch_size: Optional[int] = typer.Option(
+        default=None, help="Posts loaded per COPY, defaults to INGEST_BATCH_SIZE."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Load the metrics posts into the posts table of the scoring database."""
+    from aleph_scoring.ingest import ingest as ingest_metrics_posts
+
+    logging.basicConfig(level=LogLevel[log_level])
+    stats = asyncio.run(
+        ingest_metrics_posts(
+            api_url=api_url, files=file, from_date=from_date, batch_size=batch_size
+        )
+    )
+    logger.info("Read %d metrics posts, %d were new", stats.read, stats.inserted)
+
+
+@app.command()
+def partitions(
+    interval: Optional[PartitionInterval] = typer.Option(
+        default=None,
+        help="Length of the new partitions, defaults to MEASUREMENT_PARTITION_INTERVAL.",
+    ),
+    archive_directory: Optional[Path] = typer.Option(
+        default=None, help="Save the expired partitions as CSV files in this directory."
+    ),
+    drop: bool = typer.Option(
+        default=True, help="Drop the expired partitions, or only detach them."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Create the upcoming partitions of node_measurements, copy the new measurements
+    and prune the partitions older than MEASUREMENT_RETENTION."""
+    from aleph_scoring.scoring.partitions import maintain_partitions
+
+    logging.basicConfig(level=LogLevel[log_level])
+    asyncio.run(
+        maintain_partitions(
+            interval=interval, archive_directory=archive_directory, drop=drop
+        )
+    )
+
+
+@app.command(name="migrate")
+def migrate_command(
+    dry_run: bool = typer.Option(
+        default=False, help="List the pending migrations without applying them."
+    ),
+    check: bool = typer.Option(
+        default=True,
+        help="Check the plans of the scoring queries and the version intervals "
+        "after migrating.",
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Install or upgrade the tables, functions and indexes used by the scoring."""
+    from aleph_scoring.scoring.migrations import (
+        check_query_plans,
+        check_version_intervals,
+        migrate,
+    )
+    from aleph_scoring.utils import database_connection
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    async def run() -> List[str]:
+        conn = await database_connection(settings)
+        try:
+            migrations = await migrate(conn, dry_run=dry_run)
+            for migration in migrations:
+                print(
+                    f"{'Pending' if dry_run else 'Applied'} migration "
+                    f"{migration.version}: {migration.name}"
+                )
+            if dry_run or not check:
+                return []
+            return await check_query_plans(
+                conn, max_rows=settings.EXPLAIN_MAX_SEQ_SCAN_ROWS
+            ) + await check_version_intervals(conn)
+        finally:
+            await conn.close()
+
+    problems = asyncio.run(run())
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def benchmark(
+    generate: bool = typer.Option(
+        default=False,
+        help="Load a synthetic dataset first. Use a scratch database: the synthetic posts "
+        "are scored like real ones.",
+    ),
+    ccn_nodes: int = typer.Option(default=100, help="Synthetic CCNs."),
+    crn_nodes: int = typer.Option(default=500, help="Synthetic CRNs."),
+    rounds_per_day: int = typer.Option(default=24, help="Synthetic metrics posts per day."),
+    days: int = typer.Option(default=14, help="Days of synthetic metrics posts."),
+    missing_rate: float = typer.Option(
+        default=0.05, help="Probability that a synthetic metric is missing."
+    ),
+    version_mix: str = typer.Option(
+        default="latest=0.7,prerelease=0.05,outdated=0.15,obsolete=0.05,missing=0.05",
+        help="Share of the synthetic measurements of each version annotation.",
+    ),
+    seed: int = typer.Option(default=0, help="Seed of the synthetic dataset."),
+    to_date: Optional[datetime] = typer.Option(
+        default=None,
+        help="End of the synthetic dataset and of the scoring period (UTC), defaults to "
+        "the current hour.",
+    ),
+    period: Optional[str] = typer.Option(
+        default=None,
+        help="Length of the scoring period, such as 1d or 2w. Defaults to "
+        "SCORE_METRICS_PERIOD.",
+    ),
+    runs: int = typer.Option(default=3, help="Runs of each query."),
+    output: Optional[Path] = typer.Option(
+        default=None, help="Path where to save the report in JSON format."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Time the scoring queries and the computation of the scores, optionally on a
+    synthetic dataset."""
+    from aleph_scoring.scoring.benchmark import BenchmarkReport, run_benchmark
+    from aleph_scoring.scoring.synthetic import (
+        SyntheticDataset,
+        load_synthetic_dataset,
+        parse_version_mix,
+    )
+    from aleph_scoring.utils import database_connection
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    end = to_date or datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    period_length = parse_duration(period) if period else settings.SCORE_METRICS_PERIOD
+    scoring_period = Period(from_date=end - period_length, to_date=end)
+    dataset = (
+        SyntheticDataset(
+            ccn_nodes=ccn_nodes,
+            crn_nodes=crn_nodes,
+            rounds_per_day=rounds_per_day,
+            days=days,
+            missing_rate=missing_rate,
+            version_mix=parse_version_mix(version_mix),
+            seed=seed,
+        )
+        if generate
+        else None
+    )
+
+    async def run() -> "BenchmarkReport":
+        conn = await database_connection(settings)
+        try:
+            if dataset:
+                await load_synthetic_dataset(conn, dataset, end=end)
+            return await run_benchmark(conn, scoring_period, runs=runs, dataset=dataset)
+        finally:
+            await conn.close()
+
+    report = asyncio.run(run())
+    for timing in report.queries + report.scoring:
+        print(f"{timing.name}: {timing.rows} rows, median {timing.median:.3f}s")
+    if output:
+        with open(output, "w") as fd:
+            fd.write(report.json(indent=4))
+
+
+@app.command()
+def update_rollups(
+    from_date: Optional[datetime] = typer.Option(
+        default=None,
+        help="Recompute the rollups from this date instead of the last rolled up hour.",
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Roll up the metrics of the hours that arrived since the last update."""
+    from aleph_scoring.scoring.rollups import update_all_rollups
+
+    logging.basicConfig(level=LogLevel[log_level])
+    asyncio.run(update_all_rollups(from_date=from_date))
+
+
+@app.command(name="backfill-scores")
+def backfill_scores_command(
+    from_date: datetime = typer.Option(..., help="End of the first scored period (UTC)."),
+    to_date: Optional[datetime] = typer.Option(
+        default=None, help="End of the last scored period (UTC), defaults to now."
+    ),
+    step: str = typer.Option(
+        default="1d", help="Interval between the ends of two scored periods (e.g. 1d, 12h)."
+    ),
+    window: Optional[str] = typer.Option(
+        default=None,
+        help="Length of each scored period (e.g. 1d, 7d), defaults to SCORE_METRICS_PERIOD.",
+    ),
+    workers: int = typer.Option(
+        default=os.cpu_count() or 1, help="Number of worker processes."
+    ),
+    output: Optional[Path] = typer.Option(
+        default=None,
+        help="Append the scores of each period to this file, one JSON line per period.",
+    ),
+    to_table: bool = typer.Option(
+        default=False, help="Save the scores in the node_scores_history table."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Recompute the scores of past periods in parallel."""
+    from aleph_scoring.scoring.backfill import (
+        backfill_periods,
+        backfill_scores,
+        update_backfill_rollups,
+    )
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    if not output and not to_table:
+        raise typer.BadParameter("Specify --output and/or --to-table.")
+
+    periods = backfill_periods(
+        from_date=from_date,
+        to_date=to_date or datetime.utcnow(),
+        step=parse_duration(step),
+        window=parse_duration(window) if window else settings.SCORE_METRICS_PERIOD,
+    )
+    logger.info("Scoring %d periods with %d workers", len(periods), workers)
+
+    if settings.SCORING_ENGINE == ScoringEngine.ROLLUPS:
+        asyncio.run(update_backfill_rollups(periods))
+
+    failures = backfill_scores(
+        periods, workers=workers, output=output, save_in_database=to_table
+    )
+    if failures:
+        logger.error("%d periods could not be scored", failures)
+        raise typer.Exit(code=1)
 
 
 @app.command()
@@ -276,20 +779,90 @@ def compute_on_schedule(
         help="Logging level",
     ),
 ):
+    """Compute the scores every DAEMON_MODE_PERIOD_HOURS."""
+    from aleph_scoring.daemon import run_daemon
+
     logging.basicConfig(level=LogLevel[log_level])
-    compute_scores(output=output, publish=publish, log_level=log_level)
+    asyncio.run(run_daemon(measure=False, score=True, publish=publish, scores_output=output))
+
+
+@app.command()
+def daemon(
+    measure: bool = typer.Option(
+        default=True, help="Measure the nodes every MEASUREMENT_INTERVAL."
+    ),
+    score: bool = typer.Option(
+        default=True, help="Compute the scores every DAEMON_MODE_PERIOD_HOURS."
+    ),
+    publish: bool = typer.Option(
+        default=False,
+        help="Publish the results on Aleph.",
+    ),
+    metrics_output: Optional[Path] = typer.Option(
+        default=None, help="Path where to save the last metrics in JSON format."
+    ),
+    scores_output: Optional[Path] = typer.Option(
+        default=None, help="Path where to save the last scores in JSON format."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Measure the nodes, compute the scores and publish the results in one process."""
+    from aleph_scoring.daemon import run_daemon
 
-    schedule.every(settings.DAEMON_MODE_PERIOD_HOURS).hours.at(":00").do(
-        compute_scores,
-        save=output,
-        publish=publish,
-        log_level=log_level,
+    logging.basicConfig(level=LogLevel[log_level])
+    asyncio.run(
+        run_daemon(
+            measure=measure,
+            score=score,
+            publish=publish,
+            metrics_output=metrics_output,
+            scores_output=scores_output,
+        )
     )
 
-    logger.debug("Running the scheduler")
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+
+@app.command()
+def publish_outbox(
+    once: bool = typer.Option(
+        default=False, help="Publish the due results once instead of running forever."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Publish the results written to the outbox by the --publish options."""
+    from aleph_scoring.outbox import get_outbox, publish_due, run_publisher
+
+    logging.basicConfig(level=LogLevel[log_level])
+
+    outbox = get_outbox()
+    if not once:
+        asyncio.run(run_publisher(outbox))
+
+    published = asyncio.run(publish_due(outbox))
+    print(f"Published {published} results, {outbox.pending()} pending")
+
+
+@app.command()
+def compact_export(
+    directory: Optional[Path] = typer.Option(
+        default=None, help="Directory of the exported datasets, defaults to EXPORT_DIRECTORY."
+    ),
+    log_level: str = typer.Option(
+        default=LogLevel.INFO.name,
+        help="Logging level",
+    ),
+):
+    """Merge the files of each past day of the datasets written with EXPORT_DATAFRAME."""
+    from aleph_scoring.export import compact_export as compact_datasets
+
+    logging.basicConfig(level=LogLevel[log_level])
+    compacted = compact_datasets(directory)
+    print(f"Compacted {compacted} days")
 
 
 @app.command()
@@ -299,6 +872,8 @@ def export_as_html(input_file: Optional[Path]):
 
 def main():
     if settings.SENTRY_DSN:
+        import sentry_sdk
+
         sentry_sdk.init(
             settings.SENTRY_DSN,
         )
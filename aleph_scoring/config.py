@@ -1,11 +1,26 @@
 import logging
 from datetime import timedelta
+from enum import Enum
 from pathlib import Path
 from typing import Optional
 
 from pydantic import BaseSettings, HttpUrl
 
 
+class ScoringEngine(str, Enum):
+    # Aggregate the raw metrics posts in Postgres
+    SQL = "sql"
+    # Merge the hourly rollups of the metrics
+    ROLLUPS = "rollups"
+    # Aggregate the raw metrics in memory with NumPy
+    NUMPY = "numpy"
+
+
+class PartitionInterval(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+
+
 class Settings(BaseSettings):
     NODE_DATA_HOST: str = "https://official.aleph.cloud"
     NODE_DATA_ADDR: str = "0xa1B3bb7d2332383D96b7796B908fB7f7F3c2Be10"
@@ -21,21 +36,114 @@ class Settings(BaseSettings):
     ALEPH_POST_TYPE_CHANNEL: Optional[str] = "aleph-scoring"
     ALEPH_POST_TYPE_METRICS: str = "test-aleph-network-metrics"
     ALEPH_POST_TYPE_SCORES: str = "test-aleph-scoring-scores"
+    # API server the results are published to, defaults to NODE_DATA_HOST
+    ALEPH_API_SERVER: Optional[str] = None
+    # Results to publish are written to this SQLite database first, see aleph_scoring/outbox.py
+    OUTBOX_PATH: Path = Path("/srv/outbox.sqlite3")
+    OUTBOX_BATCH_SIZE: int = 20
+    OUTBOX_POLL_INTERVAL: timedelta = timedelta(seconds=10)
+    # Delay before the first retry of a failed publication, doubled after each failure
+    OUTBOX_RETRY_DELAY: timedelta = timedelta(seconds=30)
+    OUTBOX_MAX_RETRY_DELAY: timedelta = timedelta(hours=1)
+    # Entries are marked as failed and not retried after this number of attempts, about a
+    # day with the default delays
+    OUTBOX_MAX_ATTEMPTS: int = 30
+    # Published entries are removed after this delay
+    OUTBOX_RETENTION: timedelta = timedelta(days=7)
+    # Publish the measurements of the scores as a separate file and leave the missing values
+    # out of the metrics posts, see aleph_scoring/publication.py
+    COMPACT_SCORES_POSTS: bool = False
+    # Only publish the scores that changed by more than SCORE_DELTA_THRESHOLD, in posts of
+    # type ALEPH_POST_TYPE_SCORES_DELTA, and the full scores every SCORE_CHECKPOINT_INTERVAL
+    DELTA_SCORES_POSTS: bool = False
+    ALEPH_POST_TYPE_SCORES_DELTA: str = "test-aleph-scoring-scores-delta"
+    SCORE_DELTA_THRESHOLD: float = 0.001
+    SCORE_CHECKPOINT_INTERVAL: timedelta = timedelta(days=1)
+    # Last published scores, compared to the new ones in delta mode
+    PUBLISHED_SCORES_DIRECTORY: Path = Path("/srv/published-scores")
     ASN_DB_DIRECTORY: Path = "/srv/asn"
     ASN_DB_PATH: str = "/tmp/asn_db.bz2"
     ASN_DB_REFRESH_PERIOD_DAYS: int = 1
     DAEMON_MODE_PERIOD_HOURS: int = 24
+    # Interval between the measurement rounds of the daemon, see aleph_scoring/daemon.py
+    MEASUREMENT_INTERVAL: timedelta = timedelta(minutes=10)
+    # Delay given to the running jobs to finish when the daemon stops
+    DAEMON_SHUTDOWN_TIMEOUT: timedelta = timedelta(minutes=1)
+    DAEMON_DATABASE_CONNECTIONS: int = 2
+    # Serve the internal metrics on this port, see aleph_scoring/openmetrics.py
+    OPENMETRICS_PORT: Optional[int] = None
+    OPENMETRICS_HOST: str = "0.0.0.0"
+    # Export the traces of the measurement rounds in OTLP/JSON to this file and/or
+    # to this OTLP/HTTP endpoint, e.g. http://127.0.0.1:4318/v1/traces
+    TRACES_FILE: Optional[Path] = None
+    TRACES_ENDPOINT: Optional[str] = None
+    # Append the metrics and scores to Parquet datasets in EXPORT_DIRECTORY, see
+    # aleph_scoring/export.py
     EXPORT_DATAFRAME: bool = False
+    EXPORT_DIRECTORY: Path = Path("/srv/export")
+    # Rows are written when EXPORT_BATCH_ROWS are buffered, or EXPORT_FLUSH_INTERVAL
+    # after the first one
+    EXPORT_BATCH_ROWS: int = 50_000
+    EXPORT_FLUSH_INTERVAL: timedelta = timedelta(hours=1)
+    # Interval between the compactions of the past days by the daemon
+    EXPORT_COMPACTION_INTERVAL: timedelta = timedelta(days=1)
     ETHEREUM_PRIVATE_KEY: str = (
         "0x95c6bc829ddf6a83b5d8b228db2942fe828802fb63f412586ea7c2d0036b4020"
     )
     HTTP_REQUEST_TIMEOUT: float = 10.0
+
+    # Releases of the node software, see aleph_scoring/releases.py
+    GITHUB_API_URL: str = "https://api.github.com"
+    GITHUB_TOKEN: Optional[str] = None
+    RELEASE_CACHE_DIRECTORY: Path = Path("/srv/releases")
+    # Cached releases younger than this are used without revalidation
+    RELEASE_CACHE_MAX_AGE: timedelta = timedelta(minutes=10)
+    # Sync the releases into software_versions before computing the scores,
+    # instead of maintaining the table by hand
+    SYNC_SOFTWARE_VERSIONS: bool = False
     LOGGING_LEVEL: int = logging.DEBUG
     SENTRY_DSN: Optional[HttpUrl] = None
 
+    # Posts loaded per COPY and requested per API page by the ingest command
+    INGEST_BATCH_SIZE: int = 10_000
+    INGEST_PAGE_SIZE: int = 500
+
+    # Read the measurements from the partitions of node_measurements instead of the posts
+    PARTITIONED_MEASUREMENTS: bool = False
+    MEASUREMENT_PARTITION_INTERVAL: PartitionInterval = PartitionInterval.DAY
+    # Partitions created in advance, and age of the partitions that are pruned
+    MEASUREMENT_PARTITIONS_AHEAD: timedelta = timedelta(days=7)
+    MEASUREMENT_RETENTION: timedelta = timedelta(weeks=4)
+    # Posts created this long before the last copy into the partitions are copied again, to
+    # include the posts indexed late
+    MEASUREMENT_SYNC_LATENESS: timedelta = timedelta(hours=6)
+
+    # The migrate command fails when a scoring query reads a larger table sequentially
+    EXPLAIN_MAX_SEQ_SCAN_ROWS: int = 100_000
+
     VERSION_GRACE_PERIOD: timedelta = timedelta(weeks=2)
     SCORE_METRICS_PERIOD: timedelta = timedelta(days=1)  # TODO: bring back to 2 weeks
 
+    SCORING_ENGINE: ScoringEngine = ScoringEngine.SQL
+    # Rows fetched at once by the cursor of the measurement queries
+    MEASUREMENTS_CURSOR_PREFETCH: int = 100
+    # JSON file of a FormulaSpec, see aleph_scoring/scoring/formula.py
+    SCORING_FORMULA_FILE: Optional[Path] = None
+    ROLLUP_SKETCH_RELATIVE_ACCURACY: float = 0.01
+    # Period rolled up when the rollups table is empty
+    ROLLUP_INITIAL_PERIOD: timedelta = timedelta(weeks=2)
+    # Hours before the last rollup that are rolled up again by every update, to include
+    # the metrics posts that reached the database after their hour was rolled up
+    ROLLUP_LATENESS: timedelta = timedelta(hours=6)
+
+    # Cache of the computed scores, disabled when no directory is specified
+    SCORE_CACHE_DIRECTORY: Optional[Path] = None
+    SCORE_CACHE_MAX_ENTRIES: int = 512
+    SCORE_CACHE_MAX_AGE: timedelta = timedelta(days=30)
+    # The scoring periods end at a multiple of this duration by default, so that the runs
+    # made within the same interval share their cached scores
+    SCORE_PERIOD_ALIGNMENT: timedelta = timedelta(hours=1)
+
     class Config:
         env_file = ".env"
         env_prefix = "ALEPH_SCORING_"
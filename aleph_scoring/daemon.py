@@ -0,0 +1,371 @@
+"""
+Daemon running the measurement rounds, the scoring and the publication of the
+results together, in a single asyncio event loop.
+
+Each job runs in its own task and on its own cadence, aligned on multiples of
+its interval, so a job never overlaps itself and a slow scoring does not delay
+the measurements. The rollups and the scores are computed in a worker process:
+their CPU work would otherwise block the event loop and inflate the latencies
+measured meanwhile. The runs a job missed while it was running late are not
+replayed one by one: a job that catches up runs once, then returns to its
+cadence, and the measurements, which cannot be made for the past, skip the
+missed rounds instead.
+
+The jobs share a database pool, the ASN database, the outbox and the writer of
+the exported datasets, which stay warm between the runs. On SIGINT or SIGTERM, the running jobs get
+DAEMON_SHUTDOWN_TIMEOUT to finish, and the results they produced are published
+before the daemon exits.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, Callable, List, Optional, Tuple
+
+import asyncpg
+
+from aleph_scoring.config import ScoringEngine, settings
+from aleph_scoring.metrics import measure_node_performance
+from aleph_scoring.metrics.asn import get_asn_database
+from aleph_scoring.openmetrics import start_metrics_server, watch_event_loop_lag
+from aleph_scoring.outbox import Outbox, enqueue_metrics, enqueue_scores, get_outbox, publish_due
+from aleph_scoring.releases import update_software_versions
+from aleph_scoring.scoring.compute import compute_ccn_scores, compute_crn_scores
+from aleph_scoring.scoring.cache import (
+    DataWatermark,
+    aligned_period_end,
+    query_data_watermark,
+)
+from aleph_scoring.scoring.models import NodeScores
+from aleph_scoring.scoring.partitions import maintain_partitions
+from aleph_scoring.scoring.rollups import update_all_rollups
+from aleph_scoring.utils import Period, database_connection, database_pool
+
+if TYPE_CHECKING:
+    from aleph_scoring.export import ExportWriter
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A coroutine function run every `interval`.
+
+    With `catch_up`, a run that was missed is made as soon as possible, once
+    however many runs were missed. Without it, the missed runs are skipped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: timedelta,
+        run: Callable[[], Awaitable[None]],
+        catch_up: bool = True,
+    ):
+        if interval <= timedelta(0):
+            raise ValueError(f"The interval of job {name} must be positive")
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.catch_up = catch_up
+        self.runs = 0
+        self.missed = 0
+
+    def next_run(self, started: float, finished: float) -> Tuple[float, int]:
+        """Time of the next run after a run, and number of runs missed during it."""
+        interval = self.interval.total_seconds()
+        next_run = (started // interval + 1) * interval
+        if next_run > finished:
+            return next_run, 0
+
+        missed = int((finished - next_run) // interval) + 1
+        if self.catch_up:
+            return finished, missed - 1
+        return (finished // interval + 1) * interval, missed
+
+
+async def run_job(
+    job: Job, stopping: asyncio.Event, clock: Callable[[], float] = time.time
+) -> None:
+    """Run a job on its cadence until `stopping` is set, starting now."""
+    next_run = clock()
+    while not stopping.is_set():
+        delay = next_run - clock()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        started = clock()
+        try:
+            await job.run()
+        except Exception:
+            logger.exception("Job %s failed", job.name)
+        job.runs += 1
+
+        next_run, missed = job.next_run(started, clock())
+        if missed:
+            job.missed += missed
+            logger.warning(
+                "Job %s ran late and skipped %d runs, next run in %.0fs",
+                job.name,
+                missed,
+                max(next_run - clock(), 0),
+            )
+
+
+class Daemon:
+    """Runs jobs concurrently until it is stopped."""
+
+    def __init__(self, jobs: List[Job]):
+        self.jobs = jobs
+        self.stopping: Optional[asyncio.Event] = None
+
+    def stop(self) -> None:
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def run(self, shutdown_timeout: Optional[timedelta] = None) -> None:
+        shutdown_timeout = shutdown_timeout or settings.DAEMON_SHUTDOWN_TIMEOUT
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+
+        try:
+            tasks = [asyncio.ensure_future(run_job(job, self.stopping)) for job in self.jobs]
+            logger.info("Running jobs %s", ", ".join(job.name for job in self.jobs))
+            async with watch_event_loop_lag():
+                await self.stopping.wait()
+
+            logger.info("Stopping, waiting for the running jobs")
+            _, pending = await asyncio.wait(tasks, timeout=shutdown_timeout.total_seconds())
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning("Cancelled %d jobs that did not finish in time", len(pending))
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signal_number)
+
+
+class MeasurementJob:
+    """Measures the nodes, then saves, enqueues or exports the metrics."""
+
+    def __init__(
+        self,
+        outbox: Optional[Outbox],
+        output: Optional[Path],
+        exporter: Optional["ExportWriter"] = None,
+    ):
+        self.outbox = outbox
+        self.output = output
+        self.exporter = exporter
+
+    async def __call__(self) -> None:
+        # Refresh the ASN database outside of the event loop, the measurements
+        # use the loaded database
+        await asyncio.get_running_loop().run_in_executor(None, get_asn_database)
+        node_metrics = await measure_node_performance()
+
+        if self.output:
+            self.output.write_text(node_metrics.json(indent=4))
+        if self.outbox:
+            enqueue_metrics(node_metrics, self.outbox)
+        if self.exporter:
+            from aleph_scoring.export import export_node_metrics
+
+            export_node_metrics(node_metrics, self.exporter)
+
+
+def init_scoring_worker(log_level: int) -> None:
+    # The daemon handles the interrupts and lets the running scoring finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level)
+
+
+def scoring_executor() -> ProcessPoolExecutor:
+    """Process running the CPU-bound part of the scoring jobs.
+
+    The process is spawned rather than forked, so that it does not inherit the
+    event loop, the database pool or the outbox of the daemon.
+    """
+    return ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_scoring_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),),
+    )
+
+
+async def compute_period_scores(period: Period) -> NodeScores:
+    conn = await database_connection(settings)
+    try:
+        if settings.SCORING_ENGINE == ScoringEngine.ROLLUPS:
+            await update_all_rollups(conn=conn)
+        return NodeScores(
+            ccn=await compute_ccn_scores(period, conn=conn),
+            crn=await compute_crn_scores(period, conn=conn),
+        )
+    finally:
+        await conn.close()
+
+
+def score_period(period: Period) -> NodeScores:
+    """Update the rollups and score the nodes over a period, in a worker
+    process with its own connection to the database."""
+    return asyncio.run(compute_period_scores(period))
+
+
+class ScoringJob:
+    """Scores the nodes over SCORE_METRICS_PERIOD when new metrics arrived
+    since its last run, then saves, enqueues or exports the scores.
+
+    The scores are computed by `score` in `executor`, the default executor
+    of the event loop when none is specified.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        outbox: Optional[Outbox],
+        output: Optional[Path],
+        exporter: Optional["ExportWriter"] = None,
+        executor: Optional[Executor] = None,
+        score: Callable[[Period], NodeScores] = score_period,
+    ):
+        self.pool = pool
+        self.outbox = outbox
+        self.output = output
+        self.exporter = exporter
+        self.executor = executor
+        self.score = score
+        self.last_watermark: Optional[DataWatermark] = None
+
+    async def __call__(self) -> None:
+        to_date = aligned_period_end()
+        period = Period(from_date=to_date - settings.SCORE_METRICS_PERIOD, to_date=to_date)
+
+        async with self.pool.acquire() as conn:
+            # New releases change the annotations of the versions, and the watermark
+            if settings.SYNC_SOFTWARE_VERSIONS:
+                await update_software_versions(conn)
+            watermark = await query_data_watermark(conn)
+            if watermark == self.last_watermark:
+                logger.info("No new metrics since the last computation, skipping")
+                return
+
+            if settings.PARTITIONED_MEASUREMENTS:
+                await maintain_partitions(conn=conn)
+
+        scores = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.score, period
+        )
+
+        if self.output:
+            self.output.write_text(scores.json(indent=4))
+        if self.outbox:
+            enqueue_scores(period, scores, self.outbox)
+        if self.exporter:
+            from aleph_scoring.export import export_node_scores
+
+            export_node_scores(period, scores, self.exporter)
+        self.last_watermark = watermark
+
+
+async def publish_outbox_job(outbox: Outbox) -> None:
+    published = await publish_due(outbox)
+    if published:
+        logger.info("Published %d results", published)
+
+
+async def compact_export_job() -> None:
+    from aleph_scoring.export import compact_export
+
+    # Reads and writes whole files, outside of the event loop
+    await asyncio.get_running_loop().run_in_executor(None, compact_export)
+
+
+async def run_daemon(
+    measure: bool,
+    score: bool,
+    publish: bool,
+    metrics_output: Optional[Path] = None,
+    scores_output: Optional[Path] = None,
+) -> None:
+    """Run the measurements every MEASUREMENT_INTERVAL and the scoring every
+    DAEMON_MODE_PERIOD_HOURS, and publish their results, until stopped."""
+    start_metrics_server()
+    outbox = get_outbox() if publish else None
+    exporter = None
+    if settings.EXPORT_DATAFRAME:
+        # pyarrow is only loaded when the results are exported
+        from aleph_scoring.export import get_export_writer
+
+        exporter = get_export_writer()
+    pool = (
+        await database_pool(settings, max_size=settings.DAEMON_DATABASE_CONNECTIONS)
+        if score
+        else None
+    )
+    executor = scoring_executor() if score else None
+
+    jobs = []
+    if measure:
+        jobs.append(
+            Job(
+                "measurements",
+                settings.MEASUREMENT_INTERVAL,
+                MeasurementJob(outbox, metrics_output, exporter),
+                catch_up=False,
+            )
+        )
+    if score:
+        jobs.append(
+            Job(
+                "scoring",
+                timedelta(hours=settings.DAEMON_MODE_PERIOD_HOURS),
+                ScoringJob(pool, outbox, scores_output, exporter, executor),
+            )
+        )
+    if outbox:
+        jobs.append(
+            Job(
+                "publication",
+                settings.OUTBOX_POLL_INTERVAL,
+                partial(publish_outbox_job, outbox),
+                catch_up=False,
+            )
+        )
+
+    if exporter:
+        jobs.append(
+            Job("export_compaction", settings.EXPORT_COMPACTION_INTERVAL, compact_export_job)
+        )
+
+    try:
+        await Daemon(jobs).run()
+    finally:
+        if pool is not None:
+            await pool.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if exporter:
+            exporter.flush()
+
+    if outbox:
+        # Publish the results of the last runs
+        try:
+            await asyncio.wait_for(
+                publish_outbox_job(outbox),
+                timeout=settings.DAEMON_SHUTDOWN_TIMEOUT.total_seconds(),
+            )
+        except asyncio.TimeoutError:
+            logger.warning("%d results left unpublished in the outbox", outbox.pending())
@@ -0,0 +1,371 @@
+"""
+Columnar export of the metrics and scores, for analysis.
+
+With EXPORT_DATAFRAME, the metrics of each measurement round and the scores of
+each scoring run are appended to Parquet datasets in EXPORT_DIRECTORY, one per
+table, partitioned by day:
+
+    crn_metrics/date=2023-04-15/part-1681516800000000000-3f2a9c1e.parquet
+
+The rows are buffered and written EXPORT_BATCH_ROWS at a time, or
+EXPORT_FLUSH_INTERVAL after the first buffered row, and when the process
+exits. `compact_export` then merges the files of each past day into a single
+file sorted by node, which the daemon does every EXPORT_COMPACTION_INTERVAL.
+Files are written under a hidden name and renamed, so readers never see a
+partial file, and `load_export` reads only the columns and days it needs.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import uuid4
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics.models import AlephNodeMetrics, NodeMetrics
+from aleph_scoring.scoring.models import NodeScores
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = "zstd"
+COMPACTED_ROW_GROUP_SIZE = 100_000
+# Metadata of the compacted files: names of the files they replace
+COMPACTED_FROM_KEY = b"aleph_scoring.compacted_from"
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive")
+
+NODE_METRICS_FIELDS = [
+    pa.field("round_id", pa.string()),
+    # Address of the scoring server that measured the node
+    pa.field("server", pa.string()),
+    pa.field("measured_at", TIMESTAMP, nullable=False),
+    pa.field("node_id", pa.string(), nullable=False),
+    pa.field("url", pa.string()),
+    pa.field("asn", pa.int64()),
+    pa.field("as_name", pa.string()),
+    pa.field("version", pa.string()),
+    pa.field("days_outdated", pa.int32()),
+    pa.field("base_latency", pa.float64()),
+    pa.field("base_latency_ipv4", pa.float64()),
+]
+NODE_SCORE_FIELDS = [
+    pa.field("computed_at", TIMESTAMP, nullable=False),
+    pa.field("from_date", TIMESTAMP, nullable=False),
+    pa.field("to_date", TIMESTAMP, nullable=False),
+    pa.field("node_id", pa.string(), nullable=False),
+    pa.field("total_score", pa.float64()),
+    pa.field("performance", pa.float64()),
+    pa.field("version", pa.float64()),
+    pa.field("decentralization", pa.float64()),
+    # Measurements of the node over the period
+    pa.field("total_nodes", pa.int32()),
+    pa.field("nodes_with_identical_asn", pa.int32()),
+    pa.field("base_latency_score_p25", pa.float64()),
+    pa.field("base_latency_score_p95", pa.float64()),
+    pa.field("node_version_latest", pa.int32()),
+    pa.field("node_version_outdated", pa.int32()),
+    pa.field("node_version_obsolete", pa.int32()),
+    pa.field("node_version_missing", pa.int32()),
+    pa.field("node_version_other", pa.int32()),
+    pa.field("node_version_prerelease", pa.int32()),
+]
+
+SCHEMAS: Dict[str, pa.Schema] = {
+    "ccn_metrics": pa.schema(
+        NODE_METRICS_FIELDS
+        + [
+            pa.field("metrics_latency", pa.float64()),
+            pa.field("aggregate_latency", pa.float64()),
+            pa.field("file_download_latency", pa.float64()),
+            pa.field("txs_total", pa.int64()),
+            pa.field("pending_messages", pa.int64()),
+            pa.field("eth_height_remaining", pa.int64()),
+        ]
+    ),
+    "crn_metrics": pa.schema(
+        NODE_METRICS_FIELDS
+        + [
+            pa.field("diagnostic_vm_latency", pa.float64()),
+            pa.field("full_check_latency", pa.float64()),
+            pa.field("vm_ping_latency", pa.float64()),
+        ]
+    ),
+    "ccn_scores": pa.schema(
+        NODE_SCORE_FIELDS
+        + [
+            pa.field("metrics_latency_score_p25", pa.float64()),
+            pa.field("metrics_latency_score_p95", pa.float64()),
+            pa.field("aggregate_latency_score_p25", pa.float64()),
+            pa.field("aggregate_latency_score_p95", pa.float64()),
+            pa.field("file_download_latency_score_p25", pa.float64()),
+            pa.field("file_download_latency_score_p95", pa.float64()),
+            pa.field("eth_height_remaining_score_p25", pa.float64()),
+            pa.field("eth_height_remaining_score_p95", pa.float64()),
+        ]
+    ),
+    "crn_scores": pa.schema(
+        NODE_SCORE_FIELDS
+        + [
+            pa.field("diagnostic_vm_latency_score_p25", pa.float64()),
+            pa.field("diagnostic_vm_latency_score_p95", pa.float64()),
+            pa.field("full_check_latency_score_p25", pa.float64()),
+            pa.field("full_check_latency_score_p95", pa.float64()),
+        ]
+    ),
+}
+# Column that gives the day of the rows of each table
+DATE_COLUMNS = {
+    "ccn_metrics": "measured_at",
+    "crn_metrics": "measured_at",
+    "ccn_scores": "to_date",
+    "crn_scores": "to_date",
+}
+
+Rows = Dict[str, List[Dict[str, Any]]]
+
+
+def as_utc(value: datetime) -> datetime:
+    """The datetime in UTC, naive datetimes being in UTC already."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def node_metrics_rows(
+    node_metrics: NodeMetrics, nodes: Sequence[AlephNodeMetrics]
+) -> List[Dict[str, Any]]:
+    return [
+        {
+            **node.dict(),
+            "round_id": node_metrics.round_id,
+            "server": node_metrics.server,
+            "measured_at": datetime.fromtimestamp(node.measured_at, timezone.utc),
+        }
+        for node in nodes
+    ]
+
+
+def metrics_rows(node_metrics: NodeMetrics) -> Rows:
+    return {
+        "ccn_metrics": node_metrics_rows(node_metrics, node_metrics.ccn),
+        "crn_metrics": node_metrics_rows(node_metrics, node_metrics.crn),
+    }
+
+
+def scores_rows(period: Period, node_scores: NodeScores, computed_at: datetime) -> Rows:
+    def rows(scores) -> List[Dict[str, Any]]:
+        return [
+            {
+                **score.measurements.dict(),
+                **score.dict(exclude={"measurements"}),
+                "computed_at": computed_at,
+                "from_date": as_utc(period.from_date),
+                "to_date": as_utc(period.to_date),
+            }
+            for score in scores
+        ]
+
+    return {"ccn_scores": rows(node_scores.ccn), "crn_scores": rows(node_scores.crn)}
+
+
+def part_file_name() -> str:
+    return f"part-{time.time_ns()}-{uuid4().hex[:8]}.parquet"
+
+
+def write_parquet(path: Path, table: pa.Table, **kwargs) -> None:
+    """Write the file under a hidden name, ignored by the readers, then rename it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, temporary, compression=COMPRESSION, **kwargs)
+    os.replace(temporary, path)
+
+
+def partition_directory(directory: Path, table_name: str, day: date) -> Path:
+    return directory / table_name / f"date={day.isoformat()}"
+
+
+def write_rows(directory: Path, table_name: str, rows: List[Dict[str, Any]]) -> List[Path]:
+    """Write the rows of a table as one new file per day. Returns the files."""
+    date_column = DATE_COLUMNS[table_name]
+    rows_by_day: Dict[date, List[Dict[str, Any]]] = {}
+    for row in rows:
+        rows_by_day.setdefault(row[date_column].date(), []).append(row)
+
+    paths = []
+    for day, day_rows in sorted(rows_by_day.items()):
+        path = partition_directory(directory, table_name, day) / part_file_name()
+        write_parquet(path, pa.Table.from_pylist(day_rows, schema=SCHEMAS[table_name]))
+        paths.append(path)
+    return paths
+
+
+class ExportWriter:
+    """Buffers the rows of the tables and appends them to the datasets in batches."""
+
+    def __init__(self, directory: Path, batch_rows: int, flush_interval: float):
+        self.directory = directory
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self._rows: Rows = {table_name: [] for table_name in SCHEMAS}
+        self._buffered_since: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def buffered_rows(self) -> int:
+        return sum(len(rows) for rows in self._rows.values())
+
+    def flush_due(self) -> bool:
+        if self._buffered_since is None:
+            return False
+        return (
+            self.buffered_rows() >= self.batch_rows
+            or time.monotonic() - self._buffered_since >= self.flush_interval
+        )
+
+    def add(self, rows: Rows) -> None:
+        """Buffer the rows, and write the buffer if it is full or old enough."""
+        with self._lock:
+            for table_name, table_rows in rows.items():
+                self._rows[table_name] += table_rows
+            if self._buffered_since is None:
+                self._buffered_since = time.monotonic()
+        if self.flush_due():
+            self.flush()
+
+    def flush(self) -> List[Path]:
+        """Write the buffered rows. Returns the new files."""
+        with self._lock:
+            rows, self._rows = self._rows, {table_name: [] for table_name in SCHEMAS}
+            self._buffered_since = None
+
+        paths = []
+        for table_name, table_rows in rows.items():
+            if table_rows:
+                paths += write_rows(self.directory, table_name, table_rows)
+        if paths:
+            logger.debug("Exported %d files to %s", len(paths), self.directory)
+        return paths
+
+
+_writer: Optional[ExportWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_export_writer() -> ExportWriter:
+    """The writer of the process, flushed when the process exits."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ExportWriter(
+                Path(settings.EXPORT_DIRECTORY),
+                batch_rows=settings.EXPORT_BATCH_ROWS,
+                flush_interval=settings.EXPORT_FLUSH_INTERVAL.total_seconds(),
+            )
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def export_node_metrics(node_metrics: NodeMetrics, writer: Optional[ExportWriter] = None) -> None:
+    (writer or get_export_writer()).add(metrics_rows(node_metrics))
+
+
+def export_node_scores(
+    period: Period, node_scores: NodeScores, writer: Optional[ExportWriter] = None
+) -> None:
+    (writer or get_export_writer()).add(
+        scores_rows(period, node_scores, computed_at=datetime.now(timezone.utc))
+    )
+
+
+def partition_files(partition: Path) -> List[Path]:
+    """The files of a day, after removing the files replaced by a compacted
+    file that a compaction interrupted before the end left behind."""
+    paths = sorted(partition.glob("part-*.parquet"))
+    replaced = set()
+    for path in paths:
+        metadata = pq.read_schema(path).metadata or {}
+        replaced.update(json.loads(metadata.get(COMPACTED_FROM_KEY, b"[]")))
+    for name in replaced:
+        (partition / name).unlink(missing_ok=True)
+    return [path for path in paths if path.name not in replaced]
+
+
+def compact_partition(partition: Path, table_name: str) -> Optional[Path]:
+    """Merge the files of a day into one file, sorted by node then date.
+
+    Only the files listed at the start are merged and removed, so rows written
+    during the compaction are merged by the next one. The compacted file names
+    the files it replaces, which are removed again if the compaction stopped
+    before removing them. Returns the compacted file, if any.
+    """
+    paths = partition_files(partition)
+    if len(paths) < 2:
+        return None
+
+    # Files written before a column was added get null values
+    table = ds.dataset(paths, schema=SCHEMAS[table_name], format="parquet").to_table()
+    table = table.sort_by(
+        [("node_id", "ascending"), (DATE_COLUMNS[table_name], "ascending")]
+    ).replace_schema_metadata(
+        {COMPACTED_FROM_KEY: json.dumps([path.name for path in paths]).encode()}
+    )
+    compacted = partition / part_file_name()
+    write_parquet(compacted, table, row_group_size=COMPACTED_ROW_GROUP_SIZE)
+    for path in paths:
+        path.unlink()
+    return compacted
+
+
+def compact_export(directory: Optional[Path] = None, before: Optional[date] = None) -> int:
+    """Compact the days of all the tables before `before`, by default today (UTC).
+
+    Returns the number of days compacted.
+    """
+    directory = Path(directory or settings.EXPORT_DIRECTORY)
+    before = before or datetime.now(timezone.utc).date()
+    compacted = 0
+    for table_name in SCHEMAS:
+        for partition in sorted((directory / table_name).glob("date=*")):
+            day = date.fromisoformat(partition.name[len("date="):])
+            if day < before and compact_partition(partition, table_name):
+                compacted += 1
+    logger.info("Compacted %d days of exported results in %s", compacted, directory)
+    return compacted
+
+
+def load_export(
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    directory: Optional[Path] = None,
+) -> pa.Table:
+    """Read the rows of a table between two dates (UTC), reading only the files of
+    these days and the given columns. Use `.to_pandas()` to get a DataFrame."""
+    directory = Path(directory or settings.EXPORT_DIRECTORY)
+    schema = SCHEMAS[table_name].append(pa.field("date", pa.date32()))
+    dataset = ds.dataset(
+        directory / table_name, schema=schema, format="parquet", partitioning=PARTITIONING
+    )
+
+    date_column = DATE_COLUMNS[table_name]
+    condition = None
+    if from_date:
+        from_date = as_utc(from_date)
+        condition = (ds.field("date") >= from_date.date()) & (
+            ds.field(date_column) >= from_date
+        )
+    if to_date:
+        to_date = as_utc(to_date)
+        before_end = (ds.field("date") <= to_date.date()) & (ds.field(date_column) <= to_date)
+        condition = before_end if condition is None else condition & before_end
+    return dataset.to_table(columns=columns, filter=condition)
@@ -0,0 +1,241 @@
+"""
+Bulk ingestion of the metrics posts into the `posts` table.
+
+The posts of type ALEPH_POST_TYPE_METRICS sent by ALLOWED_METRICS_SENDER are
+read page by page from the API of an Aleph node, or from export files, and
+loaded with COPY in large batches. Posts are deduplicated by item hash, and
+the time of the last loaded post is saved with each batch so that an
+interrupted ingestion resumes where it stopped.
+"""
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+import aiohttp
+import asyncpg
+
+from aleph_scoring.config import settings
+from aleph_scoring.utils import database_connection, read_sql_file
+
+logger = logging.getLogger(__name__)
+
+POST_COLUMNS = ("item_hash", "owner", "type", "ref", "channel", "content", "creation_datetime")
+
+
+class PostRow(NamedTuple):
+    item_hash: str
+    owner: str
+    type: str
+    ref: Optional[str]
+    channel: Optional[str]
+    # JSON document, loaded as jsonb
+    content: str
+    creation_datetime: datetime
+
+
+class IngestStats(NamedTuple):
+    read: int
+    inserted: int
+
+
+def parse_post(item: Dict[str, Any]) -> Optional[PostRow]:
+    """Convert a post of the API, or a POST message, into a row of the `posts` table.
+
+    Returns None for other messages and posts that are not metrics posts.
+    """
+    if "item_hash" not in item or not isinstance(item.get("content"), dict):
+        return None
+
+    content = item["content"]
+    if "content" in content and "address" in content:
+        # POST message: the post is the content of the message
+        owner = content["address"]
+        post_type = content.get("type")
+        ref = content.get("ref")
+        post_content = content["content"]
+        time = content.get("time", item.get("time"))
+    else:
+        owner = item.get("address") or item.get("sender")
+        post_type = item.get("type") or item.get("post_type")
+        ref = item.get("ref")
+        post_content = content
+        time = item.get("time")
+
+    if (
+        owner != settings.ALLOWED_METRICS_SENDER
+        or post_type != settings.ALEPH_POST_TYPE_METRICS
+        or time is None
+    ):
+        return None
+
+    return PostRow(
+        item_hash=item["item_hash"],
+        owner=owner,
+        type=post_type,
+        ref=ref,
+        channel=item.get("channel"),
+        content=json.dumps(post_content),
+        creation_datetime=datetime.fromtimestamp(float(time), tz=timezone.utc),
+    )
+
+
+async def iter_api_posts(
+    api_url: str, since: Optional[datetime], page_size: int
+) -> AsyncIterator[Dict[str, Any]]:
+    """Page through the metrics posts of an Aleph API server, oldest first."""
+    params = {
+        "types": settings.ALEPH_POST_TYPE_METRICS,
+        "addresses": settings.ALLOWED_METRICS_SENDER,
+        "pagination": str(page_size),
+        "sortOrder": "1",
+    }
+    if since:
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        params["startDate"] = str(since.timestamp())
+
+    timeout = aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT * 6)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        page = 1
+        while True:
+            async with session.get(
+                f"{api_url.rstrip('/')}/api/v0/posts.json",
+                params={**params, "page": str(page)},
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+
+            posts = data.get("posts", [])
+            for post in posts:
+                yield post
+
+            total = data.get("pagination_total", 0)
+            if not posts or page * page_size >= total:
+                break
+            page += 1
+
+
+async def iter_file_posts(paths: Iterable[Path]) -> AsyncIterator[Dict[str, Any]]:
+    """Read posts or messages from JSON files (a list or an API page) or JSONL files."""
+    for path in paths:
+        with path.open() as fd:
+            if path.suffix == ".jsonl":
+                for line in fd:
+                    if line.strip():
+                        yield json.loads(line)
+                continue
+
+            document = json.load(fd)
+            if isinstance(document, dict):
+                document = document.get("posts") or document.get("messages") or [document]
+            for item in document:
+                yield item
+
+
+async def get_checkpoint(conn: asyncpg.Connection, source: str) -> Optional[datetime]:
+    return await conn.fetchval(
+        "SELECT last_post_time FROM ingest_checkpoints WHERE source = $1", source
+    )
+
+
+async def copy_posts(conn: asyncpg.Connection, source: str, rows: Sequence[PostRow]) -> int:
+    """Load a batch of posts and move the checkpoint of the source in one
+    transaction. Returns the number of new posts."""
+    async with conn.transaction():
+        await conn.execute(
+            "CREATE TEMPORARY TABLE ingest_posts "
+            "(LIKE posts INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        await conn.copy_records_to_table("ingest_posts", records=rows, columns=POST_COLUMNS)
+        columns = ", ".join(POST_COLUMNS)
+        status = await conn.execute(
+            f"INSERT INTO posts ({columns}) SELECT {columns} FROM ingest_posts "
+            "ON CONFLICT (item_hash) DO NOTHING"
+        )
+        inserted = int(status.split()[-1])
+        await conn.execute(
+            """
+            INSERT INTO ingest_checkpoints (source, last_post_time, posts)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (source) DO UPDATE
+                SET last_post_time = greatest(ingest_checkpoints.last_post_time,
+                                              excluded.last_post_time),
+                    posts          = ingest_checkpoints.posts + excluded.posts,
+                    updated_at     = now()
+            """,
+            source,
+            max(row.creation_datetime for row in rows),
+            inserted,
+        )
+    return inserted
+
+
+async def ingest_posts(
+    conn: asyncpg.Connection,
+    source: str,
+    items: AsyncIterator[Dict[str, Any]],
+    batch_size: int,
+) -> IngestStats:
+    read = 0
+    inserted = 0
+    batch: Dict[str, PostRow] = {}
+
+    async def flush() -> None:
+        nonlocal inserted, batch
+        if batch:
+            inserted += await copy_posts(conn, source, list(batch.values()))
+            logger.info("Loaded %d posts, %d new so far", read, inserted)
+            batch = {}
+
+    async for item in items:
+        row = parse_post(item)
+        if row is None:
+            continue
+        read += 1
+        batch[row.item_hash] = row
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+
+    return IngestStats(read=read, inserted=inserted)
+
+
+async def ingest(
+    api_url: Optional[str] = None,
+    files: Optional[List[Path]] = None,
+    from_date: Optional[datetime] = None,
+    batch_size: Optional[int] = None,
+    page_size: Optional[int] = None,
+) -> IngestStats:
+    """Load the metrics posts of export files, or of an API server starting
+    from `from_date` or the last checkpoint of this server."""
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    page_size = page_size or settings.INGEST_PAGE_SIZE
+
+    conn = await database_connection(settings)
+    try:
+        await conn.execute(read_sql_file("posts_table.sql"))
+        await conn.execute(read_sql_file("ingest_checkpoints_table.sql"))
+
+        if files:
+            return await ingest_posts(conn, "files", iter_file_posts(files), batch_size)
+
+        api_url = api_url or settings.NODE_DATA_HOST
+        since = from_date or await get_checkpoint(conn, api_url)
+        logger.info("Ingesting the metrics posts of %s since %s", api_url, since)
+        return await ingest_posts(
+            conn, api_url, iter_api_posts(api_url, since, page_size), batch_size
+        )
+    finally:
+        await conn.close()
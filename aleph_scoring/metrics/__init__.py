@@ -17,6 +17,7 @@ from typing import (
     List,
     Literal,
     Optional,
+    TYPE_CHECKING,
     Sequence,
     Tuple,
     TypeVar,
@@ -24,19 +25,39 @@ from typing import (
     NewType,
 )
 from urllib.parse import urlparse
-from icmplib import async_ping
 import aiohttp
 import async_timeout
-import pyasn
-from aleph.sdk import AlephClient
 from pydantic import BaseModel, validator
 from urllib3.util import Url, parse_url
 
 from aleph_scoring.config import settings
-from aleph_scoring.metrics.asn import get_asn_database
+from aleph_scoring.openmetrics import (
+    ASN_LOOKUPS,
+    PROBE_FAILURES,
+    PROBE_LATENCY,
+    PROBES_IN_FLIGHT,
+    ROUND_DURATION,
+    watch_event_loop_lag,
+)
+from aleph_scoring.profiling import phase
+from aleph_scoring.tracing import (
+    SpanKind,
+    StatusCode,
+    current_span,
+    export_spans,
+    new_round_id,
+    start_round,
+    start_span,
+    trace_configs,
+)
 from aleph_scoring.types.vm_type import VmType
 from .models import AlephNodeMetrics, CcnMetrics, CrnMetrics, NodeMetrics
 
+# pyasn, icmplib and the Aleph SDK are imported by the functions that use them,
+# so that importing the models of this package does not load the probe stack.
+if TYPE_CHECKING:
+    import pyasn
+
 logger = logging.getLogger(__name__)
 
 # Global variable used to aggregate the metrics over time
@@ -59,6 +80,8 @@ CRN_DIAGNOSTIC_VM_HASH = (
 CRN_DIAGNOSTIC_VM_PATH = "{url}vm/" + CRN_DIAGNOSTIC_VM_HASH
 IP4_SERVICE_URL = "https://v4.ident.me/"
 
+ADDRESS_FAMILIES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+
 
 TimeoutGenerator = NewType("TimeoutGenerator", Callable[[], aiohttp.ClientTimeout])
 
@@ -124,6 +147,10 @@ def get_compute_resource_node_urls(
             )
 
 
+def address_family(session: aiohttp.ClientSession) -> str:
+    return ADDRESS_FAMILIES.get(getattr(session.connector, "family", socket.AF_UNSPEC), "any")
+
+
 async def measure_http_latency(
     session: aiohttp.ClientSession,
     url: str,
@@ -131,70 +158,120 @@ async def measure_http_latency(
     return_output: bool = False,
     return_json: bool = True,
     expected_status: int = 200,
+    node_type: str = "node",
+    probe: str = "http",
 ) -> Tuple[Optional[float], Optional[Any]]:
-    try:
-        async with async_timeout.timeout(
-            timeout_seconds + timeout_seconds * 0.3 * random()
-        ):
-            start = time.time()
-            async with session.get(url) as resp:
-                if resp.status != expected_status:
-                    raise aiohttp.ClientResponseError(
-                        resp.request_info,
-                        resp.history,
-                        status=resp.status,
-                        message="Wrong status code",
-                    )
-                if return_output:
-                    if return_json:
-                        output = await resp.json()
+    PROBES_IN_FLIGHT.inc()
+    with start_span(
+        probe,
+        kind=SpanKind.CLIENT,
+        attributes={"http.url": url, "net.family": address_family(session)},
+    ) as span:
+        try:
+            async with async_timeout.timeout(
+                timeout_seconds + timeout_seconds * 0.3 * random()
+            ):
+                start = time.time()
+                async with session.get(url) as resp:
+                    span.set_attribute("http.status_code", resp.status)
+                    if resp.status != expected_status:
+                        raise aiohttp.ClientResponseError(
+                            resp.request_info,
+                            resp.history,
+                            status=resp.status,
+                            message="Wrong status code",
+                        )
+                    if return_output:
+                        if return_json:
+                            output = await resp.json()
+                        else:
+                            output = await resp.text()
+                        end = time.time()
+                        logger.debug(f"Success when fetching {url}")
+                        PROBE_LATENCY.observe(end - start, node_type, probe)
+                        span.set_status(StatusCode.OK)
+                        return end - start, output
                     else:
-                        output = await resp.text()
-                    end = time.time()
-                    logger.debug(f"Success when fetching {url}")
-                    return end - start, output
-                else:
-                    await resp.release()
-                    end = time.time()
-                    logger.debug(f"Success when fetching {url}")
-                    return end - start, None
-    except aiohttp.ClientResponseError:
-        logger.debug(f"Error when fetching {url}")
-        return None, None
-    except aiohttp.ClientConnectorError:
-        logger.debug(f"Error when fetching {url}")
-        return None, None
-    except asyncio.TimeoutError:
-        logger.debug(f"Timeout error when fetching {url}")
-        return None, None
+                        await resp.release()
+                        end = time.time()
+                        logger.debug(f"Success when fetching {url}")
+                        PROBE_LATENCY.observe(end - start, node_type, probe)
+                        span.set_status(StatusCode.OK)
+                        return end - start, None
+        except aiohttp.ClientResponseError as error:
+            logger.debug(f"Error when fetching {url}")
+            PROBE_FAILURES.inc(node_type, probe, "error")
+            span.set_status(StatusCode.ERROR, f"error: {error.status} {error.message}")
+            return None, None
+        except aiohttp.ClientConnectorError as error:
+            logger.debug(f"Error when fetching {url}")
+            PROBE_FAILURES.inc(node_type, probe, "connect")
+            span.set_status(StatusCode.ERROR, f"connect: {error}")
+            return None, None
+        except asyncio.TimeoutError:
+            logger.debug(f"Timeout error when fetching {url}")
+            PROBE_FAILURES.inc(node_type, probe, "timeout")
+            span.set_status(StatusCode.ERROR, "timeout")
+            return None, None
+        finally:
+            PROBES_IN_FLIGHT.dec()
 
 
 async def get_crn_version(
-    session: aiohttp.ClientSession, node_url: str
+    session: aiohttp.ClientSession,
+    node_url: str,
+    probe: str = "version",
+    attempt: int = 0,
 ) -> Optional[str]:
     # Retrieve the CRN version from header `server`.
-    try:
-        async with async_timeout.timeout(
-            settings.HTTP_REQUEST_TIMEOUT
-            + settings.HTTP_REQUEST_TIMEOUT * 0.3 * random(),
-        ):
-            async with session.get(node_url) as resp:
-                resp.raise_for_status()
-                if "Server" not in resp.headers:
-                    return None
-                for server in resp.headers.getall("Server"):
-                    version: List[str] = re.findall(r"^aleph-vm/(.*)$", server)
-                    if version and version[0]:
-                        return version[0]
-                else:
-                    return None
-
-    except (aiohttp.ClientResponseError, aiohttp.ClientConnectorError):
-        logger.debug(f"Error when fetching version from {node_url}")
-        return None
-    except asyncio.TimeoutError:
-        logger.debug(f"Timeout error when fetching version from  {node_url}")
-        return None
+    PROBES_IN_FLIGHT.inc()
+    with start_span(
+        probe,
+        kind=SpanKind.CLIENT,
+        attributes={
+            "http.url": node_url,
+            "net.family": address_family(session),
+            "attempt": attempt,
+        },
+    ) as span:
+        try:
+            async with async_timeout.timeout(
+                settings.HTTP_REQUEST_TIMEOUT
+                + settings.HTTP_REQUEST_TIMEOUT * 0.3 * random(),
+            ):
+                start = time.time()
+                async with session.get(node_url) as resp:
+                    span.set_attribute("http.status_code", resp.status)
+                    resp.raise_for_status()
+                    PROBE_LATENCY.observe(time.time() - start, "crn", probe)
+                    span.set_status(StatusCode.OK)
+                    if "Server" not in resp.headers:
+                        return None
+                    for server in resp.headers.getall("Server"):
+                        version: List[str] = re.findall(r"^aleph-vm/(.*)$", server)
+                        if version and version[0]:
+                            span.set_attribute("version", version[0])
+                            return version[0]
+                    else:
+                        return None
+
+        except aiohttp.ClientResponseError as error:
+            logger.debug(f"Error when fetching version from {node_url}")
+            PROBE_FAILURES.inc("crn", probe, "error")
+            span.set_status(StatusCode.ERROR, f"error: {error.status} {error.message}")
+            return None
+        except aiohttp.ClientConnectorError as error:
+            logger.debug(f"Error when fetching version from {node_url}")
+            PROBE_FAILURES.inc("crn", probe, "connect")
+            span.set_status(StatusCode.ERROR, f"connect: {error}")
+            return None
+        except asyncio.TimeoutError:
+            logger.debug(f"Timeout error when fetching version from  {node_url}")
+            PROBE_FAILURES.inc("crn", probe, "timeout")
+            span.set_status(StatusCode.ERROR, "timeout")
+            return None
+        finally:
+            PROBES_IN_FLIGHT.dec()
 
 
 def get_url_domain(url: str) -> str:
@@ -235,6 +312,8 @@ def get_executable_ipv6(
 async def ping(
     ip_address: Union[IPv4Address, IPv6Address], count: int
 ) -> Optional[float]:
+    from icmplib import async_ping
+
     result = await async_ping(
         address=str(ip_address), count=count, timeout=2, privileged=False
     )
@@ -255,7 +334,24 @@ async def ping_vm(crn_url: str, vm_hash: str) -> Optional[float]:
         crn_ipv6_range=crn_ipv6_range, vm_type=VmType.microvm, item_hash=vm_hash
     )
 
-    average_response_time = await ping(vm_ipv6, count=1)
+    PROBES_IN_FLIGHT.inc()
+    with start_span(
+        "vm_ping",
+        kind=SpanKind.CLIENT,
+        attributes={"net.peer.ip": str(vm_ipv6), "net.family": "ipv6"},
+    ) as span:
+        try:
+            average_response_time = await ping(vm_ipv6, count=1)
+        finally:
+            PROBES_IN_FLIGHT.dec()
+        if average_response_time is None:
+            PROBE_FAILURES.inc("crn", "vm_ping", "timeout")
+            span.set_status(StatusCode.ERROR, "timeout")
+        else:
+            # icmplib reports the round-trip times in milliseconds
+            PROBE_LATENCY.observe(average_response_time / 1000, "crn", "vm_ping")
+            span.set_attribute("rtt_ms", average_response_time)
+            span.set_status(StatusCode.OK)
     if average_response_time:
         logger.debug(
             "VM %s is reachable over IPv6, pinged in %.2f seconds",
@@ -267,17 +363,21 @@ async def ping_vm(crn_url: str, vm_hash: str) -> Optional[float]:
 
 
 def lookup_asn(
-    asn_db: pyasn.pyasn, url: str
+    asn_db: "pyasn.pyasn", url: str
 ) -> Union[Tuple[str, str], Tuple[None, None]]:
     ip_addr = get_ipv4(url)
     if ip_addr is None:
         logger.debug("Could not determine IP address for %s", url)
+        ASN_LOOKUPS.inc("no_address")
         return None, None
     asn = asn_db.lookup(ip_addr)[0]
     if asn is None:
         logger.debug("ASN lookup for (%s) %s did not return a result", ip_addr, url)
+        ASN_LOOKUPS.inc("not_found")
         return None, None
 
+    ASN_LOOKUPS.inc("found")
+
     return asn, asn_db.get_as_name(asn)
 
 
@@ -303,10 +403,12 @@ class CcnApiMetricsResponse(BaseModel):
 
 
 async def get_ccn_metrics(
-    timeout_generator: TimeoutGenerator, asn_db: pyasn.pyasn, node_info: NodeInfo
+    timeout_generator: TimeoutGenerator, asn_db: "pyasn.pyasn", node_info: NodeInfo
 ) -> CcnMetrics:
     # Avoid doing all the calls at the same time
-    await asyncio.sleep(random() * 30)
+    delay = random() * 30
+    await asyncio.sleep(delay)
+    record_scheduler_wait(delay)
 
     url = node_info.url.url
     measured_at = datetime.utcnow()
@@ -322,9 +424,15 @@ async def get_ccn_metrics(
             limit=1000,
             limit_per_host=20,
         ),
+        trace_configs=trace_configs(),
     ) as session_ipv4:
         base_latency_ipv4 = (
-            await measure_http_latency(session_ipv4, f"{url}api/v0/info/public.json")
+            await measure_http_latency(
+                session_ipv4,
+                f"{url}api/v0/info/public.json",
+                node_type="ccn",
+                probe="base_latency_ipv4",
+            )
         )[0]
 
     # Fetch most metrics using either IPv4 or IPv6
@@ -336,24 +444,37 @@ async def get_ccn_metrics(
             limit=1000,
             limit_per_host=20,
         ),
+        trace_configs=trace_configs(),
     ) as session:
         # Fetch base latency again in order to pre-open the session
-        _ = (await measure_http_latency(session, f"{url}api/v0/info/public.json"))[0]
+        _ = (
+            await measure_http_latency(
+                session, f"{url}api/v0/info/public.json", node_type="ccn", probe="warmup"
+            )
+        )[0]
         metrics_latency = (
             await measure_http_latency(
-                session, f"{url}metrics.json", settings.HTTP_REQUEST_TIMEOUT
+                session,
+                f"{url}metrics.json",
+                settings.HTTP_REQUEST_TIMEOUT,
+                node_type="ccn",
+                probe="metrics_latency",
             )
         )[0]
         aggregate_latency = (
             await measure_http_latency(
                 session,
                 "".join(CCN_AGGREGATE_PATH).format(url=url),
+                node_type="ccn",
+                probe="aggregate_latency",
             )
         )[0]
         file_download_latency = (
             await measure_http_latency(
                 session,
                 "".join(CCN_FILE_DOWNLOAD_PATH).format(url=url),
+                node_type="ccn",
+                probe="file_download_latency",
             )
         )[0]
         time, json_text = await measure_http_latency(
@@ -361,6 +482,8 @@ async def get_ccn_metrics(
             f"{url}metrics.json",
             settings.HTTP_REQUEST_TIMEOUT,
             return_output=True,
+            node_type="ccn",
+            probe="metrics",
         )
 
         if json_text is not None:
@@ -408,10 +531,12 @@ async def get_ccn_metrics(
 
 
 async def get_crn_metrics(
-    timeout_generator: TimeoutGenerator, asn_db: pyasn.pyasn, node_info: NodeInfo
+    timeout_generator: TimeoutGenerator, asn_db: "pyasn.pyasn", node_info: NodeInfo
 ) -> CrnMetrics:
     # Avoid doing all the calls at the same time
-    await asyncio.sleep(random() * 30)
+    delay = random() * 30
+    await asyncio.sleep(delay)
+    record_scheduler_wait(delay)
 
     url = node_info.url.url
     measured_at = datetime.utcnow()
@@ -419,11 +544,16 @@ async def get_crn_metrics(
     asn, as_name = lookup_asn(asn_db, url)
 
     # Get the version over IPv4 or IPv6
-    async with aiohttp.ClientSession(timeout=timeout_generator()) as session_any_ip:
+    async with aiohttp.ClientSession(
+        timeout=timeout_generator(), trace_configs=trace_configs()
+    ) as session_any_ip:
         for attempt in range(3):
-            version = await get_crn_version(session=session_any_ip, node_url=url)
+            version = await get_crn_version(
+                session=session_any_ip, node_url=url, attempt=attempt
+            )
             if version:
                 break
+    current_span().set_attribute("version.attempts", attempt + 1)
 
     async with aiohttp.ClientSession(
         timeout=timeout_generator(),
@@ -433,15 +563,18 @@ async def get_crn_metrics(
             limit=1000,
             limit_per_host=20,
         ),
+        trace_configs=trace_configs(),
     ) as session:
         # Warmup the session
-        _ = await get_crn_version(session=session, node_url=url)
+        _ = await get_crn_version(session=session, node_url=url, probe="warmup")
 
         base_latency = (
             await measure_http_latency(
                 session,
                 f"{url}about/login",
                 expected_status=401,
+                node_type="crn",
+                probe="base_latency",
             )
         )[0]
 
@@ -450,6 +583,8 @@ async def get_crn_metrics(
                 session,
                 "".join(CRN_DIAGNOSTIC_VM_PATH).format(url=url),
                 timeout_seconds=10,
+                node_type="crn",
+                probe="diagnostic_vm_latency",
             )
         )[0]
 
@@ -466,6 +601,8 @@ async def get_crn_metrics(
                 session,
                 f"{url}status/check/fastapi",
                 timeout_seconds=20,
+                node_type="crn",
+                probe="full_check_latency",
             )
         )[0]
 
@@ -477,15 +614,18 @@ async def get_crn_metrics(
             limit=1000,
             limit_per_host=20,
         ),
+        trace_configs=trace_configs(),
     ) as session_ipv4:
         # Warmup the session
-        _ = await get_crn_version(session=session_ipv4, node_url=url)
+        _ = await get_crn_version(session=session_ipv4, node_url=url, probe="warmup")
 
         base_latency_ipv4 = (
             await measure_http_latency(
                 session_ipv4,
                 f"{url}about/login",
                 expected_status=401,
+                node_type="crn",
+                probe="base_latency_ipv4",
             )
         )[0]
 
@@ -508,16 +648,46 @@ async def get_crn_metrics(
 M = TypeVar("M", bound=AlephNodeMetrics)
 
 
+def record_scheduler_wait(delay: float) -> None:
+    """Record on the span of the node how long its probes waited to start."""
+    span = current_span()
+    span.set_attribute("scheduler.delay_seconds", delay)
+    span.set_attribute("scheduler.wait_seconds", span.elapsed())
+
+
+async def traced_node_metrics(
+    node_type: str,
+    metrics_function: Callable[[TimeoutGenerator, "pyasn.pyasn", NodeInfo], Awaitable[M]],
+    timeout: TimeoutGenerator,
+    asn_db: "pyasn.pyasn",
+    node_info: NodeInfo,
+) -> M:
+    with start_span(
+        node_type, attributes={"node.id": node_info.hash, "node.url": node_info.url.url}
+    ) as span:
+        metrics = await metrics_function(timeout, asn_db, node_info)
+        span.set_attribute("node.asn", metrics.asn)
+        span.set_attribute("node.version", metrics.version)
+        span.set_status(StatusCode.OK)
+        return metrics
+
+
 async def collect_node_metrics(
     node_infos: Iterable[NodeInfo],
-    metrics_function: Callable[[TimeoutGenerator, pyasn.pyasn, NodeInfo], Awaitable[M]],
+    metrics_function: Callable[[TimeoutGenerator, "pyasn.pyasn", NodeInfo], Awaitable[M]],
+    node_type: str = "node",
 ) -> Sequence[Union[M, BaseException]]:
+    from aleph_scoring.metrics.asn import get_asn_database
+
     asn_db = get_asn_database()
     timeout = timeout_generator(
         total=60.0, connect=10.0, sock_connect=10.0, sock_read=60.0
     )
     return await asyncio.gather(
-        *[metrics_function(timeout, asn_db, node_info) for node_info in node_infos]
+        *[
+            traced_node_metrics(node_type, metrics_function, timeout, asn_db, node_info)
+            for node_info in node_infos
+        ]
     )
 
 
@@ -525,7 +695,7 @@ async def collect_all_ccn_metrics(node_data: Dict[str, Any]) -> Sequence[CcnMetr
     node_infos = list(get_api_node_urls(node_data))
     shuffle(node_infos)  # Avoid artifacts from the order in the list
     return await collect_node_metrics(
-        node_infos=node_infos, metrics_function=get_ccn_metrics
+        node_infos=node_infos, metrics_function=get_ccn_metrics, node_type="ccn"
     )
 
 
@@ -533,11 +703,13 @@ async def collect_all_crn_metrics(node_data: Dict[str, Any]) -> Sequence[CrnMetr
     node_infos = list(get_compute_resource_node_urls(node_data))
     shuffle(node_infos)  # Avoid artifacts from the order in the list
     return await collect_node_metrics(
-        node_infos=node_infos, metrics_function=get_crn_metrics
+        node_infos=node_infos, metrics_function=get_crn_metrics, node_type="crn"
     )
 
 
 async def get_aleph_nodes() -> Dict:
+    from aleph.sdk import AlephClient
+
     async with AlephClient(api_server=settings.NODE_DATA_HOST) as client:
         return await client.fetch_aggregate(
             address=settings.NODE_DATA_ADDR,
@@ -546,7 +718,7 @@ async def get_aleph_nodes() -> Dict:
         )
 
 
-async def collect_server_metadata(asn_db: pyasn.pyasn) -> Tuple[str, int, str]:
+async def collect_server_metadata(asn_db: "pyasn.pyasn") -> Tuple[str, int, str]:
     def is_valid_ip4(ip: str) -> bool:
         return bool(re.match(r"\d+\.\d+\.\d+\.\d+", ip))
 
@@ -570,19 +742,28 @@ async def collect_server_metadata(asn_db: pyasn.pyasn) -> Tuple[str, int, str]:
     return ip_address, asn, as_name
 
 
-async def collect_all_node_metrics() -> NodeMetrics:
+async def collect_all_node_metrics(round_id: Optional[str] = None) -> NodeMetrics:
+    from aleph_scoring.metrics.asn import get_asn_database
+
     # Scoring server info
-    ip_address, asn, as_name = await collect_server_metadata(get_asn_database())
+    with phase("asn_load"):
+        asn_db = get_asn_database()
+    with phase("server_metadata"):
+        ip_address, asn, as_name = await collect_server_metadata(asn_db)
 
     # Aleph node metrics
-    aleph_nodes = await get_aleph_nodes()
+    with phase("node_list_fetch"):
+        aleph_nodes = await get_aleph_nodes()
     logger.debug("Fetched node data")
-    ccn_metrics = await collect_all_ccn_metrics(aleph_nodes)
+    with phase("ccn_round"):
+        ccn_metrics = await collect_all_ccn_metrics(aleph_nodes)
     logger.debug("Fetched CCN metrics")
-    crn_metrics = await collect_all_crn_metrics(aleph_nodes)
+    with phase("crn_round"):
+        crn_metrics = await collect_all_crn_metrics(aleph_nodes)
     logger.debug("Fetched CRN metrics")
 
     return NodeMetrics(
+        round_id=round_id,
         server=ip_address,
         server_asn=asn,
         server_as_name=as_name,
@@ -592,8 +773,14 @@ async def collect_all_node_metrics() -> NodeMetrics:
 
 
 async def measure_node_performance() -> NodeMetrics:
-    logger.debug("Measuring node performance")
-    node_metrics = await collect_all_node_metrics()
+    round_id = new_round_id()
+    logger.debug("Measuring node performance, round %s", round_id)
+    try:
+        async with watch_event_loop_lag():
+            with ROUND_DURATION.time(), start_round(round_id):
+                node_metrics = await collect_all_node_metrics(round_id)
+    finally:
+        await export_spans()
     return node_metrics
 
 
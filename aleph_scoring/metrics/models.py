@@ -31,6 +31,8 @@ class CrnMetrics(AlephNodeMetrics):
 
 
 class NodeMetrics(BaseModel):
+    # ID of the measurement round, and of its trace, see aleph_scoring/tracing.py
+    round_id: Optional[str] = None
     server: str
     server_asn: int
     server_as_name: str
@@ -0,0 +1,361 @@
+"""
+Internal metrics of the measurements, the scoring and the publication, served
+in the OpenMetrics text format for Prometheus.
+
+The metrics are updated whether or not they are served: an update is a dict
+operation under an uncontended lock. The HTTP endpoint runs in a thread of its
+own when OPENMETRICS_PORT is set, so that it answers while the commands run
+their event loops or block.
+"""
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aleph_scoring.config import settings
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# Wake-up interval of the event loop lag monitor
+LAG_MONITOR_INTERVAL = 0.25
+
+LabelValues = Tuple[str, ...]
+
+REGISTRY: List["Metric"] = []
+_watched_loops: set = set()
+_server_port: Optional[int] = None
+_server_lock = threading.Lock()
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value))
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    type_name = "unknown"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        registry: Optional[List["Metric"]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).append(self)
+
+    def check_labels(self, label_values: LabelValues) -> None:
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} expects the labels {self.labels}")
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """(suffix, labels, value) of each sample."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# TYPE {self.name} {self.type_name}",
+            f"# HELP {self.name} {self.documentation}",
+        ]
+        for suffix, labels, value in self.samples():
+            label_text = ",".join(
+                f'{name}="{escape_label_value(label)}"' for name, label in labels.items()
+            )
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append(f"{self.name}{suffix}{label_text} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        registry: Optional[List[Metric]] = None,
+    ):
+        super().__init__(name, documentation, labels, registry)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self.check_labels(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield "_total", dict(zip(self.labels, label_values)), value
+
+
+class Gauge(Metric):
+    """A value that goes up and down. With `function`, the value is computed
+    when the metrics are collected."""
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        function: Optional[Callable[[], Optional[float]]] = None,
+        registry: Optional[List[Metric]] = None,
+    ):
+        super().__init__(name, documentation, labels, registry)
+        self.function = function
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self.check_labels(label_values)
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self.check_labels(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                logger.exception("Could not collect %s", self.name)
+                value = None
+            if value is not None:
+                yield "", {}, value
+            return
+
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield "", dict(zip(self.labels, label_values)), value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+        registry: Optional[List[Metric]] = None,
+    ):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Count of each bucket, not cumulative, then sum and count
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        self.check_labels(label_values)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """Observe the duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values: str) -> float:
+        values = self._values.get(label_values)
+        return values[-1] if values else 0.0
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        for label_values, counts in values:
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+            yield "_count", labels, counts[-1]
+            yield "_sum", labels, counts[-2]
+
+
+def render_metrics(registry: Optional[List[Metric]] = None) -> str:
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines += metric.render()
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def asn_database_age() -> Optional[float]:
+    asn_db_file = settings.ASN_DB_DIRECTORY / "asn_db"
+    try:
+        return time.time() - asn_db_file.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+ROUND_DURATION = Histogram(
+    "aleph_scoring_measurement_round_duration_seconds",
+    "Duration of the measurement rounds.",
+    buckets=(15, 30, 45, 60, 90, 120, 180, 300, 600),
+)
+PROBE_LATENCY = Histogram(
+    "aleph_scoring_probe_latency_seconds",
+    "Latency of the successful probes.",
+    labels=("node_type", "probe"),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30),
+)
+PROBE_FAILURES = Counter(
+    "aleph_scoring_probe_failures",
+    "Failed probes, by reason: timeout, connect or error.",
+    labels=("node_type", "probe", "reason"),
+)
+PROBES_IN_FLIGHT = Gauge("aleph_scoring_probes_in_flight", "Probes waiting for an answer.")
+EVENT_LOOP_LAG = Histogram(
+    "aleph_scoring_event_loop_lag_seconds",
+    "Delay of the event loop callbacks.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+ASN_DATABASE_AGE = Gauge(
+    "aleph_scoring_asn_database_age_seconds",
+    "Age of the ASN database file.",
+    function=asn_database_age,
+)
+ASN_LOOKUPS = Counter(
+    "aleph_scoring_asn_lookups",
+    "ASN lookups of the nodes, by result: found, not_found or no_address.",
+    labels=("result",),
+)
+QUERY_DURATION = Histogram(
+    "aleph_scoring_query_duration_seconds",
+    "Duration of the scoring queries, including the transfer of their rows.",
+    labels=("query",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+PUBLICATIONS = Counter(
+    "aleph_scoring_publications",
+    "Publications of outbox entries, by kind and outcome: published, failed or abandoned "
+    "after OUTBOX_MAX_ATTEMPTS.",
+    labels=("kind", "outcome"),
+)
+
+
+@asynccontextmanager
+async def watch_event_loop_lag(interval: float = LAG_MONITOR_INTERVAL):
+    """Measure the lag of the running event loop while in the block, if the
+    metrics are served. Nested blocks share the monitor of the outer one."""
+    loop = asyncio.get_running_loop()
+    if settings.OPENMETRICS_PORT is None or loop in _watched_loops:
+        yield
+        return
+
+    async def monitor():
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
+
+    _watched_loops.add(loop)
+    task = loop.create_task(monitor())
+    try:
+        yield
+    finally:
+        task.cancel()
+        _watched_loops.discard(loop)
+
+
+async def metrics_handler(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(
+        body=render_metrics().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[int]:
+    """Serve the metrics on /metrics in a background thread, once per process.
+
+    Defaults to OPENMETRICS_PORT and OPENMETRICS_HOST, and does nothing when
+    no port is set. Returns the port the server listens on.
+    """
+    port = settings.OPENMETRICS_PORT if port is None else port
+    host = host or settings.OPENMETRICS_HOST
+    if port is None:
+        return None
+
+    # Imported here: the modules updating the metrics do not need aiohttp.web
+    from aiohttp import web
+
+    with _server_lock:
+        if _server_port is not None:
+            return _server_port
+
+        started = threading.Event()
+        errors: List[BaseException] = []
+
+        async def serve():
+            global _server_port
+            app = web.Application()
+            app.router.add_get("/metrics", metrics_handler)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            try:
+                await site.start()
+            except OSError as error:
+                errors.append(error)
+                started.set()
+                return
+            _server_port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(
+            target=lambda: asyncio.run(serve()), name="openmetrics", daemon=True
+        ).start()
+        started.wait()
+
+    if errors:
+        logger.error("Could not serve the metrics on %s:%s: %s", host, port, errors[0])
+        return None
+    logger.info("Serving the metrics on http://%s:%d/metrics", host, _server_port)
+    return _server_port
@@ -0,0 +1,361 @@
+"""
+Durable outbox of the results to publish on Aleph.
+
+The metrics of a round and the scores of a period are written to a SQLite
+database first, then published by a publisher that drains it in order, a
+batch at a time, with one client session per batch. A failed publication is
+retried with an exponential back-off. The scores that follow a failed scores
+entry wait for it, so that the chains of delta posts stay in order. After
+OUTBOX_MAX_ATTEMPTS, an entry is marked as failed and kept, without blocking
+the entries that follow it.
+Measurements and scoring therefore never wait for the API server, and results
+are not lost when it is down or the process restarts.
+
+Entries are claimed for a lease before being published, so that several
+processes can drain the same outbox without publishing an entry twice.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from enum import Enum
+from pathlib import Path
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from aleph.sdk.client import AuthenticatedAlephClient
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics.models import NodeMetrics
+from aleph_scoring.openmetrics import PUBLICATIONS
+from aleph_scoring.publication import aleph_client, metrics_post_content, publish_scores
+from aleph_scoring.scoring.models import NodeScores
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox
+(
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind            TEXT    NOT NULL,
+    payload         TEXT    NOT NULL,
+    created_at      REAL    NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL    NOT NULL,
+    last_error      TEXT,
+    published_at    REAL,
+    item_hash       TEXT,
+    failed_at       REAL
+);
+CREATE INDEX IF NOT EXISTS ix_outbox_pending ON outbox (published_at, next_attempt_at);
+"""
+# Entries are claimed for this long before being published
+CLAIM_LEASE = 300.0
+
+_publisher_lock = threading.Lock()
+_background_publisher: Optional[threading.Thread] = None
+
+
+class OutboxKind(str, Enum):
+    METRICS = "metrics"
+    SCORES = "scores"
+
+
+# Kinds published in order: an entry waits for the older entries of its kind
+ORDERED_KINDS = (OutboxKind.SCORES,)
+
+
+class OutboxEntry(NamedTuple):
+    id: int
+    kind: OutboxKind
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class Outbox:
+    """SQLite table of the results to publish."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self.connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(OUTBOX_SCHEMA)
+            # Outboxes created before the failed state
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "failed_at" not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN failed_at REAL")
+
+    def connect(self) -> sqlite3.Connection:
+        # Autocommit mode, the transactions are explicit
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def add(self, kind: OutboxKind, payload: Dict[str, Any]) -> int:
+        now = time.time()
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (kind, payload, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?)",
+                (kind.value, json.dumps(payload), now, now),
+            )
+            assert cursor.lastrowid is not None, "The entry was not inserted"
+            return cursor.lastrowid
+
+    def claim(self, limit: int, lease: float = CLAIM_LEASE) -> List[OutboxEntry]:
+        """Claim the oldest entries that are due, in order.
+
+        The entries are not due again for `lease` seconds, unless they are
+        published or fail before. Entries of an ordered kind are not due while
+        an older entry of the same kind waits for a retry or is claimed. Failed
+        entries are never due.
+        """
+        now = time.time()
+        ordered_kinds = ", ".join(f"'{kind.value}'" for kind in ORDERED_KINDS)
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"""
+                SELECT id, kind, payload, attempts
+                FROM outbox
+                WHERE published_at IS NULL
+                  AND failed_at IS NULL
+                  AND next_attempt_at <= ?
+                  AND NOT (kind IN ({ordered_kinds}) AND EXISTS(
+                    SELECT 1
+                    FROM outbox older
+                    WHERE older.kind = outbox.kind
+                      AND older.id < outbox.id
+                      AND older.published_at IS NULL
+                      AND older.failed_at IS NULL
+                      AND older.next_attempt_at > ?))
+                ORDER BY id
+                LIMIT ?
+                """,
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(now + lease, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        return [
+            OutboxEntry(
+                id=id_, kind=OutboxKind(kind), payload=json.loads(payload), attempts=attempts
+            )
+            for id_, kind, payload, attempts in rows
+        ]
+
+    def release(self, entry_ids: List[int]) -> None:
+        """Make claimed entries due again, without counting an attempt."""
+        with closing(self.connect()) as conn:
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(time.time(), entry_id) for entry_id in entry_ids],
+            )
+
+    def mark_published(self, entry_id: int, item_hash: Optional[str]) -> None:
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET published_at = ?, item_hash = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (time.time(), item_hash, entry_id),
+            )
+
+    def mark_failed(self, entry_id: int, error: str, retry_at: Optional[float]) -> None:
+        """Record a failed attempt. The entry is retried at `retry_at`, or
+        marked as failed and never retried if it is None."""
+        with closing(self.connect()) as conn:
+            if retry_at is None:
+                conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, last_error = ?, failed_at = ? "
+                    "WHERE id = ?",
+                    (error, time.time(), entry_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, last_error = ?, "
+                    "next_attempt_at = ? WHERE id = ?",
+                    (error, retry_at, entry_id),
+                )
+
+    def pending(self) -> int:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT count(*) FROM outbox WHERE published_at IS NULL AND failed_at IS NULL"
+            ).fetchone()[0]
+
+    def failed(self) -> int:
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "SELECT count(*) FROM outbox WHERE failed_at IS NOT NULL"
+            ).fetchone()[0]
+
+    def purge(self, published_before: float) -> int:
+        """Remove the entries published before the time. Returns their number."""
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                "DELETE FROM outbox WHERE published_at < ?", (published_before,)
+            ).rowcount
+
+
+def get_outbox() -> Outbox:
+    return Outbox(Path(settings.OUTBOX_PATH))
+
+
+def enqueue_metrics(node_metrics: NodeMetrics, outbox: Optional[Outbox] = None) -> int:
+    return (outbox or get_outbox()).add(OutboxKind.METRICS, metrics_post_content(node_metrics))
+
+
+def enqueue_scores(
+    period: Period, node_scores: NodeScores, outbox: Optional[Outbox] = None
+) -> int:
+    return (outbox or get_outbox()).add(
+        OutboxKind.SCORES,
+        {
+            "period": json.loads(period.json()),
+            "scores": json.loads(node_scores.json()),
+        },
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before the next attempt after `attempts` failures."""
+    delay = settings.OUTBOX_RETRY_DELAY.total_seconds() * 2 ** (attempts - 1)
+    return min(delay, settings.OUTBOX_MAX_RETRY_DELAY.total_seconds())
+
+
+async def publish_entry(client: AuthenticatedAlephClient, entry: OutboxEntry) -> Optional[str]:
+    """Publish an entry. Returns the item hash of the post, if one was made."""
+    if entry.kind == OutboxKind.METRICS:
+        message, status = await client.create_post(
+            post_content=entry.payload,
+            post_type=settings.ALEPH_POST_TYPE_METRICS,
+            channel=settings.ALEPH_POST_TYPE_CHANNEL,
+        )
+        logger.info("Published metrics on Aleph with status %s: %s", status, message.item_hash)
+        return message.item_hash
+
+    result = await publish_scores(
+        client,
+        NodeScores.parse_obj(entry.payload["scores"]),
+        Period.parse_obj(entry.payload["period"]),
+    )
+    if result is None:
+        return None
+    message, status = result
+    logger.info("Published scores on Aleph with status %s: %s", status, message.item_hash)
+    return message.item_hash
+
+
+async def drain_outbox(
+    outbox: Outbox,
+    client_factory: Callable[[], AsyncContextManager] = aleph_client,
+    publish: Callable[[Any, OutboxEntry], Awaitable[Optional[str]]] = publish_entry,
+    batch_size: Optional[int] = None,
+) -> int:
+    """Publish a batch of due entries. Returns the number of published entries.
+
+    After the failure of an entry of an ordered kind, the following entries
+    of this kind wait for its retry, unless it was the last attempt.
+    """
+    entries = outbox.claim(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not entries:
+        return 0
+
+    published = 0
+    failed_kinds = set()
+    async with client_factory() as client:
+        for entry in entries:
+            if entry.kind in failed_kinds and entry.kind in ORDERED_KINDS:
+                outbox.release([entry.id])
+                continue
+            try:
+                item_hash = await publish(client, entry)
+            except Exception as error:
+                if entry.attempts + 1 >= settings.OUTBOX_MAX_ATTEMPTS:
+                    logger.error(
+                        "Could not publish the %s of entry %d after %d attempts, giving up: %r",
+                        entry.kind.value,
+                        entry.id,
+                        entry.attempts + 1,
+                        error,
+                    )
+                    outbox.mark_failed(entry.id, repr(error), retry_at=None)
+                    PUBLICATIONS.inc(entry.kind.value, "abandoned")
+                    continue
+
+                delay = retry_delay(entry.attempts + 1)
+                logger.warning(
+                    "Could not publish the %s of entry %d, retrying in %.0fs: %r",
+                    entry.kind.value,
+                    entry.id,
+                    delay,
+                    error,
+                )
+                outbox.mark_failed(entry.id, repr(error), time.time() + delay)
+                PUBLICATIONS.inc(entry.kind.value, "failed")
+                failed_kinds.add(entry.kind)
+                continue
+            outbox.mark_published(entry.id, item_hash)
+            PUBLICATIONS.inc(entry.kind.value, "published")
+            published += 1
+    return published
+
+
+async def publish_due(outbox: Outbox) -> int:
+    """Publish the due entries batch by batch, then purge the old published
+    entries. Returns the number of published entries."""
+    published = 0
+    while True:
+        batch = await drain_outbox(outbox)
+        if not batch:
+            break
+        published += batch
+    outbox.purge(time.time() - settings.OUTBOX_RETENTION.total_seconds())
+    return published
+
+
+async def run_publisher(outbox: Optional[Outbox] = None) -> None:
+    """Drain the outbox forever."""
+    outbox = outbox or get_outbox()
+    while True:
+        try:
+            await publish_due(outbox)
+        except Exception:
+            logger.exception("Error while draining the outbox")
+        await asyncio.sleep(settings.OUTBOX_POLL_INTERVAL.total_seconds())
+
+
+def start_background_publisher() -> threading.Thread:
+    """Drain the outbox in a background thread of this process."""
+    global _background_publisher
+    if _background_publisher is None or not _background_publisher.is_alive():
+        _background_publisher = threading.Thread(
+            target=lambda: asyncio.run(run_publisher()),
+            name="outbox-publisher",
+            daemon=True,
+        )
+        _background_publisher.start()
+    return _background_publisher
+
+
+def publish_pending() -> None:
+    """Try once to publish the due entries, unless a background publisher
+    of this process does it. Failed entries stay in the outbox."""
+    if _background_publisher is not None and _background_publisher.is_alive():
+        return
+    if not _publisher_lock.acquire(blocking=False):
+        return
+    try:
+        outbox = get_outbox()
+        asyncio.run(publish_due(outbox))
+        pending = outbox.pending()
+        if pending:
+            logger.warning("%d results could not be published yet", pending)
+    except Exception:
+        logger.exception("Error while draining the outbox")
+    finally:
+        _publisher_lock.release()
@@ -0,0 +1,240 @@
+"""
+Profiling reports of the measure and compute-scores commands.
+
+A profiled run records the wall-clock time of its phases, the peak memory
+allocated by each module, measured with tracemalloc at the end of the phases,
+and optionally a sampling CPU profile of the main thread. The report is a
+JSON file, ordered so that the reports of two versions can be diffed. The
+sampled stacks are also written next to it in the folded format of
+flamegraph.pl and speedscope.
+
+The phases are marked in the code with `phase(name)`, which does nothing
+outside of a profiled run.
+"""
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+# Number of modules and functions in the report
+TOP_ENTRIES = 30
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+_profiler: Optional["Profiler"] = None
+
+
+class PhaseStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.memory_peak = 0
+
+
+class StackSampler:
+    """Samples the stack of a thread at a regular interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                module = frame.f_globals.get("__name__", "?")
+                stack.append(f"{module}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def functions(self) -> List[Dict[str, Any]]:
+        """Functions seen in the samples: on top of the stack (self) or anywhere (total)."""
+        self_samples: Counter = Counter()
+        total_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack[-1]] += count
+            for function in set(stack):
+                total_samples[function] += count
+        ranked = sorted(total_samples.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            {"function": function, "total": total, "self": self_samples[function]}
+            for function, total in ranked[:TOP_ENTRIES]
+        ]
+
+    def folded(self) -> str:
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.stacks.items())
+        )
+
+
+def module_names() -> Dict[str, str]:
+    """Module names by source file."""
+    names = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, "__file__", None)
+        if filename:
+            names[os.path.abspath(filename)] = name
+    return names
+
+
+class Profiler:
+    def __init__(self, command: str, cpu: bool, sampling_interval: float):
+        self.command = command
+        self.phases: Dict[str, PhaseStats] = {}
+        # Phases in progress, outermost first
+        self.active_phases: List[PhaseStats] = []
+        self.memory_by_module: Dict[str, int] = {}
+        self.memory_peak = 0
+        self.sampler = (
+            StackSampler(threading.get_ident(), sampling_interval) if cpu else None
+        )
+        self.started = 0.0
+        self.seconds = 0.0
+
+    def start(self) -> None:
+        tracemalloc.start()
+        if self.sampler:
+            self.sampler.start()
+        self.started = time.perf_counter()
+
+    def stop(self) -> None:
+        self.seconds = time.perf_counter() - self.started
+        if self.sampler:
+            self.sampler.stop()
+        self.update_memory_peaks()
+        self.record_memory()
+        tracemalloc.stop()
+
+    def record_memory(self) -> None:
+        """Keep the largest allocated size of each module seen so far."""
+        names = module_names()
+        snapshot = tracemalloc.take_snapshot()
+        sizes: Counter = Counter()
+        for statistic in snapshot.statistics("filename"):
+            filename = statistic.traceback[0].filename
+            sizes[names.get(filename, filename)] += statistic.size
+        for module, size in sizes.items():
+            if size > self.memory_by_module.get(module, 0):
+                self.memory_by_module[module] = size
+
+    def update_memory_peaks(self) -> None:
+        """Account the peak since the last reset to the phases in progress."""
+        _, peak = tracemalloc.get_traced_memory()
+        self.memory_peak = max(self.memory_peak, peak)
+        for stats in self.active_phases:
+            stats.memory_peak = max(stats.memory_peak, peak)
+        # Without reset_peak (Python 3.8), the peaks are those since the start of the run
+        if sys.version_info >= (3, 9):
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        stats = self.phases.setdefault(name, PhaseStats())
+        self.update_memory_peaks()
+        self.active_phases.append(stats)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+            self.update_memory_peaks()
+            self.active_phases.remove(stats)
+            # Snapshots are slow, do not count them in the outer phases
+            if not self.active_phases:
+                self.record_memory()
+
+    def report(self) -> Dict[str, Any]:
+        modules = sorted(self.memory_by_module.items(), key=lambda item: (-item[1], item[0]))
+        report: Dict[str, Any] = {
+            "version": REPORT_VERSION,
+            "command": self.command,
+            "python": platform.python_version(),
+            "seconds": round(self.seconds, 3),
+            "phases": [
+                {
+                    "name": name,
+                    "calls": stats.calls,
+                    "seconds": round(stats.seconds, 3),
+                    "memory_peak_bytes": stats.memory_peak,
+                }
+                for name, stats in self.phases.items()
+            ],
+            "memory": {
+                "peak_bytes": self.memory_peak,
+                "by_module": [
+                    {"module": module, "peak_bytes": size}
+                    for module, size in modules[:TOP_ENTRIES]
+                ],
+            },
+        }
+        if self.sampler:
+            report["cpu"] = {
+                "sampling_interval": self.sampler.interval,
+                "samples": sum(self.sampler.stacks.values()),
+                "functions": self.sampler.functions(),
+            }
+        return report
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Record the block as a phase of the profiled run, if any."""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.phase(name):
+        yield
+
+
+def folded_stacks_path(report_path: Path) -> Path:
+    return report_path.with_suffix(".folded")
+
+
+@contextmanager
+def profile_run(
+    command: str,
+    report_path: Optional[Path],
+    cpu: bool = False,
+    sampling_interval: float = DEFAULT_SAMPLING_INTERVAL,
+) -> Iterator[Optional[Profiler]]:
+    """Profile the block and write the report to `report_path`, if set."""
+    global _profiler
+    if report_path is None:
+        yield None
+        return
+
+    profiler = Profiler(command, cpu=cpu, sampling_interval=sampling_interval)
+    _profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _profiler = None
+        report_path.write_text(json.dumps(profiler.report(), indent=2) + "\n")
+        if profiler.sampler:
+            folded_stacks_path(report_path).write_text(profiler.sampler.folded())
+        logger.info("Wrote the profile of %s to %s", command, report_path)
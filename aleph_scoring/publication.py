@@ -0,0 +1,378 @@
+"""
+Compact publication of the scores and metrics on Aleph.
+
+With COMPACT_SCORES_POSTS, the full scores of a period are published in two
+parts. The per-node detail, scores and measurements, is encoded as columns,
+one array per field, and stored as a single content-addressed file. A small
+post then lists the scores of each node without their measurements and
+references the file by hash. Otherwise, they are published in a single post.
+
+With DELTA_SCORES_POSTS, only the nodes whose scores changed by more than
+SCORE_DELTA_THRESHOLD since the last publication are posted, in a chain of
+delta posts that starts at a full publication, the checkpoint. The last
+published scores are kept in PUBLISHED_SCORES_DIRECTORY, and a new checkpoint
+is published every SCORE_CHECKPOINT_INTERVAL. `rebuild_scores` applies the
+deltas to their checkpoint.
+
+The metrics posts stay row-oriented, since the scoring queries read them
+directly, but with COMPACT_SCORES_POSTS their missing values are left out.
+
+The contents are built in a single pass over the scores, without
+intermediate copies of the models.
+"""
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from aleph.sdk.chains.ethereum import ETHAccount
+from aleph.sdk.client import AuthenticatedAlephClient
+from aleph.sdk.types import StorageEnum
+from aleph_message.models import PostMessage
+from hexbytes import HexBytes
+from pydantic import BaseModel
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics.models import MetricsPost, NodeMetrics
+from aleph_scoring.scoring.models import (
+    AlephNodeScore,
+    BaseNodeMeasurements,
+    CcnMeasurements,
+    CcnScore,
+    CrnMeasurements,
+    CrnScore,
+    NodeScoreSummaries,
+    NodeScores,
+    NodeScoresDeltaPost,
+    NodeScoresPost,
+    RemovedNodes,
+    WindowScores,
+)
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+# Version of the compact posts and detail files
+COMPACT_FORMAT_VERSION = "2.0"
+DETAIL_ENCODING = "columnar-json"
+SCORE_FIELDS = ("total_score", "performance", "version", "decentralization")
+NODE_TYPE_MEASUREMENTS: Dict[str, Type[BaseNodeMeasurements]] = {
+    "ccn": CcnMeasurements,
+    "crn": CrnMeasurements,
+}
+
+
+def get_aleph_account() -> ETHAccount:
+    if not settings.ETHEREUM_PRIVATE_KEY:
+        raise ValueError(
+            "Could not read Ethereum private key from ETHEREUM_PRIVATE_KEY."
+        )
+
+    private_key = HexBytes(settings.ETHEREUM_PRIVATE_KEY)
+    account = ETHAccount(private_key)
+    return account
+
+
+def aleph_client() -> AuthenticatedAlephClient:
+    """Client of the API server the results are published to."""
+    return AuthenticatedAlephClient(
+        account=get_aleph_account(),
+        api_server=settings.ALEPH_API_SERVER or settings.NODE_DATA_HOST,
+    )
+
+
+def period_content(period: Period) -> Dict[str, str]:
+    return {
+        "from_date": period.from_date.isoformat(),
+        "to_date": period.to_date.isoformat(),
+    }
+
+
+def score_columns(
+    node_type: str, scores: Sequence[Union[CcnScore, CrnScore]]
+) -> Dict[str, Any]:
+    """Encode the scores and measurements of the nodes of a type as columns."""
+    measurement_fields = list(NODE_TYPE_MEASUREMENTS[node_type].__fields__)
+    return {
+        "node_id": [score.node_id for score in scores],
+        **{field: [getattr(score, field) for score in scores] for field in SCORE_FIELDS},
+        "measurements": {
+            field: [getattr(score.measurements, field) for score in scores]
+            for field in measurement_fields
+        },
+    }
+
+
+def encode_scores_detail(period: Period, node_scores: NodeScores) -> bytes:
+    return json.dumps(
+        {
+            "version": COMPACT_FORMAT_VERSION,
+            "period": period_content(period),
+            "ccn": score_columns("ccn", node_scores.ccn),
+            "crn": score_columns("crn", node_scores.crn),
+        },
+        separators=(",", ":"),
+    ).encode()
+
+
+def decode_scores_detail(data: bytes) -> WindowScores:
+    """Rebuild the full scores of a period from a detail file."""
+    detail = json.loads(data)
+
+    def rows(node_type: str, score_class: Type[AlephNodeScore]) -> List[AlephNodeScore]:
+        columns = detail[node_type]
+        measurement_class = NODE_TYPE_MEASUREMENTS[node_type]
+        measurements = columns["measurements"]
+        return [
+            score_class(
+                node_id=node_id,
+                measurements=measurement_class(
+                    **{field: values[position] for field, values in measurements.items()}
+                ),
+                **{field: columns[field][position] for field in SCORE_FIELDS},
+            )
+            for position, node_id in enumerate(columns["node_id"])
+        ]
+
+    return WindowScores(
+        period=Period.parse_obj(detail["period"]),
+        scores=NodeScores(ccn=rows("ccn", CcnScore), crn=rows("crn", CrnScore)),
+    )
+
+
+def scores_summary_content(
+    period: Period, node_scores: NodeScores, detail_hash: str, detail_size: int
+) -> Dict[str, Any]:
+    """Content of a `CompactNodeScoresPost`, ready to be serialized."""
+    return {
+        "version": COMPACT_FORMAT_VERSION,
+        "tags": ["mainnet"],
+        "period": period_content(period),
+        "scores": {
+            node_type: [
+                {
+                    "node_id": score.node_id,
+                    **{field: getattr(score, field) for field in SCORE_FIELDS},
+                }
+                for score in scores
+            ]
+            for node_type, scores in node_scores.by_node_type()
+        },
+        "detail": {"item_hash": detail_hash, "size": detail_size, "encoding": DETAIL_ENCODING},
+    }
+
+
+def metrics_post_content(node_metrics: NodeMetrics) -> Dict[str, Any]:
+    """Content of a metrics post, without the missing values with COMPACT_SCORES_POSTS."""
+    return MetricsPost(tags=["mainnet"], metrics=node_metrics).dict(
+        exclude_none=settings.COMPACT_SCORES_POSTS
+    )
+
+
+async def publish_full_scores(
+    client: AuthenticatedAlephClient, node_scores: NodeScores, period: Period
+) -> Tuple[PostMessage, Any]:
+    if settings.COMPACT_SCORES_POSTS:
+        return await publish_compact_scores(client, node_scores, period)
+
+    scores_post = NodeScoresPost(tags=["mainnet"], scores=node_scores, period=period)
+    return await client.create_post(
+        # Serialized once, with the dates as strings
+        post_content=json.loads(scores_post.json()),
+        post_type=settings.ALEPH_POST_TYPE_SCORES,
+        channel=settings.ALEPH_POST_TYPE_CHANNEL,
+    )
+
+
+async def publish_compact_scores(
+    client: AuthenticatedAlephClient, node_scores: NodeScores, period: Period
+) -> Tuple[PostMessage, Any]:
+    """Store the detail file of the scores, then post their summary."""
+    detail = encode_scores_detail(period, node_scores)
+    store_message, _ = await client.create_store(
+        file_content=detail,
+        storage_engine=StorageEnum.storage,
+        channel=settings.ALEPH_POST_TYPE_CHANNEL,
+    )
+    return await client.create_post(
+        post_content=scores_summary_content(
+            period, node_scores, store_message.content.item_hash, len(detail)
+        ),
+        post_type=settings.ALEPH_POST_TYPE_SCORES,
+        channel=settings.ALEPH_POST_TYPE_CHANNEL,
+    )
+
+
+class PublishedScores(BaseModel):
+    """Scores of the last publication of a chain of delta posts."""
+
+    checkpoint: str
+    checkpoint_at: datetime
+    # Last post of the chain
+    previous: str
+    sequence: int
+    scores: NodeScoreSummaries
+
+
+def score_summaries(node_scores: NodeScores) -> NodeScoreSummaries:
+    """Scores of the nodes without their measurements."""
+    return NodeScoreSummaries(
+        **{
+            node_type: [
+                AlephNodeScore.construct(
+                    node_id=score.node_id,
+                    **{field: getattr(score, field) for field in SCORE_FIELDS},
+                )
+                for score in scores
+            ]
+            for node_type, scores in node_scores.by_node_type()
+        }
+    )
+
+
+def score_delta(
+    previous: NodeScoreSummaries, current: NodeScoreSummaries, threshold: float
+) -> Tuple[NodeScoreSummaries, RemovedNodes]:
+    """Nodes that are new or have a score that changed by more than the
+    threshold, and nodes that are not scored anymore."""
+    changed: Dict[str, List[AlephNodeScore]] = {}
+    removed: Dict[str, List[str]] = {}
+    for node_type in ("ccn", "crn"):
+        previous_scores = {score.node_id: score for score in getattr(previous, node_type)}
+        current_scores = getattr(current, node_type)
+        changed[node_type] = [
+            score
+            for score in current_scores
+            if score.node_id not in previous_scores
+            or any(
+                abs(getattr(score, field) - getattr(previous_scores[score.node_id], field))
+                > threshold
+                for field in SCORE_FIELDS
+            )
+        ]
+        current_ids = {score.node_id for score in current_scores}
+        removed[node_type] = [node_id for node_id in previous_scores if node_id not in current_ids]
+    return NodeScoreSummaries(**changed), RemovedNodes(**removed)
+
+
+def apply_score_delta(
+    scores: NodeScoreSummaries, changed: NodeScoreSummaries, removed: RemovedNodes
+) -> NodeScoreSummaries:
+    result = {}
+    for node_type in ("ccn", "crn"):
+        by_node = {score.node_id: score for score in getattr(scores, node_type)}
+        for node_id in getattr(removed, node_type):
+            by_node.pop(node_id, None)
+        by_node.update((score.node_id, score) for score in getattr(changed, node_type))
+        result[node_type] = list(by_node.values())
+    return NodeScoreSummaries(**result)
+
+
+def rebuild_scores(
+    checkpoint_hash: str, checkpoint: Dict[str, Any], deltas: Sequence[Dict[str, Any]]
+) -> NodeScoreSummaries:
+    """Rebuild the current scores from the content of a full scores post and
+    of the delta posts that follow it.
+
+    Raises ValueError if a delta belongs to another checkpoint or is missing.
+    """
+    scores = NodeScoreSummaries.parse_obj(checkpoint["scores"])
+    delta_posts = sorted(
+        (NodeScoresDeltaPost.parse_obj(delta) for delta in deltas),
+        key=lambda delta: delta.sequence,
+    )
+    for expected_sequence, delta in enumerate(delta_posts, start=1):
+        if delta.checkpoint != checkpoint_hash:
+            raise ValueError(f"Delta {delta.sequence} belongs to checkpoint {delta.checkpoint}")
+        if delta.sequence != expected_sequence:
+            raise ValueError(f"Missing delta {expected_sequence}")
+        scores = apply_score_delta(scores, delta.scores, delta.removed)
+    return scores
+
+
+def published_scores_path(period: Period) -> Path:
+    """State of the chain of the period length, such as 24h."""
+    hours = int((period.to_date - period.from_date).total_seconds() // 3600)
+    return Path(settings.PUBLISHED_SCORES_DIRECTORY) / f"scores-{hours}h.json"
+
+
+def load_published_scores(path: Path) -> Optional[PublishedScores]:
+    try:
+        return PublishedScores.parse_file(path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_published_scores(path: Path, state: PublishedScores) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp")
+    with temporary_path.open("w") as fd:
+        fd.write(state.json())
+    temporary_path.replace(path)
+
+
+async def publish_scores(
+    client: AuthenticatedAlephClient, node_scores: NodeScores, period: Period
+) -> Optional[Tuple[PostMessage, Any]]:
+    """Publish the scores of a period, or with DELTA_SCORES_POSTS only their
+    changes since the last publication.
+
+    Returns None when no score changed enough to be published.
+    """
+    if not settings.DELTA_SCORES_POSTS:
+        return await publish_full_scores(client, node_scores, period)
+
+    path = published_scores_path(period)
+    state = load_published_scores(path)
+    summaries = score_summaries(node_scores)
+    now = datetime.utcnow()
+
+    if state is None or now - state.checkpoint_at >= settings.SCORE_CHECKPOINT_INTERVAL:
+        message, status = await publish_full_scores(client, node_scores, period)
+        state = PublishedScores(
+            checkpoint=message.item_hash,
+            checkpoint_at=now,
+            previous=message.item_hash,
+            sequence=0,
+            scores=summaries,
+        )
+    else:
+        changed, removed = score_delta(
+            state.scores, summaries, threshold=settings.SCORE_DELTA_THRESHOLD
+        )
+        if not (changed.ccn or changed.crn or removed.ccn or removed.crn):
+            logger.info("No score changed by more than %s", settings.SCORE_DELTA_THRESHOLD)
+            return None
+
+        delta = NodeScoresDeltaPost(
+            tags=["mainnet"],
+            period=period,
+            checkpoint=state.checkpoint,
+            previous=state.previous,
+            sequence=state.sequence + 1,
+            threshold=settings.SCORE_DELTA_THRESHOLD,
+            scores=changed,
+            removed=removed,
+        )
+        message, status = await client.create_post(
+            post_content=json.loads(delta.json()),
+            post_type=settings.ALEPH_POST_TYPE_SCORES_DELTA,
+            channel=settings.ALEPH_POST_TYPE_CHANNEL,
+        )
+        logger.info(
+            "Published the scores of %d CCNs and %d CRNs, %d nodes removed",
+            len(changed.ccn),
+            len(changed.crn),
+            len(removed.ccn) + len(removed.crn),
+        )
+        state = state.copy(
+            update={
+                "previous": message.item_hash,
+                "sequence": delta.sequence,
+                "scores": apply_score_delta(state.scores, changed, removed),
+            }
+        )
+
+    save_published_scores(path, state)
+    return message, status
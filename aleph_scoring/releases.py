@@ -0,0 +1,270 @@
+"""
+Release metadata of the node software, cached on disk.
+
+The releases of each repository are fetched from the GitHub API with aiohttp
+and saved in RELEASE_CACHE_DIRECTORY with their ETag. A cached list younger
+than RELEASE_CACHE_MAX_AGE is used as is. An older one is revalidated with
+If-None-Match, and GitHub answers 304 Not Modified without counting the request
+against the rate limit. When GitHub cannot be reached, the cached list is used
+whatever its age.
+
+The releases are then synced into the `software_versions` table used by
+`annotate_version` and the version intervals.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import asyncpg
+from pydantic import BaseModel
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring.models import SoftwareVersionRecord
+from aleph_scoring.utils import GithubRelease, database_connection, get_latest_release
+
+logger = logging.getLogger(__name__)
+
+# GitHub repository of each software of the `software_versions` table
+SOFTWARE_REPOSITORIES: Dict[str, Tuple[str, str]] = {
+    "pyaleph": ("aleph-im", "pyaleph"),
+    "aleph-vm": ("aleph-im", "aleph-vm"),
+}
+# Length of the name column of `software_versions`
+MAX_VERSION_NAME_LENGTH = 30
+
+
+class CachedReleases(BaseModel):
+    etag: Optional[str]
+    # Time of the last response of GitHub, 200 or 304
+    fetched_at: float
+    # Most recent first, like the API
+    releases: List[GithubRelease]
+
+
+class ReleaseCache:
+    """Directory of JSON files, one per repository."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def entry_path(self, owner: str, repository: str) -> Path:
+        return self.directory / f"{owner}__{repository}.json"
+
+    def get(self, owner: str, repository: str) -> Optional[CachedReleases]:
+        try:
+            return CachedReleases.parse_file(self.entry_path(owner, repository))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, owner: str, repository: str, entry: CachedReleases) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.entry_path(owner, repository)
+            temporary_path = path.with_suffix(".tmp")
+            with temporary_path.open("w") as fd:
+                fd.write(entry.json())
+            temporary_path.replace(path)
+        except OSError:
+            logger.warning(
+                "Could not save the releases of %s/%s", owner, repository, exc_info=True
+            )
+
+
+def get_release_cache() -> ReleaseCache:
+    return ReleaseCache(Path(settings.RELEASE_CACHE_DIRECTORY))
+
+
+def github_headers() -> Dict[str, str]:
+    headers = {"Accept": "application/vnd.github+json"}
+    if settings.GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {settings.GITHUB_TOKEN}"
+    return headers
+
+
+async def fetch_releases(
+    session: aiohttp.ClientSession,
+    owner: str,
+    repository: str,
+    cache: ReleaseCache,
+) -> List[GithubRelease]:
+    """Releases of a repository, most recent first, from the cache or GitHub."""
+    cached = cache.get(owner, repository)
+    max_age = settings.RELEASE_CACHE_MAX_AGE.total_seconds()
+    if cached and time.time() - cached.fetched_at < max_age:
+        return cached.releases
+
+    headers = github_headers()
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+
+    url = f"{settings.GITHUB_API_URL.rstrip('/')}/repos/{owner}/{repository}/releases"
+    try:
+        async with session.get(url, params={"per_page": "100"}, headers=headers) as response:
+            if response.status == 304 and cached:
+                entry = cached.copy(update={"fetched_at": time.time()})
+            else:
+                response.raise_for_status()
+                entry = CachedReleases(
+                    etag=response.headers.get("ETag"),
+                    fetched_at=time.time(),
+                    releases=[
+                        GithubRelease.parse_obj(release) for release in await response.json()
+                    ],
+                )
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if cached is None:
+            raise
+        logger.warning(
+            "Could not fetch the releases of %s/%s, using the cached ones from %s",
+            owner,
+            repository,
+            datetime.utcfromtimestamp(cached.fetched_at),
+            exc_info=True,
+        )
+        return cached.releases
+
+    cache.put(owner, repository, entry)
+    return entry.releases
+
+
+async def get_latest_github_releases(
+    owner: str, repository: str
+) -> Tuple[GithubRelease, Optional[GithubRelease], Optional[GithubRelease]]:
+    """Latest release, the release before it and latest prerelease of a repository."""
+    timeout = aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        releases = await fetch_releases(session, owner, repository, get_release_cache())
+
+    result = [release.dict() for release in releases]
+    latest_release = get_latest_release(result, is_prerelease=False)
+    if latest_release is None:
+        raise ValueError(f"No release of {owner}/{repository}")
+    previous_release = get_latest_release(result, released_before=latest_release)
+    prerelease = get_latest_release(result, is_prerelease=True)
+    return latest_release, previous_release, prerelease
+
+
+def software_versions(
+    software: str, releases: List[GithubRelease]
+) -> List[SoftwareVersionRecord]:
+    """Rows of the `software_versions` table for the releases of a software.
+
+    A release is replaced by the next release, and a prerelease by the next
+    release or prerelease.
+    """
+    records = []
+    ordered = sorted(releases, key=lambda release: release.published_at)
+    for position, release in enumerate(ordered):
+        if len(release.tag_name) > MAX_VERSION_NAME_LENGTH:
+            logger.warning(
+                "Ignoring the release %s of %s: name too long", release.tag_name, software
+            )
+            continue
+        replacement = next(
+            (
+                later
+                for later in ordered[position + 1:]
+                if release.prerelease or not later.prerelease
+            ),
+            None,
+        )
+        records.append(
+            SoftwareVersionRecord(
+                software=software,
+                name=release.tag_name,
+                released_on=release.published_at,
+                replaced_on=replacement.published_at if replacement else None,
+                prerelease=release.prerelease,
+            )
+        )
+    return records
+
+
+# Versions of the records that differ from the table, or are not in it
+COUNT_CHANGED_VERSIONS_SQL = """
+SELECT count(*)
+FROM unnest($1::text[], $2::text[], $3::timestamp[], $4::timestamp[], $5::bool[])
+         AS new_version (software, name, released_on, replaced_on, prerelease)
+         LEFT JOIN software_versions AS version
+                   ON version.software = new_version.software
+                       AND version.name = new_version.name
+WHERE (version.released_on, version.replaced_on, version.prerelease)
+          IS DISTINCT FROM
+      (new_version.released_on, new_version.replaced_on, new_version.prerelease)
+"""
+
+UPSERT_VERSIONS_SQL = """
+INSERT INTO software_versions (software, name, released_on, replaced_on, prerelease)
+SELECT *
+FROM unnest($1::text[], $2::text[], $3::timestamp[], $4::timestamp[], $5::bool[])
+ON CONFLICT (software, name) DO UPDATE
+    SET released_on = excluded.released_on,
+        replaced_on = excluded.replaced_on,
+        prerelease  = excluded.prerelease
+    WHERE (software_versions.released_on, software_versions.replaced_on,
+           software_versions.prerelease)
+              IS DISTINCT FROM (excluded.released_on, excluded.replaced_on, excluded.prerelease)
+"""
+
+
+async def sync_software_versions(
+    conn: asyncpg.Connection, records: List[SoftwareVersionRecord]
+) -> int:
+    """Insert or update the versions. Versions absent from the records are kept.
+
+    Every statement on `software_versions` refreshes the software_version_intervals
+    view, see software_version_intervals.sql, so the versions are written in a
+    single statement, and only if one of them changed. Returns the number of
+    changed versions.
+    """
+    columns = (
+        [record.software for record in records],
+        [record.name for record in records],
+        # The columns are timestamps without time zone, in UTC
+        [record.released_on.replace(tzinfo=None) for record in records],
+        [
+            record.replaced_on.replace(tzinfo=None) if record.replaced_on else None
+            for record in records
+        ],
+        [record.prerelease for record in records],
+    )
+    async with conn.transaction():
+        changed = await conn.fetchval(COUNT_CHANGED_VERSIONS_SQL, *columns)
+        if changed:
+            await conn.execute(UPSERT_VERSIONS_SQL, *columns)
+    return changed
+
+
+async def update_software_versions(conn: Optional[asyncpg.Connection] = None) -> int:
+    """Fetch the releases of every software and sync them into `software_versions`.
+
+    A software whose releases cannot be fetched keeps its current versions.
+    Returns the number of synced versions.
+    """
+    cache = get_release_cache()
+    records: List[SoftwareVersionRecord] = []
+    timeout = aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for software, (owner, repository) in SOFTWARE_REPOSITORIES.items():
+            try:
+                releases = await fetch_releases(session, owner, repository, cache)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                logger.warning("Could not fetch the releases of %s", software, exc_info=True)
+                continue
+            records += software_versions(software, releases)
+
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+    try:
+        changed = await sync_software_versions(conn, records)
+    finally:
+        if close_connection:
+            await conn.close()
+
+    logger.info("Synced %d software versions, %d changed", len(records), changed)
+    return len(records)
@@ -0,0 +1,305 @@
+"""
+Scoring from archived metrics files, without a database.
+
+A directory of metrics files, as written by `measure --output` (`NodeMetrics`)
+or containing `MetricsPost` objects, is converted into a columnar cache of
+NumPy arrays sorted by measurement time. Only the files that are new since the
+last update are parsed, and any period can then be scored from memory-mapped
+arrays with the NumPy engine.
+"""
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from aleph_scoring.scoring.engine import (
+    MetricsRow,
+    MetricsTable,
+    SoftwareVersion,
+    VersionClassifier,
+    score_metrics_table,
+)
+from aleph_scoring.scoring.models import NodeScores, SoftwareVersionRecord
+from aleph_scoring.scoring.rollups import (
+    NODE_TYPE_METRICS,
+    NODE_TYPE_SOFTWARE,
+    NodeType,
+)
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE_SUFFIXES = (".json", ".jsonl")
+# Export of the software_versions table, read by `load_version_classifiers`
+SOFTWARE_VERSIONS_FILE = "software_versions.json"
+NODE_TYPES: Tuple[NodeType, ...] = ("ccn", "crn")
+
+
+def load_version_classifiers(path: Path) -> Dict[str, VersionClassifier]:
+    """Load the version classifiers of each node type from a JSON export of
+    the `software_versions` table."""
+    with path.open() as fd:
+        records = [SoftwareVersionRecord.parse_obj(record) for record in json.load(fd)]
+
+    return {
+        node_type: VersionClassifier(
+            SoftwareVersion(
+                name=record.name,
+                released_on=record.released_on,
+                replaced_on=record.replaced_on,
+                prerelease=record.prerelease,
+            )
+            for record in records
+            if record.software == software
+        )
+        for node_type, software in NODE_TYPE_SOFTWARE.items()
+    }
+
+
+def extract_node_metrics(document: Any) -> Optional[Dict[str, Any]]:
+    """Extract the `NodeMetrics` of a `NodeMetrics`, `MetricsPost` or Aleph post.
+
+    Returns None for other documents, such as the scores written to the same
+    directory by `compute-scores --output`.
+    """
+    if isinstance(document, dict) and "content" in document:
+        document = document["content"]
+    if isinstance(document, dict) and "metrics" in document:
+        document = document["metrics"]
+    if not isinstance(document, dict) or not ("ccn" in document or "crn" in document):
+        return None
+    for node_type in NODE_TYPES:
+        for node in document.get(node_type) or []:
+            if not isinstance(node, dict) or "node_id" not in node or "measured_at" not in node:
+                return None
+    return document
+
+
+def read_metrics_file(path: Path) -> Iterator[Dict[str, Any]]:
+    """The `NodeMetrics` of a file. The other documents are skipped with a warning."""
+    skipped = 0
+    with path.open() as fd:
+        if path.suffix == ".jsonl":
+            documents: Iterable[Any] = (json.loads(line) for line in fd if line.strip())
+        else:
+            document = json.load(fd)
+            documents = document if isinstance(document, list) else [document]
+
+        for document in documents:
+            node_metrics = extract_node_metrics(document)
+            if node_metrics is None:
+                skipped += 1
+            else:
+                yield node_metrics
+    if skipped:
+        logger.warning("Skipped %d documents of %s that are not metrics", skipped, path)
+
+
+def metrics_rows(node_metrics: Dict[str, Any], node_type: NodeType) -> Iterator[MetricsRow]:
+    metrics = NODE_TYPE_METRICS[node_type]
+    for node in node_metrics.get(node_type, []):
+        yield (
+            node["node_id"],
+            node["measured_at"],
+            node.get("version"),
+            node.get("asn"),
+            [node.get(metric) for metric in metrics],
+        )
+
+
+class MetricsArchive:
+    """Columnar cache of the metrics files of a directory.
+
+    The cache contains, for each node type, one `.npy` file per column of a
+    `MetricsTable` sorted by `measured_at`, and an index of the files that
+    were already imported. Each update writes the arrays in a new generation
+    directory, then replaces the index that refers to it, so that an
+    interrupted update leaves the previous index and arrays in place.
+    """
+
+    def __init__(self, directory: Path, cache_directory: Optional[Path] = None):
+        self.directory = directory
+        self.cache_directory = cache_directory or directory / ".metrics-cache"
+
+    @property
+    def index_file(self) -> Path:
+        return self.cache_directory / "index.json"
+
+    def list_metrics_files(self) -> Dict[str, List[int]]:
+        return {
+            str(path.relative_to(self.directory)): [
+                path.stat().st_size,
+                path.stat().st_mtime_ns,
+            ]
+            for path in sorted(self.directory.rglob("*"))
+            if path.suffix in METRICS_FILE_SUFFIXES
+            and path.name != SOFTWARE_VERSIONS_FILE
+            and self.cache_directory not in path.parents
+        }
+
+    def read_index(self) -> Dict[str, Any]:
+        if self.index_file.exists():
+            with self.index_file.open() as fd:
+                index = json.load(fd)
+            # Indexes written before the generations are rebuilt
+            if "generation" in index:
+                return index
+        return {"generation": 0, "files": {}, "node_types": {}}
+
+    def write_index(self, index: Dict[str, Any]) -> None:
+        temporary_path = self.index_file.with_suffix(".tmp")
+        with temporary_path.open("w") as fd:
+            json.dump(index, fd)
+        temporary_path.replace(self.index_file)
+
+    def generation_directory(self, generation: int) -> Path:
+        return self.cache_directory / f"generation-{generation}"
+
+    def remove_other_generations(self, generation: int) -> None:
+        """Remove the arrays of the previous or interrupted updates. The arrays
+        that are still memory-mapped stay readable until they are closed."""
+        current = self.generation_directory(generation)
+        for path in self.cache_directory.iterdir():
+            if path.is_dir() and path != current:
+                shutil.rmtree(path)
+
+    def save_table(
+        self, generation: int, node_type: NodeType, table: MetricsTable
+    ) -> Dict[str, Any]:
+        table_directory = self.generation_directory(generation) / node_type
+        table_directory.mkdir(parents=True, exist_ok=True)
+
+        def save(name: str, values: np.ndarray) -> None:
+            np.save(table_directory / f"{name}.npy", values)
+
+        save("node_index", table.node_index)
+        save("measured_at", table.measured_at)
+        save("version_codes", table.version_codes)
+        save("asns", table.asns)
+        for metric, values in table.metrics.items():
+            save(f"metric.{metric}", values)
+
+        return {
+            "node_ids": table.node_ids.tolist(),
+            "version_names": table.version_names,
+            "measurements": len(table),
+        }
+
+    def load_table(self, node_type: NodeType) -> MetricsTable:
+        """Load the cached table of a node type as memory-mapped arrays."""
+        index = self.read_index()
+        table_index = index["node_types"].get(node_type)
+        metrics = NODE_TYPE_METRICS[node_type]
+        if table_index is None:
+            return MetricsTable.from_rows([], metrics=metrics)
+
+        table_directory = self.generation_directory(index["generation"]) / node_type
+
+        def load(name: str) -> np.ndarray:
+            return np.load(table_directory / f"{name}.npy", mmap_mode="r")
+
+        return MetricsTable(
+            node_ids=np.array(table_index["node_ids"], dtype=object),
+            node_index=load("node_index"),
+            measured_at=load("measured_at"),
+            metrics={metric: load(f"metric.{metric}") for metric in metrics},
+            version_names=table_index["version_names"],
+            version_codes=load("version_codes"),
+            asns=load("asns"),
+            sorted_by_time=True,
+        )
+
+    def update(self) -> int:
+        """Import the metrics files that are not in the cache yet.
+
+        The cache is rebuilt from scratch when a file that was already
+        imported was modified or removed. Returns the number of imported files.
+        """
+        index = self.read_index()
+        files = self.list_metrics_files()
+
+        imported_files = index["files"]
+        if any(files.get(name) != stat for name, stat in imported_files.items()):
+            logger.info("Metrics files were modified, rebuilding the cache")
+            imported_files = {}
+            index["node_types"] = {}
+
+        new_files = [name for name in files if name not in imported_files]
+        if not new_files:
+            return 0
+        generation = index["generation"] + 1
+        # Left by an interrupted update
+        shutil.rmtree(self.generation_directory(generation), ignore_errors=True)
+
+        node_metrics = [
+            document
+            for name in new_files
+            for document in read_metrics_file(self.directory / name)
+        ]
+
+        for node_type in NODE_TYPES:
+            metrics = NODE_TYPE_METRICS[node_type]
+            new_table = MetricsTable.from_rows(
+                (
+                    row
+                    for document in node_metrics
+                    for row in metrics_rows(document, node_type)
+                ),
+                metrics=metrics,
+            )
+            tables = [new_table]
+            if node_type in index["node_types"]:
+                tables.insert(0, self.load_table(node_type))
+
+            table = MetricsTable.concatenate(tables, metrics=metrics).sort_by_time()
+            index["node_types"][node_type] = self.save_table(generation, node_type, table)
+
+        index["generation"] = generation
+        index["files"] = {
+            name: files[name] for name in list(imported_files) + new_files
+        }
+        # The new arrays are used from here
+        self.write_index(index)
+        self.remove_other_generations(generation)
+
+        logger.info("Imported %d metrics files into the cache", len(new_files))
+        return len(new_files)
+
+
+def compute_archive_scores_for_periods(
+    archive: MetricsArchive,
+    periods: Sequence[Period],
+    classifiers: Dict[str, VersionClassifier],
+) -> List[NodeScores]:
+    archive.update()
+
+    tables = {node_type: archive.load_table(node_type) for node_type in NODE_TYPES}
+    return [
+        NodeScores(
+            ccn=score_metrics_table(
+                tables["ccn"].select_period(period), "ccn", classifiers["ccn"]
+            ),
+            crn=score_metrics_table(
+                tables["crn"].select_period(period), "crn", classifiers["crn"]
+            ),
+        )
+        for period in periods
+    ]
+
+
+def compute_archive_scores(
+    archive: MetricsArchive,
+    period: Period,
+    classifiers: Dict[str, VersionClassifier],
+) -> NodeScores:
+    scores = compute_archive_scores_for_periods(archive, [period], classifiers)[0]
+    for node_type in NODE_TYPES:
+        logger.info(
+            "%d %s nodes with a total score greater than zero",
+            len([score for score in getattr(scores, node_type) if score.total_score > 0]),
+            node_type.upper(),
+        )
+    return scores
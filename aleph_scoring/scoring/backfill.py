@@ -0,0 +1,160 @@
+"""
+Parallel recomputation of the scores of past periods.
+
+The periods are distributed over a pool of processes. Each process keeps its
+own event loop and database connection pool for all the periods it scores,
+and the results are written by the parent process as they arrive.
+"""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+import asyncpg
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring.compute import compute_ccn_scores, compute_crn_scores
+from aleph_scoring.scoring.models import NodeScores, WindowScores
+from aleph_scoring.scoring.rollups import update_all_rollups
+from aleph_scoring.utils import (
+    Period,
+    database_connection,
+    database_pool,
+    read_sql_file,
+)
+
+logger = logging.getLogger(__name__)
+
+# State of each worker process
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool: Optional[asyncpg.Pool] = None
+
+
+def backfill_periods(
+    from_date: datetime, to_date: datetime, step: timedelta, window: timedelta
+) -> List[Period]:
+    """List the periods of `window` that end every `step` from `from_date`
+    up to `to_date`."""
+    periods = []
+    end = from_date
+    while end <= to_date:
+        periods.append(Period(from_date=end - window, to_date=end))
+        end += step
+    return periods
+
+
+async def update_backfill_rollups(periods: List[Period]) -> None:
+    """Roll up the hours of the periods, which can be older than the
+    ROLLUP_INITIAL_PERIOD rolled up by default."""
+    if periods:
+        await update_all_rollups(from_date=min(period.from_date for period in periods))
+
+
+def init_worker() -> None:
+    global _loop, _pool
+
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _pool = _loop.run_until_complete(database_pool(settings))
+
+
+async def _score_period(period: Period) -> WindowScores:
+    assert _pool is not None, "The worker was not initialized"
+    async with _pool.acquire() as conn:
+        ccn_scores = await compute_ccn_scores(period=period, conn=conn)
+        crn_scores = await compute_crn_scores(period=period, conn=conn)
+    return WindowScores(
+        period=period, scores=NodeScores(ccn=ccn_scores, crn=crn_scores)
+    )
+
+
+def score_period(period: Period) -> WindowScores:
+    """Entry point of the worker processes."""
+    assert _loop is not None, "The worker was not initialized"
+    return _loop.run_until_complete(_score_period(period))
+
+
+async def save_scores_in_database(window_scores: List[WindowScores]) -> None:
+    conn = await database_connection(settings)
+    try:
+        await conn.execute(read_sql_file("node_scores_history_table.sql"))
+        await conn.executemany(
+            """
+            INSERT INTO node_scores_history
+                (node_type, node_id, period_from, period_to,
+                 total_score, performance, version, decentralization, measurements)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (node_type, node_id, period_to, period_from) DO UPDATE
+                SET total_score      = excluded.total_score,
+                    performance      = excluded.performance,
+                    version          = excluded.version,
+                    decentralization = excluded.decentralization,
+                    measurements     = excluded.measurements,
+                    computed_at      = now() at time zone 'utc'
+            """,
+            [
+                (
+                    node_type,
+                    score.node_id,
+                    window.period.from_date,
+                    window.period.to_date,
+                    score.total_score,
+                    score.performance,
+                    score.version,
+                    score.decentralization,
+                    score.measurements.json(),
+                )
+                for window in window_scores
+                for node_type, scores in window.scores.by_node_type()
+                for score in scores
+            ],
+        )
+    finally:
+        await conn.close()
+
+
+def backfill_scores(
+    periods: List[Period],
+    workers: int,
+    output: Optional[Path] = None,
+    save_in_database: bool = False,
+) -> int:
+    """Score the periods in parallel.
+
+    The scores of each period are appended to `output` as one JSON line,
+    and/or saved in the `node_scores_history` table. Returns the number of
+    periods that could not be scored.
+    """
+    failures = 0
+    output_file = output.open("a") if output else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            futures = {pool.submit(score_period, period): period for period in periods}
+            for done, future in enumerate(as_completed(futures), start=1):
+                period = futures[future]
+                try:
+                    window_scores = future.result()
+                except Exception:
+                    logger.exception(
+                        "Could not score the period %s - %s",
+                        period.from_date,
+                        period.to_date,
+                    )
+                    failures += 1
+                    continue
+
+                if output_file:
+                    output_file.write(window_scores.json() + "\n")
+                    output_file.flush()
+                if save_in_database:
+                    asyncio.run(save_scores_in_database([window_scores]))
+                logger.info(
+                    "Scored period ending %s (%d/%d)", period.to_date, done, len(periods)
+                )
+    finally:
+        if output_file:
+            output_file.close()
+
+    return failures
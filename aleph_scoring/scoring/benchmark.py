@@ -0,0 +1,135 @@
+"""
+Benchmark of the scoring queries.
+
+Each scoring query is run several times on the current database with the
+parameters of a period, then explained with EXPLAIN ANALYZE. The full scoring
+of each node type is timed the same way, with the score cache disabled. The
+report can be saved as JSON to compare query or schema changes on the same
+synthetic dataset, see `aleph_scoring.scoring.synthetic`.
+"""
+import json
+import logging
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import asyncpg
+from pydantic import BaseModel
+
+from aleph_scoring.config import ScoringEngine, settings
+from aleph_scoring.scoring.compute import compute_ccn_scores, compute_crn_scores
+from aleph_scoring.scoring.migrations import scoring_queries
+from aleph_scoring.scoring.models import AlephNodeScore
+from aleph_scoring.scoring.synthetic import SyntheticDataset
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+
+class Timing(BaseModel):
+    name: str
+    # Rows returned by a query, or nodes scored
+    rows: int
+    # Duration of each run, in seconds
+    durations: List[float]
+    median: float
+    # Output of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), for the queries
+    plan: Optional[Any] = None
+    planning_time: Optional[float] = None
+    execution_time: Optional[float] = None
+
+
+class BenchmarkReport(BaseModel):
+    created_at: datetime
+    server_version: str
+    scoring_engine: ScoringEngine
+    partitioned_measurements: bool
+    period: Period
+    # Metrics posts of the database
+    posts: int
+    dataset: Optional[SyntheticDataset]
+    queries: List[Timing]
+    scoring: List[Timing]
+
+
+async def time_runs(name: str, run: Callable[[], Awaitable[int]], runs: int) -> Timing:
+    """Time `runs` calls of a coroutine that returns a number of rows."""
+    durations = []
+    rows = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        rows = await run()
+        durations.append(time.perf_counter() - start)
+    logger.info("%s: %d rows in %.3fs (median)", name, rows, statistics.median(durations))
+    return Timing(name=name, rows=rows, durations=durations, median=statistics.median(durations))
+
+
+async def benchmark_query(
+    conn: asyncpg.Connection, name: str, sql: str, args: Tuple, runs: int
+) -> Timing:
+    async def run() -> int:
+        return len(await conn.fetch(sql, *args))
+
+    timing = await time_runs(name, run, runs)
+    plan = json.loads(
+        await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args)
+    )
+    return timing.copy(
+        update={
+            "plan": plan,
+            "planning_time": plan[0].get("Planning Time"),
+            "execution_time": plan[0].get("Execution Time"),
+        }
+    )
+
+
+async def benchmark_scoring(
+    conn: asyncpg.Connection, node_type: str, period: Period, runs: int
+) -> Timing:
+    compute: Callable[..., Awaitable[Sequence[AlephNodeScore]]]
+    if node_type == "ccn":
+        compute = compute_ccn_scores
+    else:
+        compute = compute_crn_scores
+
+    async def run() -> int:
+        return len(await compute(period, conn=conn))
+
+    cache_directory = settings.SCORE_CACHE_DIRECTORY
+    settings.SCORE_CACHE_DIRECTORY = None
+    try:
+        return await time_runs(f"compute_{node_type}_scores", run, runs)
+    finally:
+        settings.SCORE_CACHE_DIRECTORY = cache_directory
+
+
+async def run_benchmark(
+    conn: asyncpg.Connection,
+    period: Period,
+    runs: int = 3,
+    dataset: Optional[SyntheticDataset] = None,
+) -> BenchmarkReport:
+    """Time the scoring queries and the scoring of each node type over the period."""
+    queries = [
+        await benchmark_query(conn, name, sql, args, runs)
+        for name, sql, args in scoring_queries(period)
+    ]
+    scoring = [
+        await benchmark_scoring(conn, node_type, period, runs) for node_type in ("ccn", "crn")
+    ]
+    return BenchmarkReport(
+        created_at=datetime.utcnow(),
+        server_version=await conn.fetchval("SHOW server_version"),
+        scoring_engine=settings.SCORING_ENGINE,
+        partitioned_measurements=settings.PARTITIONED_MEASUREMENTS,
+        period=period,
+        posts=await conn.fetchval(
+            "SELECT count(*) FROM posts WHERE owner = $1 AND type = $2",
+            settings.ALLOWED_METRICS_SENDER,
+            settings.ALEPH_POST_TYPE_METRICS,
+        ),
+        dataset=dataset,
+        queries=queries,
+        scoring=scoring,
+    )
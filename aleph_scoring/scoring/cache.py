@@ -0,0 +1,184 @@
+"""
+Cache of the computed scores.
+
+The scores of a node type over a period only depend on the metrics posts, the
+software versions and the scoring formulas. Each entry is keyed by the period
+and by a watermark of this data, so that a run with the same inputs returns
+the previous result instead of querying the measurements again. The periods
+computed by default end at `aligned_period_end`, so that repeated runs have
+the same period.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Type, TypeVar
+
+import asyncpg
+from pydantic import BaseModel
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring.formula import formula_checksum
+from aleph_scoring.scoring.metric_scores import SCORING_FORMULA_VERSION
+from aleph_scoring.utils import Period, database_connection, read_sql_file
+
+logger = logging.getLogger(__name__)
+
+ScoreT = TypeVar("ScoreT", bound=BaseModel)
+
+
+class DataWatermark(NamedTuple):
+    latest_post_time: Optional[datetime]
+    post_count: int
+    software_versions_checksum: str
+
+
+async def query_data_watermark(conn: asyncpg.Connection) -> DataWatermark:
+    record = await conn.fetchrow(
+        read_sql_file("query_data_watermark.template.sql"),
+        settings.ALLOWED_METRICS_SENDER,
+        settings.ALEPH_POST_TYPE_METRICS,
+    )
+    return DataWatermark(**dict(record))
+
+
+async def fetch_data_watermark() -> DataWatermark:
+    conn = await database_connection(settings)
+    try:
+        return await query_data_watermark(conn)
+    finally:
+        await conn.close()
+
+
+def aligned_period_end(now: Optional[datetime] = None) -> datetime:
+    """The default end of the scoring periods: the current time (UTC) rounded down
+    to SCORE_PERIOD_ALIGNMENT, so that the cache keys of close runs are equal."""
+    now = now or datetime.utcnow()
+    alignment = settings.SCORE_PERIOD_ALIGNMENT
+    return now - (now - datetime.min) % alignment
+
+
+def score_cache_key(node_type: str, period: Period, watermark: DataWatermark) -> str:
+    return json.dumps(
+        {
+            "node_type": node_type,
+            "from_date": period.from_date.isoformat(),
+            "to_date": period.to_date.isoformat(),
+            "latest_post_time": (
+                watermark.latest_post_time.isoformat()
+                if watermark.latest_post_time
+                else None
+            ),
+            "post_count": watermark.post_count,
+            "software_versions": watermark.software_versions_checksum,
+            "formula_version": SCORING_FORMULA_VERSION,
+            "formula": formula_checksum(),
+            "scoring_engine": settings.SCORING_ENGINE.value,
+        },
+        sort_keys=True,
+    )
+
+
+class ScoreCache:
+    """Directory of JSON files, one per cached result.
+
+    The modification time of a file is the creation time of its entry, and its
+    access time the last time the entry was used. When there are more than
+    `max_entries`, the entries older than `max_age` are removed, as well as the
+    least recently used ones. Entries older than `max_age` are never used.
+    """
+
+    def __init__(self, directory: Path, max_entries: int, max_age: timedelta):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    def entry_path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        path = self.entry_path(key)
+        try:
+            with path.open() as fd:
+                entry = json.load(fd)
+            created_at = path.stat().st_mtime
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if entry["key"] != key or time.time() - created_at > self.max_age.total_seconds():
+            return None
+
+        # Set explicitly, the file system may not update the access times
+        os.utime(path, (time.time(), created_at))
+        return entry["values"]
+
+    def put(self, key: str, values: List[Any]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.entry_path(key)
+        temporary_path = path.with_suffix(".tmp")
+        with temporary_path.open("w") as fd:
+            json.dump({"key": key, "values": values}, fd)
+        temporary_path.replace(path)
+        if sum(1 for _ in self.directory.glob("*.json")) > self.max_entries:
+            self.evict()
+
+    def evict(self) -> int:
+        """Remove the expired and least recently used entries, from the times
+        of the files. Returns the number of removed entries."""
+        entries = []
+        removed = 0
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            if time.time() - stat.st_mtime > self.max_age.total_seconds():
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                entries.append((stat.st_atime, path))
+
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            path.unlink(missing_ok=True)
+            removed += 1
+
+        return removed
+
+
+def get_score_cache() -> Optional[ScoreCache]:
+    if not settings.SCORE_CACHE_DIRECTORY:
+        return None
+    return ScoreCache(
+        directory=Path(settings.SCORE_CACHE_DIRECTORY),
+        max_entries=settings.SCORE_CACHE_MAX_ENTRIES,
+        max_age=settings.SCORE_CACHE_MAX_AGE,
+    )
+
+
+async def cached_scores(
+    conn: asyncpg.Connection,
+    node_type: str,
+    period: Period,
+    score_class: Type[ScoreT],
+    compute: Callable[[], Awaitable[List[ScoreT]]],
+) -> List[ScoreT]:
+    """Return the cached scores of the node type over the period, or compute
+    and cache them if the data changed since they were computed."""
+    score_cache = get_score_cache()
+    if score_cache is None:
+        return await compute()
+
+    key = score_cache_key(node_type, period, await query_data_watermark(conn))
+    values = score_cache.get(key)
+    if values is not None:
+        logger.info("Using the cached %s scores", node_type.upper())
+        return [score_class.parse_obj(value) for value in values]
+
+    scores = await compute()
+    score_cache.put(key, [json.loads(score.json()) for score in scores])
+    return scores
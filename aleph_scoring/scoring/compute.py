@@ -0,0 +1,326 @@
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    overload,
+)
+
+import asyncpg
+import numpy as np
+
+from aleph_scoring.config import ScoringEngine, settings
+from aleph_scoring.openmetrics import QUERY_DURATION
+from aleph_scoring.scoring.models import (
+    AlephNodeScore,
+    CcnMeasurements,
+    CcnScore,
+    CrnMeasurements,
+    CrnScore,
+    NodeScores,
+)
+from aleph_scoring.scoring.cache import cached_scores
+from aleph_scoring.scoring.engine import (
+    compute_engine_scores,
+    compute_engine_scores_for_periods,
+)
+from aleph_scoring.scoring.formula import VERSION_ANNOTATIONS, get_score_function
+from aleph_scoring.scoring.partitions import read_measurements_query
+from aleph_scoring.scoring.rollups import (
+    NodeType,
+    query_rollup_measurements,
+    query_rollup_measurements_for_periods,
+)
+from aleph_scoring.utils import Period, database_connection
+
+logger = logging.getLogger(__name__)
+
+MeasurementsT = TypeVar("MeasurementsT", CrnMeasurements, CcnMeasurements)
+
+
+async def stream_measurements(
+    conn: asyncpg.connection,
+    node_type: NodeType,
+    sql_file: str,
+    measurements_class: Type[MeasurementsT],
+    period: Period,
+) -> AsyncIterator[Tuple[str, MeasurementsT]]:
+    """Stream the rows of a measurement query through a server-side cursor.
+
+    The rows come from our own query, so the models are built without
+    validation.
+    """
+    fields = tuple(measurements_class.__fields__)
+    query_name = sql_file.split(".")[0]
+    with QUERY_DURATION.time(query_name):
+        async with conn.transaction():
+            async for record in conn.cursor(
+                read_measurements_query(sql_file),
+                settings.ALLOWED_METRICS_SENDER,
+                settings.ALEPH_POST_TYPE_METRICS,
+                period.from_date,
+                period.to_date,
+                node_type,
+                prefetch=settings.MEASUREMENTS_CURSOR_PREFETCH,
+            ):
+                yield record["node_id"], measurements_class.construct(
+                    **{field: record[field] for field in fields}
+                )
+
+
+async def query_crn_measurements(
+    conn: asyncpg.connection,
+    period: Period,
+):
+    """Query the aggregated measurements and the ASN distribution of each CRN.
+
+    Both are computed in a single scan of the metrics posts.
+    """
+    async for node_id, measurements in stream_measurements(
+        conn, "crn", "query_crn_measurements.template.sql", CrnMeasurements, period
+    ):
+        yield node_id, measurements
+
+
+async def query_crn_rollup_measurements(
+    conn: asyncpg.connection,
+    period: Period,
+):
+    rows = await query_rollup_measurements(conn, node_type="crn", period=period)
+    for node_id, row in rows.items():
+        yield node_id, CrnMeasurements.parse_obj(row)
+
+
+@overload
+def score_node_measurements(
+    node_type: Literal["crn"],
+    node_measurements: Sequence[Tuple[str, CrnMeasurements]],
+) -> List[CrnScore]:
+    ...
+
+
+@overload
+def score_node_measurements(
+    node_type: Literal["ccn"],
+    node_measurements: Sequence[Tuple[str, CcnMeasurements]],
+) -> List[CcnScore]:
+    ...
+
+
+def score_node_measurements(
+    node_type: NodeType,
+    node_measurements: Sequence[Tuple[str, Union[CrnMeasurements, CcnMeasurements]]],
+) -> Sequence[AlephNodeScore]:
+    """Score the measurements of all the nodes of a type at once with the
+    compiled scoring formula."""
+    if not node_measurements:
+        return []
+
+    score_class: Type[AlephNodeScore] = CrnScore if node_type == "crn" else CcnScore
+    rows = [measurements.dict() for _, measurements in node_measurements]
+    fields = {name: np.array([row[name] for row in rows]) for name in rows[0]}
+    scores = get_score_function(node_type)(fields)
+
+    result: List[AlephNodeScore] = []
+    for position, (node_id, measurements) in enumerate(node_measurements):
+        if not sum(
+            rows[position][f"node_version_{annotation}"] for annotation in VERSION_ANNOTATIONS
+        ):
+            logger.warning(f"No version measurement for node {node_id}")
+        result.append(
+            score_class(
+                node_id=node_id,
+                measurements=measurements,
+                **{name: values[position].item() for name, values in scores.items()},
+            )
+        )
+    return result
+
+
+async def compute_crn_scores(
+    period: Period,
+    conn: Optional[asyncpg.Connection] = None,
+) -> List[CrnScore]:
+    """Compute the scores of the CRNs over a period.
+
+    A new database connection is opened unless `conn` is specified. The result
+    is cached when SCORE_CACHE_DIRECTORY is set.
+    """
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+
+    async def compute() -> List[CrnScore]:
+        if settings.SCORING_ENGINE == ScoringEngine.NUMPY:
+            return await compute_engine_scores("crn", period, conn=conn)
+
+        if settings.SCORING_ENGINE == ScoringEngine.ROLLUPS:
+            node_measurements = query_crn_rollup_measurements(conn, period)
+        else:
+            node_measurements = query_crn_measurements(conn, period)
+
+        return score_node_measurements(
+            "crn", [item async for item in node_measurements]
+        )
+
+    try:
+        result = await cached_scores(conn, "crn", period, CrnScore, compute)
+    finally:
+        if close_connection:
+            await conn.close()
+
+    logger.info(
+        "{} CRN nodes with a total score greater than zero".format(
+            len([x for x in result if x.total_score > 0])
+        )
+    )
+    return result
+
+
+async def query_ccn_measurements(
+    conn: asyncpg.connection,
+    period: Period,
+):
+    """Query the aggregated measurements and the ASN distribution of each CCN.
+
+    Both are computed in a single scan of the metrics posts.
+    """
+    async for node_id, measurements in stream_measurements(
+        conn, "ccn", "query_ccn_measurements.template.sql", CcnMeasurements, period
+    ):
+        yield node_id, measurements
+
+
+async def query_ccn_rollup_measurements(
+    conn: asyncpg.connection,
+    period: Period,
+):
+    rows = await query_rollup_measurements(conn, node_type="ccn", period=period)
+    for node_id, row in rows.items():
+        yield node_id, CcnMeasurements.parse_obj(row)
+
+
+async def compute_ccn_scores(
+    period: Period,
+    conn: Optional[asyncpg.Connection] = None,
+) -> List[CcnScore]:
+    """Compute the scores of the CCNs over a period.
+
+    A new database connection is opened unless `conn` is specified. The result
+    is cached when SCORE_CACHE_DIRECTORY is set.
+    """
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+
+    async def compute() -> List[CcnScore]:
+        if settings.SCORING_ENGINE == ScoringEngine.NUMPY:
+            return await compute_engine_scores("ccn", period, conn=conn)
+
+        if settings.SCORING_ENGINE == ScoringEngine.ROLLUPS:
+            node_measurements = query_ccn_rollup_measurements(conn, period)
+        else:
+            node_measurements = query_ccn_measurements(conn, period)
+
+        return score_node_measurements(
+            "ccn", [item async for item in node_measurements]
+        )
+
+    try:
+        result = await cached_scores(conn, "ccn", period, CcnScore, compute)
+    finally:
+        if close_connection:
+            await conn.close()
+
+    logger.info(
+        "{} CCN nodes with a total score greater than zero".format(
+            len([x for x in result if x.total_score > 0])
+        )
+    )
+    return result
+
+
+async def compute_scores_for_periods(periods: Sequence[Period]) -> List[NodeScores]:
+    """Compute the scores of several periods, such as 1, 7 and 14 days,
+    reading the measurements of all the periods once.
+
+    With the rollups engine, the periods are computed by merging nested
+    hourly rollups. Otherwise, the raw measurements are loaded once and
+    aggregated with the NumPy engine.
+    """
+    if settings.SCORING_ENGINE != ScoringEngine.ROLLUPS:
+        ccn_scores = await compute_engine_scores_for_periods("ccn", periods)
+        crn_scores = await compute_engine_scores_for_periods("crn", periods)
+        return [
+            NodeScores(ccn=ccn, crn=crn) for ccn, crn in zip(ccn_scores, crn_scores)
+        ]
+
+    conn = await database_connection(settings)
+    try:
+        ccn_measurements = await query_rollup_measurements_for_periods(
+            conn, "ccn", periods
+        )
+        crn_measurements = await query_rollup_measurements_for_periods(
+            conn, "crn", periods
+        )
+    finally:
+        await conn.close()
+
+    return [
+        NodeScores(
+            ccn=score_node_measurements(
+                "ccn",
+                [
+                    (node_id, CcnMeasurements.parse_obj(row))
+                    for node_id, row in ccn_rows.items()
+                ],
+            ),
+            crn=score_node_measurements(
+                "crn",
+                [
+                    (node_id, CrnMeasurements.parse_obj(row))
+                    for node_id, row in crn_rows.items()
+                ],
+            ),
+        )
+        for ccn_rows, crn_rows in zip(ccn_measurements, crn_measurements)
+    ]
+
+
+if __name__ == "__main__":
+    from aleph_scoring.releases import update_software_versions
+
+    logging.basicConfig(level=logging.INFO)
+
+    to_date = datetime.utcnow()
+    from_date = to_date - settings.SCORE_METRICS_PERIOD
+    current_period = Period(from_date=from_date, to_date=to_date)
+
+    asyncio.run(update_software_versions())
+
+    ccn_scores = asyncio.run(
+        compute_ccn_scores(
+            period=current_period,
+        )
+    )
+    crn_scores = asyncio.run(
+        compute_crn_scores(
+            period=current_period,
+        )
+    )
+
+    scores = NodeScores(
+        ccn=ccn_scores,
+        crn=crn_scores,
+    )
+    with open(Path(__file__).parent.parent.parent / "scores.json", "w") as fd:
+        fd.write(scores.json(indent=4))
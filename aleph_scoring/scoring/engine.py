@@ -0,0 +1,615 @@
+"""
+Vectorised scoring engine.
+
+Loads the measurements of a period into NumPy arrays, one per metric, and
+computes the percentiles, version counters, ASN distribution and scores of
+all nodes at once. The results are the same as the SQL queries and
+`compute_crn_scores`/`compute_ccn_scores`, but the raw measurements can come
+from any source and be scored repeatedly without a database round-trip.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    overload,
+)
+
+import asyncpg
+import numpy as np
+
+from aleph_scoring.config import settings
+from aleph_scoring.openmetrics import QUERY_DURATION
+from aleph_scoring.scoring.formula import get_score_function
+from aleph_scoring.scoring.metric_scores import MetricScore
+from aleph_scoring.scoring.partitions import read_measurements_query
+from aleph_scoring.scoring.models import (
+    AlephNodeScore,
+    BaseNodeMeasurements,
+    CcnMeasurements,
+    CcnScore,
+    CrnMeasurements,
+    CrnScore,
+)
+from aleph_scoring.scoring.rollups import (
+    NODE_TYPE_METRIC_SCORES,
+    NODE_TYPE_METRICS,
+    NODE_TYPE_SOFTWARE,
+    NodeType,
+)
+from aleph_scoring.utils import Period, database_connection
+
+if TYPE_CHECKING:
+    from aleph_scoring.metrics.models import AlephNodeMetrics
+
+logger = logging.getLogger(__name__)
+
+# Annotation codes, in the order of `annotate_version` plus missing and unknown versions
+ANNOTATIONS: Tuple[str, ...] = (
+    "latest",
+    "prerelease",
+    "outdated",
+    "obsolete",
+    "other",
+    "missing",
+    "unknown",
+)
+LATEST, PRERELEASE, OUTDATED, OBSOLETE, OTHER, MISSING, UNKNOWN = range(len(ANNOTATIONS))
+
+# ASN of the measurements where it is unknown
+MISSING_ASN = -1
+
+MetricsRow = Tuple[str, float, Optional[str], Optional[int], Sequence[Optional[float]]]
+
+
+def utc_timestamp(date: datetime) -> float:
+    """Timestamp of a datetime, naive datetimes being considered as UTC."""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+class SoftwareVersion(NamedTuple):
+    name: str
+    released_on: datetime
+    replaced_on: Optional[datetime]
+    prerelease: bool
+
+
+class VersionClassifier:
+    """Vectorised equivalent of the `annotate_version` SQL function."""
+
+    def __init__(self, versions: Iterable[SoftwareVersion]):
+        grace_period = settings.VERSION_GRACE_PERIOD.total_seconds()
+        self.versions: Dict[str, Tuple[float, float, float, int]] = {}
+        for version in versions:
+            replaced_on = (
+                utc_timestamp(version.replaced_on) if version.replaced_on else np.inf
+            )
+            self.versions[version.name] = (
+                utc_timestamp(version.released_on),
+                replaced_on,
+                replaced_on + grace_period,
+                PRERELEASE if version.prerelease else LATEST,
+            )
+
+    def annotate(
+        self,
+        version_names: Sequence[str],
+        version_codes: np.ndarray,
+        measured_at: np.ndarray,
+    ) -> np.ndarray:
+        """Return the annotation code of each measurement.
+
+        `version_codes` are indices in `version_names`, where the empty name
+        denotes a missing version.
+        """
+        annotations = np.full(len(version_codes), UNKNOWN, dtype=np.int8)
+        for code, name in enumerate(version_names):
+            rows = version_codes == code
+            if not name:
+                annotations[rows] = MISSING
+            elif name in self.versions:
+                released_on, replaced_on, obsolete_on, current = self.versions[name]
+                dates = measured_at[rows]
+                annotations[rows] = np.select(
+                    [
+                        dates < released_on,
+                        dates < replaced_on,
+                        dates < obsolete_on,
+                    ],
+                    [OTHER, current, OUTDATED],
+                    default=OBSOLETE,
+                )
+        return annotations
+
+
+class MetricsTable:
+    """Columnar representation of the measurements of one type of node."""
+
+    def __init__(
+        self,
+        node_ids: np.ndarray,
+        node_index: np.ndarray,
+        measured_at: np.ndarray,
+        metrics: Dict[str, np.ndarray],
+        version_names: List[str],
+        version_codes: np.ndarray,
+        asns: np.ndarray,
+        sorted_by_time: bool = False,
+    ):
+        self.node_ids = node_ids
+        self.node_index = node_index
+        self.measured_at = measured_at
+        self.metrics = metrics
+        self.version_names = version_names
+        self.version_codes = version_codes
+        self.asns = asns
+        self.sorted_by_time = sorted_by_time
+
+    def __len__(self) -> int:
+        return len(self.node_index)
+
+    @classmethod
+    def from_rows(
+        cls, rows: Iterable[MetricsRow], metrics: Sequence[str]
+    ) -> "MetricsTable":
+        """Build the table from (node_id, measured_at, version, asn, metric values) rows,
+        as returned by `query_node_metrics_rows.template.sql`."""
+        node_codes: Dict[str, int] = {}
+        version_codes: Dict[str, int] = {"": 0}
+        node_index: List[int] = []
+        measured_at: List[float] = []
+        versions: List[int] = []
+        asns: List[int] = []
+        values: List[Sequence[Optional[float]]] = []
+
+        for node_id, timestamp, version, asn, metric_values in rows:
+            node_index.append(node_codes.setdefault(node_id, len(node_codes)))
+            measured_at.append(timestamp)
+            versions.append(version_codes.setdefault(version or "", len(version_codes)))
+            asns.append(MISSING_ASN if asn is None else asn)
+            values.append(metric_values)
+
+        # None values become NaN
+        metric_array = np.array(values, dtype=np.float64).reshape(len(values), len(metrics))
+        return cls(
+            node_ids=np.array(list(node_codes), dtype=object),
+            node_index=np.array(node_index, dtype=np.int64),
+            measured_at=np.array(measured_at, dtype=np.float64),
+            metrics={
+                metric: metric_array[:, position] for position, metric in enumerate(metrics)
+            },
+            version_names=list(version_codes),
+            version_codes=np.array(versions, dtype=np.int64),
+            asns=np.array(asns, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_node_metrics(
+        cls, node_metrics: Iterable["AlephNodeMetrics"], metrics: Sequence[str]
+    ) -> "MetricsTable":
+        return cls.from_rows(
+            (
+                (
+                    node.node_id,
+                    node.measured_at,
+                    node.version,
+                    node.asn,
+                    [getattr(node, metric) for metric in metrics],
+                )
+                for node in node_metrics
+            ),
+            metrics=metrics,
+        )
+
+    @classmethod
+    def concatenate(
+        cls, tables: Sequence["MetricsTable"], metrics: Sequence[str]
+    ) -> "MetricsTable":
+        """Concatenate tables, merging their node ids and version names."""
+        node_codes: Dict[str, int] = {}
+        version_codes: Dict[str, int] = {"": 0}
+        node_index, version_index = [], []
+        for table in tables:
+            node_mapping = np.array(
+                [node_codes.setdefault(node_id, len(node_codes)) for node_id in table.node_ids],
+                dtype=np.int64,
+            )
+            version_mapping = np.array(
+                [
+                    version_codes.setdefault(name, len(version_codes))
+                    for name in table.version_names
+                ],
+                dtype=np.int64,
+            )
+            node_index.append(node_mapping[table.node_index])
+            version_index.append(version_mapping[table.version_codes])
+
+        def concatenate_column(columns, dtype):
+            return np.concatenate([np.empty(0, dtype=dtype), *columns])
+
+        return cls(
+            node_ids=np.array(list(node_codes), dtype=object),
+            node_index=concatenate_column(node_index, np.int64),
+            measured_at=concatenate_column(
+                [table.measured_at for table in tables], np.float64
+            ),
+            metrics={
+                metric: concatenate_column(
+                    [table.metrics[metric] for table in tables], np.float64
+                )
+                for metric in metrics
+            },
+            version_names=list(version_codes),
+            version_codes=concatenate_column(version_index, np.int64),
+            asns=concatenate_column([table.asns for table in tables], np.int64),
+        )
+
+    def select(self, rows: Union[np.ndarray, slice]) -> "MetricsTable":
+        """Return the measurements selected by a boolean mask, an index array or a slice."""
+        return MetricsTable(
+            node_ids=self.node_ids,
+            node_index=self.node_index[rows],
+            measured_at=self.measured_at[rows],
+            metrics={metric: values[rows] for metric, values in self.metrics.items()},
+            version_names=self.version_names,
+            version_codes=self.version_codes[rows],
+            asns=self.asns[rows],
+            sorted_by_time=self.sorted_by_time and isinstance(rows, slice),
+        )
+
+    def sort_by_time(self) -> "MetricsTable":
+        if self.sorted_by_time:
+            return self
+        table = self.select(np.argsort(self.measured_at, kind="stable"))
+        table.sorted_by_time = True
+        return table
+
+    def select_period(self, period: Period) -> "MetricsTable":
+        from_timestamp = utc_timestamp(period.from_date)
+        to_timestamp = utc_timestamp(period.to_date)
+        if self.sorted_by_time:
+            # Binary search instead of scanning every measurement
+            start, end = np.searchsorted(
+                self.measured_at, [from_timestamp, to_timestamp], side="left"
+            )
+            return self.select(slice(start, end))
+
+        return self.select(
+            (self.measured_at >= from_timestamp) & (self.measured_at < to_timestamp)
+        )
+
+
+def group_percentiles(
+    values: np.ndarray, groups: np.ndarray, group_count: int, quantiles: Iterable[float]
+) -> Dict[float, np.ndarray]:
+    """Compute `percentile_disc` of the values of each group.
+
+    The values are sorted once for all the quantiles. Groups without values
+    get NaN.
+    """
+    sorted_values = values[np.lexsort((values, groups))]
+    counts = np.bincount(groups, minlength=group_count)
+    starts = np.concatenate((np.zeros(1, dtype=counts.dtype), np.cumsum(counts)[:-1]))
+    present = counts > 0
+
+    result: Dict[float, np.ndarray] = {}
+    for q in quantiles:
+        # Same position as Postgres: ceil(q * count), starting at 1
+        positions = np.maximum(np.ceil(q * counts).astype(np.int64), 1) - 1
+        percentiles = np.full(group_count, np.nan)
+        percentiles[present] = sorted_values[starts[present] + positions[present]]
+        result[q] = percentiles
+    return result
+
+
+class NodeAggregates:
+    """Per-node aggregates, with the same fields as CrnMeasurements/CcnMeasurements."""
+
+    def __init__(self, node_ids: np.ndarray, fields: Dict[str, np.ndarray]):
+        self.node_ids = node_ids
+        self.fields = fields
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+
+def aggregate_metric_scores(
+    table: MetricsTable,
+    groups: np.ndarray,
+    group_count: int,
+    metric_scores: Iterable[MetricScore],
+) -> Dict[str, np.ndarray]:
+    definitions_by_metric: Dict[Tuple[str, float], List[MetricScore]] = {}
+    for definition in metric_scores:
+        key = (definition.metric, definition.missing_value)
+        definitions_by_metric.setdefault(key, []).append(definition)
+
+    fields: Dict[str, np.ndarray] = {}
+    for (metric, missing_value), definitions in definitions_by_metric.items():
+        values = table.metrics[metric]
+        values = np.where(np.isnan(values), missing_value, values)
+        percentiles = group_percentiles(
+            values,
+            groups,
+            group_count,
+            {definition.percentile for definition in definitions},
+        )
+        for definition in definitions:
+            fields[definition.field] = np.clip(
+                definition.offset - percentiles[definition.percentile] / definition.divisor,
+                0,
+                1,
+            )
+    return fields
+
+
+def aggregate_asn_info(
+    groups: np.ndarray, group_count: int, asns: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """Same ASN distribution as the measurement queries: every distinct (node, ASN)
+    pair counts as one node, and each node keeps its known ASN shared by the
+    most nodes."""
+    pairs = np.unique(np.stack([groups, asns], axis=1), axis=0)
+    pair_nodes, pair_asns = pairs[:, 0], pairs[:, 1]
+    distinct_asns, asn_indices, asn_counts = np.unique(
+        pair_asns, return_inverse=True, return_counts=True
+    )
+    pair_identical = asn_counts[asn_indices.reshape(-1)]
+
+    order = np.lexsort(
+        (pair_asns, -pair_identical, pair_asns == MISSING_ASN, pair_nodes)
+    )
+    _, first = np.unique(pair_nodes[order], return_index=True)
+    selected = order[first]
+
+    asn = np.full(group_count, MISSING_ASN, dtype=np.int64)
+    nodes_with_identical_asn = np.zeros(group_count, dtype=np.int64)
+    asn[pair_nodes[selected]] = pair_asns[selected]
+    nodes_with_identical_asn[pair_nodes[selected]] = pair_identical[selected]
+    return {
+        "asn": asn,
+        "total_nodes": np.full(group_count, len(pairs), dtype=np.int64),
+        "nodes_with_identical_asn": nodes_with_identical_asn,
+    }
+
+
+def aggregate(
+    table: MetricsTable,
+    node_type: NodeType,
+    classifier: VersionClassifier,
+    metric_scores: Optional[Iterable[MetricScore]] = None,
+) -> NodeAggregates:
+    """Compute the aggregates of every node that has measurements in the table.
+
+    The percentile scores are those of the node type unless `metric_scores` is specified.
+    """
+    if not len(table):
+        return NodeAggregates(node_ids=np.array([], dtype=object), fields={})
+
+    node_codes, groups = np.unique(table.node_index, return_inverse=True)
+    groups = groups.reshape(-1)
+    group_count = len(node_codes)
+
+    if metric_scores is None:
+        metric_scores = NODE_TYPE_METRIC_SCORES[node_type]
+    fields = aggregate_metric_scores(table, groups, group_count, metric_scores)
+
+    annotations = classifier.annotate(
+        table.version_names, table.version_codes, table.measured_at
+    )
+    version_counts = np.bincount(
+        groups * len(ANNOTATIONS) + annotations,
+        minlength=group_count * len(ANNOTATIONS),
+    ).reshape(group_count, len(ANNOTATIONS))
+    for code, annotation in enumerate(ANNOTATIONS):
+        if code != UNKNOWN:
+            fields[f"node_version_{annotation}"] = version_counts[:, code]
+
+    fields.update(aggregate_asn_info(groups, group_count, table.asns))
+    return NodeAggregates(node_ids=table.node_ids[node_codes], fields=fields)
+
+
+def compute_scores(
+    node_type: NodeType, fields: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """Score the aggregates of all the nodes with the compiled scoring formula."""
+    if not fields:
+        return {}
+    return get_score_function(node_type)(fields)
+
+
+def to_node_scores(
+    node_type: NodeType, aggregates: NodeAggregates, scores: Dict[str, np.ndarray]
+) -> List[AlephNodeScore]:
+    measurements_class: Type[BaseNodeMeasurements] = (
+        CrnMeasurements if node_type == "crn" else CcnMeasurements
+    )
+    score_class: Type[AlephNodeScore] = CrnScore if node_type == "crn" else CcnScore
+
+    result: List[AlephNodeScore] = []
+    for position, node_id in enumerate(aggregates.node_ids):
+        measurements = measurements_class.parse_obj(
+            {name: values[position].item() for name, values in aggregates.fields.items()}
+        )
+        result.append(
+            score_class(
+                node_id=node_id,
+                measurements=measurements,
+                **{name: values[position].item() for name, values in scores.items()},
+            )
+        )
+    return result
+
+
+@overload
+def score_metrics_table(
+    table: MetricsTable, node_type: Literal["ccn"], classifier: VersionClassifier
+) -> List[CcnScore]:
+    ...
+
+
+@overload
+def score_metrics_table(
+    table: MetricsTable, node_type: Literal["crn"], classifier: VersionClassifier
+) -> List[CrnScore]:
+    ...
+
+
+def score_metrics_table(
+    table: MetricsTable, node_type: NodeType, classifier: VersionClassifier
+) -> Sequence[AlephNodeScore]:
+    aggregates = aggregate(table, node_type, classifier)
+    return to_node_scores(
+        node_type, aggregates, compute_scores(node_type, aggregates.fields)
+    )
+
+
+async def load_metrics_table(
+    conn: asyncpg.Connection, node_type: NodeType, period: Period
+) -> MetricsTable:
+    metrics = NODE_TYPE_METRICS[node_type]
+    with QUERY_DURATION.time("query_node_metrics_rows"):
+        values = await conn.fetch(
+            read_measurements_query("query_node_metrics_rows.template.sql"),
+            settings.ALLOWED_METRICS_SENDER,
+            settings.ALEPH_POST_TYPE_METRICS,
+            period.from_date,
+            period.to_date,
+            node_type,
+            list(metrics),
+        )
+    return MetricsTable.from_rows(
+        (
+            (
+                record["node_id"],
+                record["measured_at"],
+                record["version"],
+                record["asn"],
+                record["metric_values"],
+            )
+            for record in values
+        ),
+        metrics=metrics,
+    )
+
+
+async def load_version_classifier(
+    conn: asyncpg.Connection, node_type: NodeType
+) -> VersionClassifier:
+    values = await conn.fetch(
+        "SELECT name, released_on, replaced_on, prerelease "
+        "FROM software_versions WHERE software = $1",
+        NODE_TYPE_SOFTWARE[node_type],
+    )
+    return VersionClassifier(SoftwareVersion(*record) for record in values)
+
+
+@overload
+async def compute_engine_scores_for_periods(
+    node_type: Literal["ccn"],
+    periods: Sequence[Period],
+    conn: Optional[asyncpg.Connection] = None,
+) -> List[List[CcnScore]]:
+    ...
+
+
+@overload
+async def compute_engine_scores_for_periods(
+    node_type: Literal["crn"],
+    periods: Sequence[Period],
+    conn: Optional[asyncpg.Connection] = None,
+) -> List[List[CrnScore]]:
+    ...
+
+
+async def compute_engine_scores_for_periods(
+    node_type: NodeType,
+    periods: Sequence[Period],
+    conn: Optional[asyncpg.Connection] = None,
+) -> Sequence[Sequence[AlephNodeScore]]:
+    """Score several periods from a single read of the measurements.
+
+    A new database connection is opened unless `conn` is specified.
+    """
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+    try:
+        table = await load_metrics_table(
+            conn,
+            node_type,
+            Period(
+                from_date=min(period.from_date for period in periods),
+                to_date=max(period.to_date for period in periods),
+            ),
+        )
+        classifier = await load_version_classifier(conn, node_type)
+    finally:
+        if close_connection:
+            await conn.close()
+
+    table = table.sort_by_time()
+    return [
+        score_metrics_table(table.select_period(period), node_type, classifier)
+        for period in periods
+    ]
+
+
+@overload
+async def compute_engine_scores(
+    node_type: Literal["ccn"], period: Period, conn: Optional[asyncpg.Connection] = None
+) -> List[CcnScore]:
+    ...
+
+
+@overload
+async def compute_engine_scores(
+    node_type: Literal["crn"], period: Period, conn: Optional[asyncpg.Connection] = None
+) -> List[CrnScore]:
+    ...
+
+
+async def compute_engine_scores(
+    node_type: NodeType, period: Period, conn: Optional[asyncpg.Connection] = None
+) -> Sequence[AlephNodeScore]:
+    return (await compute_engine_scores_for_periods(node_type, [period], conn=conn))[0]
+
+
+def compare_scores(
+    expected: Sequence[Union[CcnScore, CrnScore]],
+    actual: Sequence[Union[CcnScore, CrnScore]],
+    tolerance: float = 1e-9,
+) -> List[str]:
+    """List the differences between two sets of scores of the same nodes."""
+    differences = []
+    actual_by_node = {score.node_id: score for score in actual}
+    for expected_score in expected:
+        actual_score = actual_by_node.pop(expected_score.node_id, None)
+        if actual_score is None:
+            differences.append(f"{expected_score.node_id}: missing")
+            continue
+
+        expected_values = expected_score.dict(exclude={"node_id"})
+        expected_values.update(expected_values.pop("measurements"))
+        actual_values = actual_score.dict(exclude={"node_id"})
+        actual_values.update(actual_values.pop("measurements"))
+        for name, expected_value in expected_values.items():
+            if abs(expected_value - actual_values[name]) > tolerance:
+                differences.append(
+                    f"{expected_score.node_id}: {name} is {actual_values[name]}, "
+                    f"expected {expected_value}"
+                )
+
+    differences.extend(f"{node_id}: unexpected" for node_id in actual_by_node)
+    return differences
@@ -0,0 +1,173 @@
+"""
+Declarative scoring formulas.
+
+A `FormulaSpec` lists the factors of the performance score of each node type
+with their weights, the thresholds of the version score and the weights of the
+total score. It is compiled once into a function that scores every node of a
+batch with a few array operations, whatever the number of factors.
+
+The default spec reproduces the historical formulas. Another spec can be
+loaded from the JSON file set in SCORING_FORMULA_FILE.
+"""
+import hashlib
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from pydantic import BaseModel, validator
+
+from aleph_scoring.config import settings
+
+VERSION_ANNOTATIONS = ("latest", "prerelease", "outdated", "obsolete", "other", "missing")
+
+ScoreFunction = Callable[[Dict[str, np.ndarray]], Dict[str, np.ndarray]]
+
+
+class PerformanceFactor(BaseModel):
+    # Field of CrnMeasurements/CcnMeasurements, between 0 and 1
+    field: str
+    weight: float = 1.0
+
+
+class NodeTypeFormula(BaseModel):
+    # The performance score is the weighted geometric mean of the factors
+    performance_factors: List[PerformanceFactor]
+
+    @validator("performance_factors")
+    def check_weights(cls, factors: List[PerformanceFactor]) -> List[PerformanceFactor]:
+        if any(factor.weight < 0 for factor in factors):
+            raise ValueError("Negative weight")
+        if not sum(factor.weight for factor in factors):
+            raise ValueError("At least one factor must have a positive weight")
+        return factors
+
+
+class FormulaSpec(BaseModel):
+    crn: NodeTypeFormula
+    ccn: NodeTypeFormula
+
+    # Versions counted as up to date in the version score
+    valid_versions: List[str] = ["latest", "outdated", "prerelease"]
+    # The version score is 0 when there are more missing versions than this
+    # ratio of the known versions
+    max_missing_version_ratio: float = 0.2
+    decentralization_exponent: float = 2.0
+    # The total score is the weighted geometric mean of these scores
+    performance_weight: float = 1.0
+    version_weight: float = 1.0
+
+    @validator("valid_versions", each_item=True)
+    def check_version(cls, version: str) -> str:
+        if version not in VERSION_ANNOTATIONS:
+            raise ValueError(f"Unknown version annotation: {version}")
+        return version
+
+
+DEFAULT_FORMULA = FormulaSpec(
+    crn=NodeTypeFormula(
+        performance_factors=[
+            PerformanceFactor(field="base_latency_score_p25"),
+            PerformanceFactor(field="base_latency_score_p95"),
+            PerformanceFactor(field="diagnostic_vm_latency_score_p25"),
+            # Suspended since most nodes have very bad values
+            PerformanceFactor(field="diagnostic_vm_latency_score_p95", weight=0),
+            PerformanceFactor(field="full_check_latency_score_p25"),
+            # Suspended since most nodes have very bad values
+            PerformanceFactor(field="full_check_latency_score_p95", weight=0),
+        ]
+    ),
+    ccn=NodeTypeFormula(
+        performance_factors=[
+            PerformanceFactor(field="base_latency_score_p25"),
+            PerformanceFactor(field="base_latency_score_p95"),
+            PerformanceFactor(field="metrics_latency_score_p25"),
+            PerformanceFactor(field="metrics_latency_score_p95"),
+            PerformanceFactor(field="aggregate_latency_score_p25"),
+            PerformanceFactor(field="aggregate_latency_score_p95"),
+            PerformanceFactor(field="file_download_latency_score_p25", weight=0),
+            PerformanceFactor(field="file_download_latency_score_p95", weight=0),
+            PerformanceFactor(field="eth_height_remaining_score_p25", weight=0),
+            PerformanceFactor(field="eth_height_remaining_score_p95", weight=0),
+        ]
+    ),
+)
+
+
+def compile_formula(spec: FormulaSpec, node_type: str) -> ScoreFunction:
+    """Compile the formula of a node type into a function that takes the
+    aggregates of all the nodes, one array per field, and returns their scores."""
+    factors = [
+        factor
+        for factor in getattr(spec, node_type).performance_factors
+        if factor.weight > 0
+    ]
+    factor_fields = [factor.field for factor in factors]
+    factor_exponents = np.array([factor.weight for factor in factors])
+    factor_exponents /= factor_exponents.sum()
+
+    valid_versions = [f"node_version_{version}" for version in spec.valid_versions]
+    known_versions = [
+        f"node_version_{version}" for version in VERSION_ANNOTATIONS if version != "missing"
+    ]
+    max_missing_ratio = spec.max_missing_version_ratio
+    decentralization_exponent = spec.decentralization_exponent
+    total_weight = spec.performance_weight + spec.version_weight
+    performance_exponent = spec.performance_weight / total_weight
+    version_exponent = spec.version_weight / total_weight
+
+    def score(fields: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        # Weighted geometric mean of all the factors of all the nodes at once
+        factor_values = np.stack(
+            [np.asarray(fields[field], dtype=np.float64) for field in factor_fields], axis=1
+        )
+        with np.errstate(divide="ignore"):
+            performance = np.exp(np.log(factor_values) @ factor_exponents)
+
+        valid = np.sum([fields[field] for field in valid_versions], axis=0)
+        known = np.sum([fields[field] for field in known_versions], axis=0)
+        missing = fields["node_version_missing"]
+        total = known + missing
+        ratio = np.divide(
+            valid,
+            total,
+            out=np.zeros(len(total), dtype=np.float64),
+            where=total > 0,
+        )
+        version = np.where((total == 0) | (missing > known * max_missing_ratio), 0.0, ratio)
+
+        decentralization = (
+            1 - fields["nodes_with_identical_asn"] / fields["total_nodes"]
+        ) ** decentralization_exponent
+
+        return {
+            "total_score": performance**performance_exponent * version**version_exponent,
+            "performance": performance,
+            "version": version,
+            "decentralization": decentralization,
+        }
+
+    return score
+
+
+def load_formula(path: Optional[Path] = None) -> FormulaSpec:
+    if path is None:
+        return DEFAULT_FORMULA
+    return FormulaSpec.parse_file(path)
+
+
+@lru_cache(maxsize=None)
+def _compiled_formulas(path: Optional[Path]) -> Dict[str, ScoreFunction]:
+    spec = load_formula(path)
+    return {node_type: compile_formula(spec, node_type) for node_type in ("ccn", "crn")}
+
+
+def get_score_function(node_type: str) -> ScoreFunction:
+    """Compiled formula of the node type, from SCORING_FORMULA_FILE or the default spec."""
+    return _compiled_formulas(settings.SCORING_FORMULA_FILE)[node_type]
+
+
+def formula_checksum() -> str:
+    spec = load_formula(settings.SCORING_FORMULA_FILE)
+    return hashlib.sha256(json.dumps(spec.dict(), sort_keys=True).encode()).hexdigest()
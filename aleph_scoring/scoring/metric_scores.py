@@ -0,0 +1,83 @@
+"""
+Definitions of the per-metric percentile scores.
+
+These mirror the `greatest(least(offset - percentile_disc(...) / divisor, 1), 0)`
+expressions of `query_crn_measurements.template.sql` and
+`query_ccn_measurements.template.sql`, so that the scores can also be computed
+outside of Postgres.
+"""
+from typing import NamedTuple, Optional, Tuple
+
+# Part of the key of the score cache, increment it when a scoring formula changes
+SCORING_FORMULA_VERSION = 1
+
+
+class MetricScore(NamedTuple):
+    # Name of the field in CrnMeasurements/CcnMeasurements
+    field: str
+    # Name of the raw metric in CrnMetrics/CcnMetrics
+    metric: str
+    percentile: float
+    divisor: float
+    offset: float = 1.0
+    # Value used in place of missing measurements, see COALESCE in the queries
+    missing_value: float = 100.0
+
+
+CRN_METRICS: Tuple[str, ...] = (
+    "base_latency",
+    "diagnostic_vm_latency",
+    "full_check_latency",
+)
+
+CCN_METRICS: Tuple[str, ...] = (
+    "base_latency",
+    "metrics_latency",
+    "aggregate_latency",
+    "file_download_latency",
+    "eth_height_remaining",
+)
+
+CRN_METRIC_SCORES: Tuple[MetricScore, ...] = (
+    MetricScore("base_latency_score_p25", "base_latency", 0.25, 2),
+    MetricScore("base_latency_score_p95", "base_latency", 0.95, 2),
+    MetricScore("diagnostic_vm_latency_score_p25", "diagnostic_vm_latency", 0.25, 2.5),
+    MetricScore("diagnostic_vm_latency_score_p95", "diagnostic_vm_latency", 0.95, 2.5),
+    MetricScore("full_check_latency_score_p25", "full_check_latency", 0.25, 4),
+    MetricScore("full_check_latency_score_p95", "full_check_latency", 0.95, 4),
+)
+
+# The CCN query uses the 80th percentile for the fields named `_p95`.
+CCN_METRIC_SCORES: Tuple[MetricScore, ...] = (
+    MetricScore("base_latency_score_p25", "base_latency", 0.25, 2),
+    MetricScore("base_latency_score_p95", "base_latency", 0.80, 4),
+    MetricScore("metrics_latency_score_p25", "metrics_latency", 0.25, 2.5),
+    MetricScore("metrics_latency_score_p95", "metrics_latency", 0.80, 5),
+    MetricScore("aggregate_latency_score_p25", "aggregate_latency", 0.25, 4),
+    MetricScore("aggregate_latency_score_p95", "aggregate_latency", 0.80, 8),
+    MetricScore("file_download_latency_score_p25", "file_download_latency", 0.25, 4),
+    MetricScore("file_download_latency_score_p95", "file_download_latency", 0.80, 8),
+    MetricScore(
+        "eth_height_remaining_score_p25",
+        "eth_height_remaining",
+        0.25,
+        100,
+        offset=1.5,
+        missing_value=1000.0,
+    ),
+    MetricScore(
+        "eth_height_remaining_score_p95",
+        "eth_height_remaining",
+        0.80,
+        275,
+        offset=2,
+        missing_value=1000.0,
+    ),
+)
+
+
+def percentile_score(definition: MetricScore, percentile: Optional[float]) -> float:
+    """Convert a percentile of a metric into a score between 0 and 1."""
+    if percentile is None:
+        percentile = definition.missing_value
+    return max(min(definition.offset - percentile / definition.divisor, 1.0), 0.0)
@@ -0,0 +1,199 @@
+"""
+Installation and upgrade of the database objects of the scoring.
+
+The migrations apply the SQL files of `aleph_scoring/scoring/sql` in order and
+are recorded with the checksum of their SQL in the `schema_migrations` ledger.
+Repeatable migrations, for functions and views, are applied again when their
+SQL changes. After migrating, the plans of the scoring queries are checked so
+that a missing index does not silently turn them into sequential scans of a
+large table.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import asyncpg
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring.partitions import read_measurements_query
+from aleph_scoring.scoring.rollups import NODE_TYPE_METRICS
+from aleph_scoring.utils import Period, read_sql_file
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock that prevents concurrent migrations
+MIGRATIONS_LOCK = 7_345_912
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    files: Tuple[str, ...]
+    # Applied again when its SQL changes. The SQL must be idempotent.
+    repeatable: bool = False
+    # Run outside of a transaction, one statement per file, for CREATE INDEX CONCURRENTLY
+    transactional: bool = True
+
+    def sql(self) -> List[str]:
+        return [read_sql_file(filename) for filename in self.files]
+
+    def checksum(self) -> str:
+        return hashlib.sha256("\n".join(self.sql()).encode()).hexdigest()
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "posts", ("posts_table.sql",)),
+    Migration(2, "software_versions", ("software_versions_table.sql",)),
+    Migration(3, "annotate_version", ("software_versions_function.sql",), repeatable=True),
+    Migration(
+        4, "software_version_intervals", ("software_version_intervals.sql",), repeatable=True
+    ),
+    Migration(5, "node_metrics_hourly_rollups", ("node_metrics_rollups_table.sql",)),
+    Migration(6, "node_scores_history", ("node_scores_history_table.sql",)),
+    Migration(7, "ingest_checkpoints", ("ingest_checkpoints_table.sql",)),
+    Migration(8, "node_measurements", ("node_measurements_table.sql",)),
+    Migration(9, "posts_indexes", ("posts_indexes.sql",), transactional=False),
+)
+
+
+class AppliedMigration(NamedTuple):
+    version: int
+    name: str
+    checksum: str
+    applied_at: datetime
+
+
+async def get_applied_migrations(conn: asyncpg.Connection) -> Dict[int, AppliedMigration]:
+    await conn.execute(read_sql_file("schema_migrations_table.sql"))
+    records = await conn.fetch(
+        "SELECT version, name, checksum, applied_at FROM schema_migrations"
+    )
+    return {record["version"]: AppliedMigration(*record) for record in records}
+
+
+def pending_migrations(
+    migrations: Sequence[Migration], applied: Dict[int, AppliedMigration]
+) -> List[Migration]:
+    """List the migrations to apply: the new ones, and the repeatable ones
+    whose SQL changed. A versioned migration that changed after being applied
+    is an error."""
+    pending = []
+    for migration in migrations:
+        applied_migration = applied.get(migration.version)
+        if applied_migration is None:
+            pending.append(migration)
+        elif applied_migration.checksum != migration.checksum():
+            if not migration.repeatable:
+                raise ValueError(
+                    f"Migration {migration.version} ({migration.name}) was modified "
+                    "after being applied, add a new migration instead"
+                )
+            pending.append(migration)
+    return pending
+
+
+async def apply_migration(conn: asyncpg.Connection, migration: Migration) -> None:
+    record_sql = """
+        INSERT INTO schema_migrations (version, name, checksum)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (version) DO UPDATE
+            SET name       = excluded.name,
+                checksum   = excluded.checksum,
+                applied_at = now()
+    """
+    if migration.transactional:
+        async with conn.transaction():
+            for sql in migration.sql():
+                await conn.execute(sql)
+            await conn.execute(
+                record_sql, migration.version, migration.name, migration.checksum()
+            )
+    else:
+        for sql in migration.sql():
+            await conn.execute(sql)
+        await conn.execute(record_sql, migration.version, migration.name, migration.checksum())
+    logger.info("Applied migration %d (%s)", migration.version, migration.name)
+
+
+async def migrate(conn: asyncpg.Connection, dry_run: bool = False) -> List[Migration]:
+    """Apply the pending migrations. Returns the applied migrations."""
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK)
+    try:
+        pending = pending_migrations(MIGRATIONS, await get_applied_migrations(conn))
+        if not dry_run:
+            for migration in pending:
+                await apply_migration(conn, migration)
+        return pending
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK)
+
+
+def sequential_scans(plan: Dict[str, Any]) -> Iterator[str]:
+    """Names of the relations read by a sequential scan in a JSON query plan."""
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from sequential_scans(child)
+
+
+def scoring_queries(period: Optional[Period] = None) -> List[Tuple[str, str, Tuple]]:
+    """The scoring queries, with the parameters of a period, by default the
+    current scoring period."""
+    if period is None:
+        to_date = datetime.utcnow()
+        period = Period(from_date=to_date - settings.SCORE_METRICS_PERIOD, to_date=to_date)
+    measurement_args: Tuple[Any, ...] = (
+        settings.ALLOWED_METRICS_SENDER,
+        settings.ALEPH_POST_TYPE_METRICS,
+        period.from_date,
+        period.to_date,
+    )
+    return [
+        (
+            f"query_{node_type}_measurements",
+            read_measurements_query(f"query_{node_type}_measurements.template.sql"),
+            (*measurement_args, node_type),
+        )
+        for node_type in ("ccn", "crn")
+    ] + [
+        (
+            "query_node_metrics_rows",
+            read_measurements_query("query_node_metrics_rows.template.sql"),
+            (*measurement_args, "crn", list(NODE_TYPE_METRICS["crn"])),
+        ),
+        (
+            "query_data_watermark",
+            read_sql_file("query_data_watermark.template.sql"),
+            measurement_args[:2],
+        ),
+    ]
+
+
+async def check_query_plans(conn: asyncpg.Connection, max_rows: float) -> List[str]:
+    """Explain the scoring queries and list the sequential scans of tables of
+    more than `max_rows` rows, according to the statistics of Postgres."""
+    problems = []
+    for name, sql, args in scoring_queries():
+        plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))
+        for relation in set(sequential_scans(plan[0]["Plan"])):
+            rows = await conn.fetchval(
+                "SELECT reltuples FROM pg_class WHERE relname = $1", relation
+            )
+            if rows is not None and rows > max_rows:
+                problems.append(
+                    f"{name}: sequential scan of {relation} (about {int(rows)} rows)"
+                )
+    return problems
+
+
+async def check_version_intervals(conn: asyncpg.Connection) -> List[str]:
+    """Run `test_software_version_intervals.sql`, that lists the versions and dates
+    where the intervals and `annotate_version` disagree."""
+    records = await conn.fetch(read_sql_file("test_software_version_intervals.sql"))
+    return [
+        f"software_version_intervals: {record['software']} {record['name']} at "
+        f"{record['version_date']} is {record['annotation']}, expected {record['expected']}"
+        for record in records
+    ]
@@ -1,4 +1,5 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple, Union
 
 from pydantic import BaseModel, ConstrainedFloat
 
@@ -45,6 +46,16 @@ class CcnMeasurements(BaseNodeMeasurements):
     eth_height_remaining_score_p95: float
 
 
+class SoftwareVersionRecord(BaseModel):
+    """Row of the `software_versions` table, exported as JSON."""
+
+    software: str
+    name: str
+    released_on: datetime
+    replaced_on: Optional[datetime]
+    prerelease: bool = False
+
+
 class AlephNodeScore(BaseModel):
     node_id: str
     total_score: Score
@@ -65,9 +76,67 @@ class NodeScores(BaseModel):
     ccn: List[CcnScore]
     crn: List[CrnScore]
 
+    def by_node_type(self) -> List[Tuple[str, Sequence[Union[CcnScore, CrnScore]]]]:
+        return [("ccn", self.ccn), ("crn", self.crn)]
+
+
+class WindowScores(BaseModel):
+    period: Period
+    scores: NodeScores
+
+
+class MultiWindowScores(BaseModel):
+    windows: List[WindowScores]
+
 
 class NodeScoresPost(BaseModel):
     version: str = "1.1"
     tags: List[str]
     period: Period
     scores: NodeScores
+
+
+class NodeScoreSummaries(BaseModel):
+    ccn: List[AlephNodeScore]
+    crn: List[AlephNodeScore]
+
+
+class ScoresDetailReference(BaseModel):
+    # Hash of the file in the Aleph storage
+    item_hash: str
+    size: int
+    encoding: str = "columnar-json"
+
+
+class CompactNodeScoresPost(BaseModel):
+    """Scores post without the measurements, which are published as a
+    separate file, see aleph_scoring/publication.py."""
+
+    version: str = "2.0"
+    tags: List[str]
+    period: Period
+    scores: NodeScoreSummaries
+    detail: ScoresDetailReference
+
+
+class RemovedNodes(BaseModel):
+    ccn: List[str] = []
+    crn: List[str] = []
+
+
+class NodeScoresDeltaPost(BaseModel):
+    """Scores that changed since the previous scores post of a chain that
+    starts at a full scores post, the checkpoint."""
+
+    version: str = "2.0"
+    tags: List[str]
+    period: Period
+    # Item hashes of the checkpoint and of the previous post of the chain
+    checkpoint: str
+    previous: str
+    # Position in the chain, starting at 1 after the checkpoint
+    sequence: int
+    threshold: float
+    # Nodes with a score that changed by more than the threshold, or new nodes
+    scores: NodeScoreSummaries
+    removed: RemovedNodes
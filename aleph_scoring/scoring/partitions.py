@@ -0,0 +1,252 @@
+"""
+Time-partitioned storage of the measurements.
+
+The measurements of the metrics posts are copied into `node_measurements`, a
+table partitioned by measurement time into daily or weekly ranges. The scoring
+queries then only read the partitions that overlap their period, and the
+partitions older than MEASUREMENT_RETENTION are detached, archived or dropped
+instead of growing the tables and indexes forever.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import asyncpg
+
+from aleph_scoring.config import PartitionInterval, settings
+from aleph_scoring.utils import database_connection, read_sql_file
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "node_measurements"
+# Name of the checkpoint of the copy from the posts, in `ingest_checkpoints`
+SYNC_CHECKPOINT = "node_measurements"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class Partition(NamedTuple):
+    name: str
+    from_date: datetime
+    to_date: datetime
+
+
+def read_measurements_query(filename: str) -> str:
+    """Read a query that selects its measurements from the `measurement` CTE,
+    with the measurement source of the current storage."""
+    source = (
+        "measurements_from_partitions.template.sql"
+        if settings.PARTITIONED_MEASUREMENTS
+        else "measurements_from_posts.template.sql"
+    )
+    return read_sql_file(filename).replace(
+        "/* measurement source */", read_sql_file(source).rstrip()
+    )
+
+
+def partition_start(date: datetime, interval: PartitionInterval) -> datetime:
+    start = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == PartitionInterval.WEEK:
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_length(interval: PartitionInterval) -> timedelta:
+    return timedelta(weeks=1) if interval == PartitionInterval.WEEK else timedelta(days=1)
+
+
+def partitions_between(
+    from_date: datetime, to_date: datetime, interval: PartitionInterval
+) -> List[Partition]:
+    """List the partitions that cover [from_date, to_date[."""
+    partitions = []
+    start = partition_start(from_date, interval)
+    while start < to_date:
+        end = start + partition_length(interval)
+        partitions.append(
+            Partition(
+                name=f"{PARTITIONED_TABLE}_{start:%Y%m%d}", from_date=start, to_date=end
+            )
+        )
+        start = end
+    return partitions
+
+
+async def create_partitioned_table(conn: asyncpg.Connection) -> None:
+    await conn.execute(read_sql_file("ingest_checkpoints_table.sql"))
+    await conn.execute(read_sql_file("node_measurements_table.sql"))
+
+
+async def list_partitions(conn: asyncpg.Connection) -> List[Partition]:
+    """List the attached range partitions, oldest first. A default partition
+    is not listed."""
+    records = await conn.fetch(
+        """
+        SELECT child.relname                                                    as name,
+               pg_get_expr(child.relpartbound, child.oid)                      as bound
+        FROM pg_inherits
+                 JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        WHERE pg_inherits.inhparent = $1::regclass
+        """,
+        PARTITIONED_TABLE,
+    )
+    partitions = []
+    for record in records:
+        if record["bound"] == "DEFAULT":
+            continue
+        # FOR VALUES FROM ('2023-04-15 00:00:00') TO ('2023-04-16 00:00:00')
+        bounds = record["bound"].split("'")
+        partitions.append(
+            Partition(
+                name=record["name"],
+                from_date=datetime.fromisoformat(bounds[1]),
+                to_date=datetime.fromisoformat(bounds[3]),
+            )
+        )
+    return sorted(partitions, key=lambda partition: partition.from_date)
+
+
+async def create_partitions(
+    conn: asyncpg.Connection,
+    from_date: datetime,
+    to_date: datetime,
+    interval: PartitionInterval,
+) -> List[Partition]:
+    """Create the missing partitions between the two dates. Returns the new partitions."""
+    existing = {partition.name for partition in await list_partitions(conn)}
+    created = []
+    for partition in partitions_between(from_date, to_date, interval):
+        if partition.name in existing:
+            continue
+        await conn.execute(
+            f"CREATE TABLE {partition.name} PARTITION OF {PARTITIONED_TABLE} "
+            f"FOR VALUES FROM ('{partition.from_date.isoformat()}') "
+            f"TO ('{partition.to_date.isoformat()}')"
+        )
+        logger.info("Created partition %s", partition.name)
+        created.append(partition)
+    return created
+
+
+async def prune_partitions(
+    conn: asyncpg.Connection,
+    before: datetime,
+    archive_directory: Optional[Path] = None,
+    drop: bool = True,
+) -> List[Partition]:
+    """Detach the partitions that end before the date.
+
+    Their rows are saved as CSV in the archive directory if specified, and the
+    detached tables are dropped unless `drop` is False.
+    """
+    pruned = []
+    for partition in await list_partitions(conn):
+        if partition.to_date > before:
+            continue
+
+        await conn.execute(
+            f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {partition.name}"
+        )
+        if archive_directory:
+            archive_directory.mkdir(parents=True, exist_ok=True)
+            await conn.copy_from_table(
+                partition.name,
+                output=archive_directory / f"{partition.name}.csv",
+                format="csv",
+                header=True,
+            )
+        if drop:
+            await conn.execute(f"DROP TABLE {partition.name}")
+        logger.info(
+            "%s partition %s", "Dropped" if drop else "Detached", partition.name
+        )
+        pruned.append(partition)
+    return pruned
+
+
+async def sync_measurements(conn: asyncpg.Connection) -> int:
+    """Copy the measurements of the posts created since the last copy into
+    the partitions. Returns the number of new measurements.
+
+    The posts created in the MEASUREMENT_SYNC_LATENESS before the last copy
+    are read again, as posts can be indexed after newer ones were copied. Their
+    measurements that were already copied are skipped.
+    """
+    partitions = await list_partitions(conn)
+    if not partitions:
+        logger.warning("No partition of %s, nothing to copy", PARTITIONED_TABLE)
+        return 0
+
+    last_post_time = await conn.fetchval(
+        "SELECT last_post_time FROM ingest_checkpoints WHERE source = $1", SYNC_CHECKPOINT
+    )
+    latest_post_time = await conn.fetchval(
+        "SELECT max(creation_datetime) FROM posts WHERE owner = $1 AND type = $2",
+        settings.ALLOWED_METRICS_SENDER,
+        settings.ALEPH_POST_TYPE_METRICS,
+    )
+    if latest_post_time is None:
+        return 0
+
+    async with conn.transaction():
+        status = await conn.execute(
+            read_sql_file("sync_node_measurements.template.sql"),
+            settings.ALLOWED_METRICS_SENDER,
+            settings.ALEPH_POST_TYPE_METRICS,
+            last_post_time - settings.MEASUREMENT_SYNC_LATENESS if last_post_time else EPOCH,
+            latest_post_time,
+            partitions[0].from_date,
+            partitions[-1].to_date,
+        )
+        inserted = int(status.split()[-1])
+        await conn.execute(
+            """
+            INSERT INTO ingest_checkpoints (source, last_post_time, posts)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (source) DO UPDATE
+                SET last_post_time = excluded.last_post_time,
+                    posts          = ingest_checkpoints.posts + excluded.posts,
+                    updated_at     = now()
+            """,
+            SYNC_CHECKPOINT,
+            latest_post_time,
+            inserted,
+        )
+    logger.info("Copied %d measurements into %s", inserted, PARTITIONED_TABLE)
+    return inserted
+
+
+async def maintain_partitions(
+    interval: Optional[PartitionInterval] = None,
+    archive_directory: Optional[Path] = None,
+    drop: bool = True,
+    conn: Optional[asyncpg.Connection] = None,
+) -> None:
+    """Create the partitions of the retention period and the next days, copy
+    the new measurements and prune the expired partitions.
+
+    A new database connection is opened unless `conn` is specified.
+    """
+    interval = interval or settings.MEASUREMENT_PARTITION_INTERVAL
+    now = datetime.utcnow()
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+    try:
+        await create_partitioned_table(conn)
+        await create_partitions(
+            conn,
+            from_date=now - settings.MEASUREMENT_RETENTION,
+            to_date=now + settings.MEASUREMENT_PARTITIONS_AHEAD,
+            interval=interval,
+        )
+        await prune_partitions(
+            conn,
+            before=now - settings.MEASUREMENT_RETENTION,
+            archive_directory=archive_directory,
+            drop=drop,
+        )
+        await sync_measurements(conn)
+    finally:
+        if close_connection:
+            await conn.close()
@@ -0,0 +1,419 @@
+"""
+Hourly rollups of node metrics.
+
+Each rollup stores, for one node and one hour, a DDSketch of every metric,
+the number of missing values, the number of measurements per version string
+and per ASN. Scoring a period then merges the hourly sketches of each node
+instead of sorting every raw measurement, and only the hours that arrived
+since the last update need to be processed.
+"""
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Literal, NamedTuple, Optional, Sequence, Tuple
+
+import asyncpg
+
+from aleph_scoring.config import settings
+from aleph_scoring.openmetrics import QUERY_DURATION
+from aleph_scoring.scoring.metric_scores import (
+    CCN_METRIC_SCORES,
+    CCN_METRICS,
+    CRN_METRIC_SCORES,
+    CRN_METRICS,
+    MetricScore,
+    percentile_score,
+)
+from aleph_scoring.scoring.partitions import read_measurements_query
+from aleph_scoring.scoring.sketch import DDSketch
+from aleph_scoring.utils import Period, database_connection, read_sql_file
+
+logger = logging.getLogger(__name__)
+
+NodeType = Literal["ccn", "crn"]
+NODE_TYPES: Tuple[NodeType, ...] = ("ccn", "crn")
+
+NODE_TYPE_METRICS: Dict[str, Tuple[str, ...]] = {
+    "ccn": CCN_METRICS,
+    "crn": CRN_METRICS,
+}
+NODE_TYPE_METRIC_SCORES: Dict[str, Tuple[MetricScore, ...]] = {
+    "ccn": CCN_METRIC_SCORES,
+    "crn": CRN_METRIC_SCORES,
+}
+NODE_TYPE_SOFTWARE: Dict[str, str] = {
+    "ccn": "pyaleph",
+    "crn": "aleph-vm",
+}
+VERSION_ANNOTATIONS = ("latest", "prerelease", "outdated", "obsolete", "other")
+ONE_HOUR = timedelta(hours=1)
+
+
+def truncate_to_hour(timestamp: float) -> datetime:
+    return datetime.utcfromtimestamp(timestamp - timestamp % 3600)
+
+
+class NodeRollup:
+    """Mergeable aggregate of the measurements of a node."""
+
+    def __init__(self, metrics: Sequence[str], relative_accuracy: float):
+        self.metrics = metrics
+        self.samples = 0
+        self.sketches = {
+            metric: DDSketch(relative_accuracy=relative_accuracy) for metric in metrics
+        }
+        self.missing: Dict[str, int] = {metric: 0 for metric in metrics}
+        self.versions: Counter = Counter()
+        self.asns: Counter = Counter()
+        # Number of measurements per version annotation, set when scoring
+        self.annotations: Counter = Counter()
+
+    def add(
+        self,
+        metric_values: Sequence[Optional[float]],
+        version: Optional[str],
+        asn: Optional[int],
+    ) -> None:
+        self.samples += 1
+        for metric, value in zip(self.metrics, metric_values):
+            if value is None:
+                self.missing[metric] += 1
+            else:
+                self.sketches[metric].add(value)
+        self.versions[version or ""] += 1
+        self.asns["" if asn is None else str(asn)] += 1
+
+    def merge(self, other: "NodeRollup") -> None:
+        self.samples += other.samples
+        for metric in self.metrics:
+            self.sketches[metric].merge(other.sketches[metric])
+            self.missing[metric] += other.missing[metric]
+        self.versions.update(other.versions)
+        self.asns.update(other.asns)
+        self.annotations.update(other.annotations)
+
+    def percentile(self, metric: str, q: float, missing_value: float) -> Optional[float]:
+        """Percentile of a metric, counting missing values as `missing_value`
+        like the COALESCE of the SQL queries."""
+        sketch = DDSketch(relative_accuracy=self.sketches[metric].relative_accuracy)
+        sketch.merge(self.sketches[metric])
+        sketch.add(missing_value, count=self.missing[metric])
+        return sketch.quantile(q)
+
+    @classmethod
+    def from_record(
+        cls, record: asyncpg.Record, metrics: Sequence[str], relative_accuracy: float
+    ) -> "NodeRollup":
+        rollup = cls(metrics=metrics, relative_accuracy=relative_accuracy)
+        rollup.samples = record["samples"]
+        sketches = json.loads(record["sketches"])
+        for metric in metrics:
+            if metric in sketches:
+                rollup.sketches[metric] = DDSketch.from_dict(sketches[metric])
+        rollup.missing.update(json.loads(record["missing"]))
+        rollup.versions.update(json.loads(record["versions"]))
+        rollup.asns.update(json.loads(record["asns"]))
+        return rollup
+
+    def to_record_values(self) -> Tuple[int, str, str, str, str]:
+        return (
+            self.samples,
+            json.dumps(
+                {metric: sketch.to_dict() for metric, sketch in self.sketches.items()}
+            ),
+            json.dumps(self.missing),
+            json.dumps(self.versions),
+            json.dumps(self.asns),
+        )
+
+
+async def create_rollups_table(conn: asyncpg.Connection) -> None:
+    await conn.execute(read_sql_file("node_metrics_rollups_table.sql"))
+
+
+async def get_rollups_watermark(
+    conn: asyncpg.Connection, node_type: NodeType
+) -> Optional[datetime]:
+    """Return the most recent hour that has been rolled up."""
+    return await conn.fetchval(
+        "SELECT max(hour) FROM node_metrics_hourly_rollups WHERE node_type = $1",
+        node_type,
+    )
+
+
+async def update_rollups(
+    conn: asyncpg.Connection,
+    node_type: NodeType,
+    from_date: Optional[datetime] = None,
+) -> int:
+    """Roll up the complete hours that arrived since the last update.
+
+    The last ROLLUP_LATENESS hours that were already rolled up are recomputed,
+    so that the posts indexed after their hour was rolled up are counted. All
+    the hours since `from_date` are recomputed when it is specified.
+    """
+    metrics = NODE_TYPE_METRICS[node_type]
+    relative_accuracy = settings.ROLLUP_SKETCH_RELATIVE_ACCURACY
+
+    to_date = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    if from_date is None:
+        watermark = await get_rollups_watermark(conn, node_type)
+        if watermark:
+            from_date = watermark + ONE_HOUR - settings.ROLLUP_LATENESS
+        else:
+            from_date = to_date - settings.ROLLUP_INITIAL_PERIOD
+    from_date = from_date.replace(minute=0, second=0, microsecond=0)
+
+    if from_date >= to_date:
+        logger.debug("No new complete hour to roll up for %s nodes", node_type)
+        return 0
+
+    with QUERY_DURATION.time("query_node_metrics_rows"):
+        values = await conn.fetch(
+            read_measurements_query("query_node_metrics_rows.template.sql"),
+            settings.ALLOWED_METRICS_SENDER,
+            settings.ALEPH_POST_TYPE_METRICS,
+            from_date,
+            to_date,
+            node_type,
+            list(metrics),
+        )
+
+    rollups: Dict[Tuple[str, datetime], NodeRollup] = {}
+    for record in values:
+        key = (record["node_id"], truncate_to_hour(record["measured_at"]))
+        if key not in rollups:
+            rollups[key] = NodeRollup(
+                metrics=metrics, relative_accuracy=relative_accuracy
+            )
+        rollups[key].add(record["metric_values"], record["version"], record["asn"])
+
+    await conn.executemany(
+        """
+        INSERT INTO node_metrics_hourly_rollups
+            (node_type, node_id, hour, samples, sketches, missing, versions, asns)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        ON CONFLICT (node_type, node_id, hour) DO UPDATE
+            SET samples  = excluded.samples,
+                sketches = excluded.sketches,
+                missing  = excluded.missing,
+                versions = excluded.versions,
+                asns     = excluded.asns
+        """,
+        [
+            (node_type, node_id, hour, *rollup.to_record_values())
+            for (node_id, hour), rollup in rollups.items()
+        ],
+    )
+    logger.info(
+        "Rolled up %d node-hours of %s metrics from %s to %s",
+        len(rollups),
+        node_type,
+        from_date,
+        to_date,
+    )
+    return len(rollups)
+
+
+async def update_all_rollups(
+    from_date: Optional[datetime] = None, conn: Optional[asyncpg.Connection] = None
+) -> None:
+    close_connection = conn is None
+    if conn is None:
+        conn = await database_connection(settings)
+    try:
+        await create_rollups_table(conn)
+        for node_type in NODE_TYPES:
+            await update_rollups(conn, node_type=node_type, from_date=from_date)
+    finally:
+        if close_connection:
+            await conn.close()
+
+
+async def annotate_versions(
+    conn: asyncpg.Connection, software: str, versions: Iterable[Tuple[str, datetime]]
+) -> Dict[Tuple[str, datetime], str]:
+    """Annotate each distinct (version, date) pair using `annotate_version`."""
+    versions = list(versions)
+    values = await conn.fetch(
+        read_sql_file("query_annotate_versions.template.sql"),
+        software,
+        [version for version, _ in versions],
+        [date for _, date in versions],
+    )
+    return {
+        (record["version_name"], record["version_date"]): record["annotation"]
+        for record in values
+    }
+
+
+def asn_distribution(
+    node_asns: Dict[str, Counter]
+) -> Dict[str, Dict[str, Optional[int]]]:
+    """Reproduce the ASN distribution of the measurement queries from ASN counters.
+
+    Every distinct (node, ASN) pair counts as one node. When a node was seen
+    with several ASNs, the known ASN shared by the most nodes is kept.
+    """
+    pairs_per_asn: Counter = Counter()
+    for asns in node_asns.values():
+        pairs_per_asn.update(asns.keys())
+    total_nodes = sum(pairs_per_asn.values())
+
+    result: Dict[str, Dict[str, Optional[int]]] = {}
+    for node_id, asns in node_asns.items():
+        known_asns = [(-pairs_per_asn[asn], int(asn), asn) for asn in asns if asn]
+        asn = min(known_asns)[2] if known_asns else ""
+        result[node_id] = {
+            "asn": int(asn) if asn else None,
+            "total_nodes": total_nodes,
+            "nodes_with_identical_asn": pairs_per_asn[asn],
+        }
+    return result
+
+
+class HourlyRollup(NamedTuple):
+    node_id: str
+    hour: datetime
+    rollup: NodeRollup
+
+
+async def load_hourly_rollups(
+    conn: asyncpg.Connection, node_type: NodeType, period: Period
+) -> List[HourlyRollup]:
+    """Load the hourly rollups of a period, with their versions annotated."""
+    metrics = NODE_TYPE_METRICS[node_type]
+    relative_accuracy = settings.ROLLUP_SKETCH_RELATIVE_ACCURACY
+
+    with QUERY_DURATION.time("query_node_metrics_rollups"):
+        values = await conn.fetch(
+            read_sql_file("query_node_metrics_rollups.template.sql"),
+            node_type,
+            period.from_date,
+            period.to_date,
+        )
+    hourly_rollups = [
+        HourlyRollup(
+            node_id=record["node_id"],
+            hour=record["hour"],
+            rollup=NodeRollup.from_record(
+                record, metrics=metrics, relative_accuracy=relative_accuracy
+            ),
+        )
+        for record in values
+    ]
+
+    annotations = await annotate_versions(
+        conn,
+        software=NODE_TYPE_SOFTWARE[node_type],
+        versions={
+            (version, hourly_rollup.hour)
+            for hourly_rollup in hourly_rollups
+            for version in hourly_rollup.rollup.versions
+            if version
+        },
+    )
+    for hourly_rollup in hourly_rollups:
+        for version, count in hourly_rollup.rollup.versions.items():
+            if version:
+                annotation = annotations.get((version, hourly_rollup.hour))
+            else:
+                annotation = "missing"
+            hourly_rollup.rollup.annotations[annotation] += count
+
+    return hourly_rollups
+
+
+def rollup_measurements(
+    node_type: NodeType, node_rollups: Dict[str, NodeRollup]
+) -> Dict[str, Dict]:
+    """Compute the measurements of each node from its merged rollups."""
+    asn_info = asn_distribution(
+        {node_id: rollup.asns for node_id, rollup in node_rollups.items()}
+    )
+
+    result: Dict[str, Dict] = {}
+    for node_id, rollup in node_rollups.items():
+        row: Dict = {
+            definition.field: percentile_score(
+                definition,
+                rollup.percentile(
+                    definition.metric,
+                    definition.percentile,
+                    definition.missing_value,
+                ),
+            )
+            for definition in NODE_TYPE_METRIC_SCORES[node_type]
+        }
+        for annotation in VERSION_ANNOTATIONS + ("missing",):
+            row[f"node_version_{annotation}"] = rollup.annotations[annotation]
+
+        row.update(asn_info[node_id])
+        result[node_id] = row
+
+    return result
+
+
+async def query_rollup_measurements_for_periods(
+    conn: asyncpg.Connection, node_type: NodeType, periods: Sequence[Period]
+) -> List[Dict[str, Dict]]:
+    """Compute the measurements of each node over several periods.
+
+    The hourly rollups of all the periods are read at once. Periods that end
+    at the same time are nested: they are computed from the narrowest to the
+    widest, each one only merging the hours that the previous one did not cover.
+    """
+    metrics = NODE_TYPE_METRICS[node_type]
+    relative_accuracy = settings.ROLLUP_SKETCH_RELATIVE_ACCURACY
+
+    hourly_rollups = await load_hourly_rollups(
+        conn,
+        node_type,
+        Period(
+            from_date=min(period.from_date for period in periods),
+            to_date=max(period.to_date for period in periods),
+        ),
+    )
+    hourly_rollups.sort(key=lambda hourly_rollup: hourly_rollup.hour, reverse=True)
+
+    periods_by_end: Dict[datetime, List[int]] = {}
+    for position, period in enumerate(periods):
+        periods_by_end.setdefault(period.to_date, []).append(position)
+
+    results: List[Dict[str, Dict]] = [{} for _ in periods]
+    for to_date, positions in periods_by_end.items():
+        positions.sort(key=lambda position: periods[position].from_date, reverse=True)
+        hours = [
+            hourly_rollup for hourly_rollup in hourly_rollups if hourly_rollup.hour < to_date
+        ]
+
+        node_rollups: Dict[str, NodeRollup] = {}
+        merged_hours = 0
+        for position in positions:
+            from_hour = periods[position].from_date.replace(
+                minute=0, second=0, microsecond=0
+            )
+            while merged_hours < len(hours) and hours[merged_hours].hour >= from_hour:
+                node_id, _, rollup = hours[merged_hours]
+                if node_id not in node_rollups:
+                    node_rollups[node_id] = NodeRollup(
+                        metrics=metrics, relative_accuracy=relative_accuracy
+                    )
+                node_rollups[node_id].merge(rollup)
+                merged_hours += 1
+
+            results[position] = rollup_measurements(node_type, node_rollups)
+
+    return results
+
+
+async def query_rollup_measurements(
+    conn: asyncpg.Connection, node_type: NodeType, period: Period
+) -> Dict[str, Dict]:
+    """Compute the measurements of each node over a period from the hourly rollups.
+
+    The result contains the same fields as `query_{node_type}_measurements`.
+    The period is aligned on complete hours.
+    """
+    return (await query_rollup_measurements_for_periods(conn, node_type, [period]))[0]
@@ -0,0 +1,88 @@
+"""
+Mergeable quantile sketch used to store hourly rollups of node metrics.
+
+This is a minimal implementation of DDSketch (Masson et al., 2019): values are
+assigned to logarithmically sized buckets so that any quantile can be estimated
+with a bounded relative error, and two sketches can be merged by adding their
+bucket counts.
+"""
+import math
+from typing import Dict, Optional
+
+
+class DDSketch:
+    # Values below this threshold are counted as zero (latencies are positive,
+    # block heights are non-negative integers).
+    min_value = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.bins: Dict[int, int] = {}
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.bins.values())
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if count <= 0:
+            return
+        if value < self.min_value:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with a different accuracy")
+
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile with the semantics of `percentile_disc`:
+        the smallest value whose cumulative position is at least `q * count`.
+        """
+        total = self.count
+        if not total:
+            return None
+
+        rank = max(math.ceil(q * total), 1)
+        if rank <= self.zero_count:
+            return 0.0
+
+        cumulative = self.zero_count
+        for key in sorted(self.bins):
+            cumulative += self.bins[key]
+            if cumulative >= rank:
+                return self._value(key)
+
+        # Unreachable unless the counts were tampered with
+        return self._value(max(self.bins))
+
+    def to_dict(self) -> Dict:
+        return {
+            "a": self.relative_accuracy,
+            "z": self.zero_count,
+            "b": {str(key): count for key, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DDSketch":
+        sketch = cls(relative_accuracy=data["a"])
+        sketch.zero_count = data["z"]
+        sketch.bins = {int(key): count for key, count in data["b"].items()}
+        return sketch
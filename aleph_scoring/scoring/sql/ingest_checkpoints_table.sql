@@ -0,0 +1,8 @@
+/* Position of the `ingest` command in each source of metrics posts. */
+CREATE TABLE IF NOT EXISTS ingest_checkpoints
+(
+    source         varchar                  not null primary key,
+    last_post_time timestamp with time zone not null,
+    posts          bigint                   not null default 0,
+    updated_at     timestamp with time zone not null default now()
+);
@@ -0,0 +1,12 @@
+    /* Same measurements as measurements_from_posts.template.sql, from the partitions of
+       node_measurements that overlap the period */
+    SELECT node_id,
+           (node ->> 'asn')::bigint as asn,
+           measured_at,
+           node
+    FROM node_measurements
+    WHERE owner = $1
+      AND post_type = $2
+      AND measured_at >= $3::timestamp
+      AND measured_at < $4::timestamp
+      AND node_type = $5::text
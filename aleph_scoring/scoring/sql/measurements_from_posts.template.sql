@@ -0,0 +1,11 @@
+    /* Measurements of the nodes of type $5 between $3 and $4, in the metrics posts of type $2 sent by $1 */
+    SELECT node ->> 'node_id'                                       as node_id,
+           (node ->> 'asn')::bigint                                 as asn,
+           to_timestamp((node ->> 'measured_at')::float)::timestamp as measured_at,
+           node
+    FROM posts,
+         jsonb_array_elements(content -> 'metrics' -> $5::text) node
+    WHERE owner = $1
+      AND type = $2
+      AND to_timestamp((node -> 'measured_at')::float)::timestamp >= $3::timestamp
+      AND to_timestamp((node -> 'measured_at')::float)::timestamp < $4::timestamp
@@ -0,0 +1,18 @@
+/* Measurements of the metrics posts, one row per node and measurement, partitioned by
+   measurement time so that the scoring queries only read the partitions of their period
+   and old measurements can be detached or dropped in constant time.
+   The partitions are created by the `partitions` command. */
+CREATE TABLE IF NOT EXISTS node_measurements
+(
+    owner       varchar     not null,
+    post_type   varchar     not null,
+    node_type   varchar(3)  not null,
+    node_id     varchar(64) not null,
+    measured_at timestamp   not null,
+    item_hash   varchar     not null,
+    node        jsonb       not null,
+    PRIMARY KEY (item_hash, node_type, node_id, measured_at)
+) PARTITION BY RANGE (measured_at);
+
+CREATE INDEX IF NOT EXISTS ix_node_measurements_lookup
+    ON node_measurements (owner, post_type, node_type, measured_at);
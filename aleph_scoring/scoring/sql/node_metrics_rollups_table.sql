@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS node_metrics_hourly_rollups
+(
+    node_type varchar(3)  not null,
+    node_id   varchar(64) not null,
+    hour      timestamp   not null,
+    samples   int         not null,
+    /* DDSketch of each metric, serialized by DDSketch.to_dict() */
+    sketches  jsonb       not null,
+    /* Number of missing values of each metric */
+    missing   jsonb       not null,
+    /* Number of measurements of each version string */
+    versions  jsonb       not null,
+    /* Number of measurements of each ASN */
+    asns      jsonb       not null,
+    PRIMARY KEY (node_type, node_id, hour)
+);
@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS node_scores_history
+(
+    node_type        varchar(3)  not null,
+    node_id          varchar(64) not null,
+    period_from      timestamp   not null,
+    period_to        timestamp   not null,
+    total_score      float       not null,
+    performance      float       not null,
+    version          float       not null,
+    decentralization float       not null,
+    measurements     jsonb       not null,
+    computed_at      timestamp   not null default (now() at time zone 'utc'),
+    PRIMARY KEY (node_type, node_id, period_to, period_from)
+);
@@ -0,0 +1,7 @@
+/* Index of the metrics posts used by the scoring queries, the data watermark and the copy
+   into node_measurements: all of them select the posts of one sender and type, and the
+   last two by creation time. The measurement time is inside the content of the posts and
+   cannot be indexed, the partitions of node_measurements are organized by it instead.
+   Built concurrently, to not lock the posts of a running node. */
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_posts_owner_type_creation_datetime
+    ON posts (owner, type, creation_datetime)
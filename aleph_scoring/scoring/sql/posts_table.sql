@@ -0,0 +1,16 @@
+/* Subset of the `posts` table of a Core Channel Node, for scoring databases that are
+   filled by the `ingest` command instead of a node. */
+CREATE TABLE IF NOT EXISTS posts
+(
+    item_hash         varchar                  not null primary key,
+    owner             varchar                  not null,
+    type              varchar,
+    ref               varchar,
+    amends            varchar,
+    channel           varchar,
+    content           jsonb                    not null,
+    creation_datetime timestamp with time zone not null,
+    latest_amend      varchar
+);
+
+CREATE INDEX IF NOT EXISTS ix_posts_owner_type ON posts (owner, type);
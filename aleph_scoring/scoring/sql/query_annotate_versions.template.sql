@@ -0,0 +1,9 @@
+SELECT versions.version_name,
+       versions.version_date,
+       coalesce(software_version_interval.annotation, 'unknown') as annotation
+FROM unnest($2::text[], $3::timestamp[]) AS versions(version_name, version_date)
+         LEFT JOIN software_version_intervals as software_version_interval
+                   ON software_version_interval.software = $1
+                       AND software_version_interval.version = versions.version_name
+                       AND software_version_interval.valid_from <= versions.version_date
+                       AND versions.version_date < software_version_interval.valid_to
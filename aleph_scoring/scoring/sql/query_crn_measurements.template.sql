@@ -1,4 +1,11 @@
-SELECT node ->> 'node_id'                                                        as node_id,
+/* Single scan of the metrics posts: the ASN distribution and the latency and version
+   aggregates are computed from the same materialized set of measurements. */
+WITH measurement AS MATERIALIZED (
+/* measurement source */
+),
+
+node_aggregates AS (
+SELECT node_id,
 
        count((node -> 'base_latency')::float > 0)                                as base_latency_present,
        count(case when (node -> 'base_latency')::float is null then 1 end)       as base_latency_missing,
@@ -46,52 +53,44 @@ SELECT node ->> 'node_id'
        count((node -> 'full_check_latency')::float > 0)                          as full_check_latency_present,
        count(case when (node -> 'full_check_latency')::float is null then 1 end) as full_check_latency_missing,
 
-       count(
-            case
-                when (
-                    annotate_version('aleph-vm', node ->> 'version',
-                                     to_timestamp((node->>'measured_at')::float)::timestamptz) = 'latest'
-                    ) then 1 end)
-            as node_version_latest,
-
-        count(
-            case
-                when (
-                    annotate_version('aleph-vm', node ->> 'version',
-                                     to_timestamp((node->>'measured_at')::float)::timestamptz) = 'prerelease'
-                    ) then 1 end)
-            as node_version_prerelease,
+       count(*) FILTER (WHERE software_version_interval.annotation = 'latest')     as node_version_latest,
+       count(*) FILTER (WHERE software_version_interval.annotation = 'prerelease') as node_version_prerelease,
+       count(*) FILTER (WHERE software_version_interval.annotation = 'outdated')   as node_version_outdated,
+       count(*) FILTER (WHERE software_version_interval.annotation = 'obsolete')   as node_version_obsolete,
+       count(*) FILTER (WHERE software_version_interval.annotation = 'other')      as node_version_other,
+       count(case when (coalesce(node ->> 'version', '') = '') then 1 end) as node_version_missing
 
-        count(
-            case
-                when (
-                    annotate_version('aleph-vm', node ->> 'version',
-                                     to_timestamp((node->>'measured_at')::float)::timestamptz) = 'outdated'
-                    ) then 1 end)
-            as node_version_outdated,
+FROM measurement
+         /* Classify the version of each measurement with a single range join,
+            see software_version_intervals.sql */
+         LEFT JOIN software_version_intervals as software_version_interval
+                   ON software_version_interval.software = 'aleph-vm'
+                       AND software_version_interval.version = node ->> 'version'
+                       AND software_version_interval.valid_from <= measurement.measured_at
+                       AND measurement.measured_at < software_version_interval.valid_to
+GROUP BY node_id
+),
 
-        count(
-            case
-                when (
-                    annotate_version('aleph-vm', node ->> 'version',
-                                     to_timestamp((node->>'measured_at')::float)::timestamptz) = 'obsolete'
-                    ) then 1 end)
-            as node_version_obsolete,
+/* Every distinct (node, ASN) pair counts as one node */
+node_asn AS (
+    SELECT node_id,
+           asn,
+           COUNT(*) OVER ()                    as total_nodes,
+           COUNT(*) OVER (PARTITION BY asn)    as nodes_with_identical_asn
+    FROM measurement
+    GROUP BY node_id, asn
+),
 
-        count(
-            case
-                when (
-                    annotate_version('aleph-vm', node ->> 'version',
-                                     to_timestamp((node->>'measured_at')::float)::timestamptz) = 'other'
-                    ) then 1 end)
-            as node_version_other,
+/* Keep a single ASN per node, preferring a known one */
+node_asn_info AS (
+    SELECT DISTINCT ON (node_id) node_id, asn, total_nodes, nodes_with_identical_asn
+    FROM node_asn
+    ORDER BY node_id, asn IS NULL, nodes_with_identical_asn DESC
+)
 
-        count(case when (coalesce(node ->> 'version', '') = '') then 1 end) as node_version_missing
-FROM posts,
-     jsonb_array_elements(content -> 'metrics' -> 'crn') node
-WHERE owner = $1
-    /*owner = ANY($3::text[])*/
-  AND type = $2
-  AND to_timestamp((node -> 'measured_at')::float)::timestamp > $3::timestamp
-  AND to_timestamp((node -> 'measured_at')::float)::timestamp < $4::timestamp
-GROUP BY node ->> 'node_id'
+SELECT node_aggregates.*,
+       node_asn_info.asn,
+       node_asn_info.total_nodes,
+       node_asn_info.nodes_with_identical_asn
+FROM node_aggregates
+         JOIN node_asn_info USING (node_id)
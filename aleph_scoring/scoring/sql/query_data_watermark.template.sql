@@ -0,0 +1,13 @@
+/* State of the data used by the scoring queries: the scores of a period can only change
+   when new metrics posts arrive or when the software versions are modified. */
+SELECT (SELECT max(creation_datetime)
+        FROM posts
+        WHERE owner = $1
+          AND type = $2)                                          as latest_post_time,
+       (SELECT count(*)
+        FROM posts
+        WHERE owner = $1
+          AND type = $2)                                          as post_count,
+       (SELECT md5(coalesce(string_agg(concat_ws('|', software, name, released_on, replaced_on, prerelease),
+                                       ',' ORDER BY software, name), ''))
+        FROM software_versions)                                   as software_versions_checksum
@@ -0,0 +1,6 @@
+SELECT node_id, hour, samples, sketches, missing, versions, asns
+FROM node_metrics_hourly_rollups
+WHERE node_type = $1
+  AND hour >= date_trunc('hour', $2::timestamp)
+  AND hour < $3::timestamp
+ORDER BY node_id, hour
@@ -0,0 +1,11 @@
+WITH measurement AS (
+/* measurement source */
+)
+SELECT node_id,
+       (node ->> 'measured_at')::float                           as measured_at,
+       node ->> 'version'                                        as version,
+       asn,
+       (SELECT array_agg((node ->> metric)::float ORDER BY position)
+        FROM unnest($6::text[]) WITH ORDINALITY AS metrics(metric, position)
+       )                                                         as metric_values
+FROM measurement
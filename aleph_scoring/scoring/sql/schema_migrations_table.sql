@@ -0,0 +1,8 @@
+/* Ledger of the migrations applied by the `migrate` command. */
+CREATE TABLE IF NOT EXISTS schema_migrations
+(
+    version    int                      not null primary key,
+    name       varchar                  not null,
+    checksum   varchar(64)              not null,
+    applied_at timestamp with time zone not null default now()
+);
@@ -0,0 +1,57 @@
+/* Precomputed version classification.
+
+   Each version of `software_versions` is split into the time intervals where
+   `annotate_version` returns the same annotation, so that the scoring queries
+   can classify measurements with a single range join instead of calling
+   `annotate_version` for every row and every counter.
+
+   This file is a repeatable migration: the view is dropped and created again
+   so that a change of its definition takes effect. */
+DROP MATERIALIZED VIEW IF EXISTS software_version_intervals CASCADE;
+
+CREATE MATERIALIZED VIEW software_version_intervals AS
+SELECT software_version.software,
+       software_version.name as version,
+       intervals.valid_from,
+       intervals.valid_to,
+       intervals.annotation
+FROM software_versions as software_version,
+     LATERAL (
+         VALUES ('-infinity'::timestamp,
+                 software_version.released_on,
+                 'other'),
+                (software_version.released_on,
+                 coalesce(software_version.replaced_on, 'infinity'::timestamp),
+                 CASE WHEN software_version.prerelease THEN 'prerelease' ELSE 'latest' END),
+                (software_version.replaced_on,
+                 software_version.replaced_on + (interval '14' day),
+                 'outdated'),
+                (software_version.replaced_on + (interval '14' day),
+                 'infinity'::timestamp,
+                 'obsolete')
+         ) as intervals(valid_from, valid_to, annotation)
+/* Intervals that start at `replaced_on` are dropped for current versions */
+WHERE intervals.valid_from < intervals.valid_to;
+
+CREATE UNIQUE INDEX software_version_intervals_lookup
+    ON software_version_intervals (software, version, valid_from);
+
+
+/* Keep the intervals up to date when releases change */
+CREATE OR REPLACE FUNCTION refresh_software_version_intervals()
+    RETURNS trigger
+    language plpgsql
+as
+$$
+BEGIN
+    REFRESH MATERIALIZED VIEW software_version_intervals;
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS software_versions_changed ON software_versions;
+CREATE TRIGGER software_versions_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON software_versions
+    FOR EACH STATEMENT
+EXECUTE FUNCTION refresh_software_version_intervals();
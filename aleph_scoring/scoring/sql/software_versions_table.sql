@@ -1,4 +1,4 @@
-CREATE TABLE software_versions
+CREATE TABLE IF NOT EXISTS software_versions
 (
     software    varchar(30)        not null,
     name        varchar(30)        not null,
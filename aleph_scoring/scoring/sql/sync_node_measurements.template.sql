@@ -0,0 +1,22 @@
+/* Copy the measurements of the metrics posts created in ]$3, $4] into node_measurements,
+   skipping those measured outside of the partitions, in [$5, $6[ */
+INSERT INTO node_measurements (owner, post_type, node_type, node_id, measured_at, item_hash, node)
+SELECT owner, post_type, node_type, node_id, measured_at, item_hash, node
+FROM (SELECT owner,
+             type                                                     as post_type,
+             node_type,
+             node ->> 'node_id'                                       as node_id,
+             to_timestamp((node ->> 'measured_at')::float)::timestamp as measured_at,
+             item_hash,
+             node
+      FROM posts,
+           unnest(ARRAY ['ccn', 'crn']) node_type,
+           jsonb_array_elements(content -> 'metrics' -> node_type) node
+      WHERE owner = $1
+        AND type = $2
+        AND creation_datetime > $3
+        AND creation_datetime <= $4) post_measurement
+WHERE node_id IS NOT NULL
+  AND measured_at >= $5::timestamp
+  AND measured_at < $6::timestamp
+ON CONFLICT DO NOTHING
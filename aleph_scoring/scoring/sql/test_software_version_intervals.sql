@@ -0,0 +1,19 @@
+/* Must return no row: the intervals must annotate measurements the same way
+   as `annotate_version`. Run after test_software_versions_function.sql. */
+SELECT software_version.software,
+       software_version.name,
+       dates.version_date,
+       annotate_version(software_version.software, software_version.name,
+                        dates.version_date::timestamptz) as expected,
+       software_version_interval.annotation              as annotation
+FROM software_versions as software_version
+         CROSS JOIN generate_series('2022-01-01'::timestamp, '2023-06-01'::timestamp,
+                                    interval '6' hour) as dates(version_date)
+         LEFT JOIN software_version_intervals as software_version_interval
+                   ON software_version_interval.software = software_version.software
+                       AND software_version_interval.version = software_version.name
+                       AND software_version_interval.valid_from <= dates.version_date
+                       AND dates.version_date < software_version_interval.valid_to
+WHERE annotate_version(software_version.software, software_version.name,
+                       dates.version_date::timestamptz)
+          IS DISTINCT FROM software_version_interval.annotation;
@@ -0,0 +1,299 @@
+"""
+Synthetic metrics posts for benchmarks.
+
+A `SyntheticDataset` describes a network of nodes measured every round for a
+number of days. The generator produces one metrics post per round, with the
+shape of the posts of `measure`, and the software versions needed to give
+each version of the mix its annotation. The data is deterministic for a given
+seed, so that benchmarks of different query or schema versions read the same
+posts.
+"""
+import hashlib
+import json
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import asyncpg
+from pydantic import BaseModel, validator
+
+from aleph_scoring.config import settings
+from aleph_scoring.ingest import PostRow, copy_posts
+from aleph_scoring.releases import sync_software_versions
+from aleph_scoring.scoring.formula import VERSION_ANNOTATIONS
+from aleph_scoring.scoring.migrations import migrate
+from aleph_scoring.scoring.models import SoftwareVersionRecord
+from aleph_scoring.scoring.partitions import create_partitions, sync_measurements
+from aleph_scoring.scoring.rollups import NODE_TYPE_SOFTWARE
+from aleph_scoring.utils import Period
+
+logger = logging.getLogger(__name__)
+
+# Source of the synthetic posts in `ingest_checkpoints`
+SYNTHETIC_SOURCE = "synthetic"
+
+
+class SyntheticDataset(BaseModel):
+    ccn_nodes: int = 100
+    crn_nodes: int = 500
+    rounds_per_day: int = 24
+    days: int = 14
+    # Probability that each metric of a measurement is missing
+    missing_rate: float = 0.05
+    # Share of the measurements reporting a version of each annotation
+    version_mix: Dict[str, float] = {
+        "latest": 0.7,
+        "prerelease": 0.05,
+        "outdated": 0.15,
+        "obsolete": 0.05,
+        "missing": 0.05,
+    }
+    # The nodes are spread over this many ASNs, the first ones hosting the most nodes
+    asns: int = 40
+    seed: int = 0
+
+    @validator("missing_rate")
+    def check_rate(cls, rate: float) -> float:
+        if not 0 <= rate <= 1:
+            raise ValueError("The missing rate must be between 0 and 1")
+        return rate
+
+    @validator("version_mix")
+    def check_version_mix(cls, mix: Dict[str, float]) -> Dict[str, float]:
+        unknown = set(mix) - set(VERSION_ANNOTATIONS)
+        if unknown:
+            raise ValueError(f"Unknown version annotations: {', '.join(sorted(unknown))}")
+        if any(share < 0 for share in mix.values()) or not sum(mix.values()):
+            raise ValueError("The shares of the version mix must be positive")
+        return mix
+
+    def period(self, end: datetime) -> Period:
+        return Period(from_date=end - timedelta(days=self.days), to_date=end)
+
+
+def parse_version_mix(version_mix: str) -> Dict[str, float]:
+    """Parse a version mix such as "latest=0.8,outdated=0.15,missing=0.05"."""
+    mix = {}
+    for item in version_mix.split(","):
+        annotation, _, share = item.partition("=")
+        mix[annotation.strip()] = float(share)
+    return mix
+
+
+def synthetic_versions(period: Period) -> Dict[str, SoftwareVersionRecord]:
+    """Releases of a software that give each annotation to the measurements
+    of the period, by annotation.
+
+    Versions stay outdated for two weeks after being replaced, so in longer
+    datasets the outdated measurements become obsolete.
+    """
+    start = period.from_date
+    return {
+        "obsolete": SoftwareVersionRecord(
+            software="",
+            name="0.0.1-synthetic",
+            released_on=start - timedelta(days=90),
+            replaced_on=start - timedelta(days=60),
+        ),
+        "outdated": SoftwareVersionRecord(
+            software="",
+            name="0.0.2-synthetic",
+            released_on=start - timedelta(days=60),
+            replaced_on=start - timedelta(hours=1),
+        ),
+        "latest": SoftwareVersionRecord(
+            software="", name="0.0.3-synthetic", released_on=start - timedelta(hours=1)
+        ),
+        "prerelease": SoftwareVersionRecord(
+            software="",
+            name="0.0.4-rc1-synthetic",
+            released_on=start - timedelta(hours=1),
+            prerelease=True,
+        ),
+        # Released after the period: the measurements run a version from the future
+        "other": SoftwareVersionRecord(
+            software="", name="0.0.5-synthetic", released_on=period.to_date + timedelta(days=1)
+        ),
+    }
+
+
+def software_version_records(period: Period) -> List[SoftwareVersionRecord]:
+    return [
+        version.copy(update={"software": software})
+        for software in NODE_TYPE_SOFTWARE.values()
+        for version in synthetic_versions(period).values()
+    ]
+
+
+def node_id(dataset: SyntheticDataset, node_type: str, position: int) -> str:
+    return hashlib.sha256(f"{dataset.seed}-{node_type}-{position}".encode()).hexdigest()
+
+
+class SyntheticNode(NamedTuple):
+    node_id: str
+    url: str
+    asn: int
+    # Typical latency of the node in seconds, some nodes are much slower than others
+    latency: float
+    # Annotation of the version of the node
+    version: str
+
+
+def synthetic_nodes(
+    dataset: SyntheticDataset, node_type: str, count: int, rng: random.Random
+) -> List[SyntheticNode]:
+    asn_weights = [1 / (position + 1) for position in range(dataset.asns)]
+    annotations = list(dataset.version_mix)
+    version_weights = list(dataset.version_mix.values())
+    return [
+        SyntheticNode(
+            node_id=node_id(dataset, node_type, position),
+            url=f"https://{node_type}-{position}.synthetic.example/",
+            asn=64512 + rng.choices(range(dataset.asns), weights=asn_weights)[0],
+            latency=rng.lognormvariate(-1.5, 0.8),
+            version=rng.choices(annotations, weights=version_weights)[0],
+        )
+        for position in range(count)
+    ]
+
+
+def measure(
+    node: SyntheticNode,
+    node_type: str,
+    measured_at: float,
+    versions: Dict[str, SoftwareVersionRecord],
+    dataset: SyntheticDataset,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    def latency(factor: float) -> Optional[float]:
+        if rng.random() < dataset.missing_rate:
+            return None
+        return round(node.latency * factor * rng.lognormvariate(0, 0.3), 4)
+
+    version = versions.get(node.version)
+    metrics: Dict[str, Any] = {
+        "measured_at": measured_at,
+        "node_id": node.node_id,
+        "url": node.url,
+        "asn": node.asn,
+        "as_name": f"SYNTHETIC-AS{node.asn}",
+        "version": version.name if version else None,
+        "base_latency": latency(1),
+        "base_latency_ipv4": latency(1),
+    }
+    if node_type == "ccn":
+        metrics.update(
+            metrics_latency=latency(2),
+            aggregate_latency=latency(2),
+            file_download_latency=latency(4),
+            txs_total=None,
+            pending_messages=rng.randrange(100),
+            eth_height_remaining=(
+                None if rng.random() < dataset.missing_rate else rng.randrange(200)
+            ),
+        )
+    else:
+        metrics.update(
+            diagnostic_vm_latency=latency(3),
+            full_check_latency=latency(6),
+            vm_ping_latency=latency(1),
+        )
+    return metrics
+
+
+def generate_posts(dataset: SyntheticDataset, end: datetime) -> Iterator[PostRow]:
+    """Generate the metrics posts of the dataset, one per round, ending at
+    `end` (UTC)."""
+    period = dataset.period(end)
+    versions = synthetic_versions(period)
+    rng = random.Random(dataset.seed)
+    nodes: Dict[str, List[SyntheticNode]] = {
+        "ccn": synthetic_nodes(dataset, "ccn", dataset.ccn_nodes, rng),
+        "crn": synthetic_nodes(dataset, "crn", dataset.crn_nodes, rng),
+    }
+
+    round_length = timedelta(days=1) / dataset.rounds_per_day
+    rounds = dataset.days * dataset.rounds_per_day
+    for round_number in range(rounds):
+        round_start = period.from_date + round_number * round_length
+        measured_at = round_start.replace(tzinfo=timezone.utc).timestamp()
+        content = {
+            "version": "1.0",
+            "tags": ["synthetic"],
+            "metrics": {
+                "server": "synthetic.example",
+                "server_asn": 64511,
+                "server_as_name": "SYNTHETIC",
+                **{
+                    node_type: [
+                        measure(
+                            node,
+                            node_type,
+                            measured_at + rng.uniform(0, 60),
+                            versions,
+                            dataset,
+                            rng,
+                        )
+                        for node in node_list
+                    ]
+                    for node_type, node_list in nodes.items()
+                },
+            },
+        }
+        yield PostRow(
+            item_hash=hashlib.sha256(
+                f"synthetic-{dataset.seed}-{measured_at}".encode()
+            ).hexdigest(),
+            owner=settings.ALLOWED_METRICS_SENDER,
+            type=settings.ALEPH_POST_TYPE_METRICS,
+            ref=None,
+            channel=settings.ALEPH_POST_TYPE_CHANNEL,
+            content=json.dumps(content),
+            creation_datetime=(round_start + timedelta(minutes=5)).replace(
+                tzinfo=timezone.utc
+            ),
+        )
+
+
+async def load_synthetic_dataset(
+    conn: asyncpg.Connection,
+    dataset: SyntheticDataset,
+    end: datetime,
+    batch_size: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Migrate the database and load the posts and software versions of the
+    dataset ending at `end` (UTC). Posts that were already loaded are skipped.
+
+    Returns the number of posts and new posts.
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    await migrate(conn)
+
+    period = dataset.period(end)
+    await sync_software_versions(conn, software_version_records(period))
+
+    posts = 0
+    inserted = 0
+    batch: List[PostRow] = []
+    for post in generate_posts(dataset, end):
+        batch.append(post)
+        if len(batch) >= batch_size:
+            inserted += await copy_posts(conn, SYNTHETIC_SOURCE, batch)
+            posts += len(batch)
+            batch = []
+    if batch:
+        inserted += await copy_posts(conn, SYNTHETIC_SOURCE, batch)
+        posts += len(batch)
+    logger.info("Loaded %d synthetic posts, %d were new", posts, inserted)
+
+    if settings.PARTITIONED_MEASUREMENTS:
+        await create_partitions(
+            conn,
+            from_date=period.from_date,
+            to_date=period.to_date,
+            interval=settings.MEASUREMENT_PARTITION_INTERVAL,
+        )
+        await sync_measurements(conn)
+
+    return posts, inserted
@@ -0,0 +1,212 @@
+"""
+What-if analysis of the scoring formulas.
+
+The measurements of a period are loaded once, and the percentiles needed by
+every scenario are computed in a single pass over them. Each scenario then
+only re-evaluates its compiled formula on the per-node aggregates, and is
+compared to the current formula: score deltas, rank changes and nodes that
+cross zero.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring.engine import (
+    MetricsTable,
+    VersionClassifier,
+    aggregate,
+    load_metrics_table,
+    load_version_classifier,
+)
+from aleph_scoring.scoring.formula import FormulaSpec, compile_formula, load_formula
+from aleph_scoring.scoring.metric_scores import MetricScore
+from aleph_scoring.scoring.rollups import NODE_TYPE_METRIC_SCORES, NodeType
+from aleph_scoring.utils import Period, database_connection
+
+# Number of nodes listed in the largest changes of each scenario
+TOP_CHANGES = 10
+
+
+class MetricScoreOverride(BaseModel):
+    percentile: Optional[float]
+    divisor: Optional[float]
+    offset: Optional[float]
+
+
+class Scenario(BaseModel):
+    name: str
+    # Weights of the performance factors, by field. A field that is not a
+    # factor of the current formula is added to it.
+    weights: Dict[str, float] = {}
+    # Percentile, divisor or offset of the percentile scores, by field
+    metric_scores: Dict[str, MetricScoreOverride] = {}
+    valid_versions: Optional[List[str]]
+    max_missing_version_ratio: Optional[float]
+    decentralization_exponent: Optional[float]
+    performance_weight: Optional[float]
+    version_weight: Optional[float]
+
+    def formula(self, baseline: FormulaSpec, node_type: NodeType) -> FormulaSpec:
+        spec = baseline.dict()
+        spec.update(
+            self.dict(
+                include={
+                    "valid_versions",
+                    "max_missing_version_ratio",
+                    "decentralization_exponent",
+                    "performance_weight",
+                    "version_weight",
+                },
+                exclude_none=True,
+            )
+        )
+        factors = spec[node_type]["performance_factors"]
+        weights = dict(self.weights)
+        for factor in factors:
+            factor["weight"] = weights.pop(factor["field"], factor["weight"])
+        factors += [{"field": field, "weight": weight} for field, weight in weights.items()]
+        return FormulaSpec.parse_obj(spec)
+
+    def metric_score_definitions(self, node_type: NodeType) -> List[MetricScore]:
+        return [
+            definition._replace(
+                **self.metric_scores[definition.field].dict(exclude_none=True)
+            )
+            if definition.field in self.metric_scores
+            else definition
+            for definition in NODE_TYPE_METRIC_SCORES[node_type]
+        ]
+
+
+class NodeChange(BaseModel):
+    node_id: str
+    total_score: float
+    new_total_score: float
+    rank: int
+    new_rank: int
+
+
+class ScenarioReport(BaseModel):
+    name: str
+    nodes: int
+    mean_score_delta: float
+    mean_absolute_score_delta: float
+    max_absolute_score_delta: float
+    mean_absolute_rank_change: float
+    max_absolute_rank_change: int
+    # Nodes with a positive total score that would get 0, and the opposite
+    dropped_to_zero: int
+    rose_from_zero: int
+    largest_changes: List[NodeChange]
+
+
+def score_ranks(total_scores: np.ndarray) -> np.ndarray:
+    """Rank of each node, starting at 1 for the highest score."""
+    order = np.argsort(-total_scores, kind="stable")
+    ranks = np.empty(len(total_scores), dtype=np.int64)
+    ranks[order] = np.arange(1, len(total_scores) + 1)
+    return ranks
+
+
+def compare_total_scores(
+    name: str, node_ids: np.ndarray, baseline: np.ndarray, scenario: np.ndarray
+) -> ScenarioReport:
+    deltas = scenario - baseline
+    baseline_ranks = score_ranks(baseline)
+    scenario_ranks = score_ranks(scenario)
+    rank_changes = np.abs(scenario_ranks - baseline_ranks)
+
+    largest = np.argsort(-np.abs(deltas), kind="stable")[:TOP_CHANGES]
+    return ScenarioReport(
+        name=name,
+        nodes=len(node_ids),
+        mean_score_delta=float(deltas.mean()) if len(deltas) else 0.0,
+        mean_absolute_score_delta=float(np.abs(deltas).mean()) if len(deltas) else 0.0,
+        max_absolute_score_delta=float(np.abs(deltas).max(initial=0.0)),
+        mean_absolute_rank_change=float(rank_changes.mean()) if len(deltas) else 0.0,
+        max_absolute_rank_change=int(rank_changes.max(initial=0)),
+        dropped_to_zero=int(np.count_nonzero((baseline > 0) & (scenario == 0))),
+        rose_from_zero=int(np.count_nonzero((baseline == 0) & (scenario > 0))),
+        largest_changes=[
+            NodeChange(
+                node_id=node_ids[position],
+                total_score=float(baseline[position]),
+                new_total_score=float(scenario[position]),
+                rank=int(baseline_ranks[position]),
+                new_rank=int(scenario_ranks[position]),
+            )
+            for position in largest
+        ],
+    )
+
+
+def run_scenarios(
+    table: MetricsTable,
+    node_type: NodeType,
+    classifier: VersionClassifier,
+    scenarios: List[Scenario],
+    baseline_formula: Optional[FormulaSpec] = None,
+) -> List[ScenarioReport]:
+    """Compare the total scores of each scenario to those of the baseline formula."""
+    baseline_formula = baseline_formula or load_formula(settings.SCORING_FORMULA_FILE)
+
+    # Compute the percentile scores of all the scenarios at once, so that the
+    # values of each metric are sorted only once.
+    scenario_fields: List[Dict[str, str]] = []
+    definitions: Dict[MetricScore, str] = {
+        definition: definition.field for definition in NODE_TYPE_METRIC_SCORES[node_type]
+    }
+    for scenario in scenarios:
+        fields = {}
+        for definition in scenario.metric_score_definitions(node_type):
+            if definition not in definitions:
+                definitions[definition] = f"{definition.field}@{len(definitions)}"
+            fields[definition.field] = definitions[definition]
+        scenario_fields.append(fields)
+
+    aggregates = aggregate(
+        table,
+        node_type,
+        classifier,
+        metric_scores=[
+            definition._replace(field=field) for definition, field in definitions.items()
+        ],
+    )
+    if not len(aggregates):
+        return []
+
+    baseline = compile_formula(baseline_formula, node_type)(aggregates.fields)["total_score"]
+
+    reports = []
+    for scenario, fields in zip(scenarios, scenario_fields):
+        score = compile_formula(scenario.formula(baseline_formula, node_type), node_type)
+        scenario_scores = score(
+            {
+                **aggregates.fields,
+                **{field: aggregates.fields[name] for field, name in fields.items()},
+            }
+        )
+        reports.append(
+            compare_total_scores(
+                scenario.name,
+                aggregates.node_ids,
+                baseline,
+                scenario_scores["total_score"],
+            )
+        )
+    return reports
+
+
+async def load_measurements(
+    node_type: NodeType, period: Period
+) -> Tuple[MetricsTable, VersionClassifier]:
+    """Load the measurements of a period and the software versions from the database."""
+    conn = await database_connection(settings)
+    try:
+        table = await load_metrics_table(conn, node_type, period)
+        classifier = await load_version_classifier(conn, node_type)
+    finally:
+        await conn.close()
+    return table, classifier
@@ -0,0 +1,281 @@
+"""
+Traces of the measurement rounds, exported in the OTLP/JSON format.
+
+A round is a trace whose ID is the round ID stored in NodeMetrics. It has one
+span per measured node, and the node spans have one child span per probe,
+with the phases of the HTTP requests (DNS resolution, connection, headers sent,
+response) as span events. Every span carries the round ID.
+
+The spans are exported at the end of each round: appended as one line of JSON
+to TRACES_FILE, like the file exporter of the OpenTelemetry collector, and/or
+posted to the OTLP/HTTP endpoint TRACES_ENDPOINT of a local collector. Tracing
+is disabled, and costs nothing, when neither is set.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import uuid4
+
+import aiohttp
+
+from aleph_scoring.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "aleph-scoring"
+ROUND_ID_ATTRIBUTE = "aleph.round_id"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_round_id: ContextVar[Optional[str]] = ContextVar("round_id", default=None)
+_finished_spans: List["Span"] = []
+_finished_spans_lock = threading.Lock()
+
+
+class SpanKind(IntEnum):
+    INTERNAL = 1
+    CLIENT = 3
+
+
+class StatusCode(IntEnum):
+    UNSET = 0
+    OK = 1
+    ERROR = 2
+
+
+def tracing_enabled() -> bool:
+    return bool(settings.TRACES_FILE or settings.TRACES_ENDPOINT)
+
+
+def new_round_id() -> str:
+    """A round ID, usable as an OTLP trace ID."""
+    return uuid4().hex
+
+
+def otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": otlp_value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        kind: SpanKind,
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.status = StatusCode.UNSET
+        self.status_message = ""
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append(
+            {"timeUnixNano": str(time.time_ns()), "name": name, "attributes": attributes}
+        )
+
+    def set_status(self, status: StatusCode, message: str = "") -> None:
+        self.status = status
+        self.status_message = message
+
+    def elapsed(self) -> float:
+        """Seconds since the start of the span."""
+        return (time.time_ns() - self.start_time) / 1e9
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": int(self.kind),
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time or time.time_ns()),
+            "attributes": otlp_attributes(self.attributes),
+            "events": [
+                {**event, "attributes": otlp_attributes(event["attributes"])}
+                for event in self.events
+            ],
+            "status": {"code": int(self.status), "message": self.status_message},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+class NoopSpan:
+    """Span of the disabled tracing."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def set_status(self, status: StatusCode, message: str = "") -> None:
+        pass
+
+    def elapsed(self) -> float:
+        return 0.0
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def current_span():
+    """The span of the running task, or a span that records nothing."""
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def start_span(
+    name: str,
+    kind: SpanKind = SpanKind.INTERNAL,
+    trace_id: Optional[str] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Iterator[Any]:
+    """Record a span for the block, child of the current span of the task.
+
+    An exception leaving the block sets the status of the span to ERROR.
+    """
+    if not tracing_enabled():
+        yield NOOP_SPAN
+        return
+
+    attributes = dict(attributes or {})
+    parent = _current_span.get()
+    round_id = _round_id.get()
+    if round_id:
+        attributes[ROUND_ID_ATTRIBUTE] = round_id
+    span = Span(
+        name,
+        trace_id=trace_id or (parent.trace_id if parent else new_round_id()),
+        parent_span_id=parent.span_id if parent else None,
+        kind=kind,
+        attributes=attributes,
+    )
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.set_status(StatusCode.ERROR, repr(error))
+        raise
+    finally:
+        span.end_time = time.time_ns()
+        _current_span.reset(token)
+        with _finished_spans_lock:
+            _finished_spans.append(span)
+
+
+@contextmanager
+def start_round(round_id: str) -> Iterator[Any]:
+    """Trace a measurement round, as the trace `round_id`."""
+    token = _round_id.set(round_id)
+    try:
+        with start_span("measurement_round", trace_id=round_id) as span:
+            yield span
+    finally:
+        _round_id.reset(token)
+
+
+def trace_configs() -> List[aiohttp.TraceConfig]:
+    """Trace configs recording the phases of the requests of a client
+    session as events of the current span."""
+    if not tracing_enabled():
+        return []
+
+    def record(event_name: str):
+        async def on_event(session, context, params) -> None:
+            current_span().add_event(event_name)
+
+        return on_event
+
+    config = aiohttp.TraceConfig()
+    config.on_dns_resolvehost_start.append(record("dns_resolve_start"))
+    config.on_dns_resolvehost_end.append(record("dns_resolve_end"))
+    config.on_dns_cache_hit.append(record("dns_cache_hit"))
+    config.on_connection_create_start.append(record("connection_create_start"))
+    config.on_connection_create_end.append(record("connection_create_end"))
+    config.on_connection_reuseconn.append(record("connection_reuse"))
+    config.on_request_headers_sent.append(record("request_headers_sent"))
+    config.on_request_end.append(record("response_headers_received"))
+    return [config]
+
+
+def otlp_request(spans: List[Span]) -> Dict[str, Any]:
+    """ExportTraceServiceRequest of the spans, in OTLP/JSON."""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [span.to_otlp() for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+async def export_spans() -> int:
+    """Export the finished spans. Returns their number."""
+    global _finished_spans
+    with _finished_spans_lock:
+        spans, _finished_spans = _finished_spans, []
+    if not spans:
+        return 0
+
+    body = json.dumps(otlp_request(spans))
+    if settings.TRACES_FILE:
+        settings.TRACES_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with settings.TRACES_FILE.open("a") as fd:
+            fd.write(body + "\n")
+    if settings.TRACES_ENDPOINT:
+        timeout = aiohttp.ClientTimeout(total=settings.HTTP_REQUEST_TIMEOUT)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.post(
+                    settings.TRACES_ENDPOINT,
+                    data=body,
+                    headers={"Content-Type": "application/json"},
+                ) as response:
+                    response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.warning(
+                "Could not export %d spans to %s", len(spans), settings.TRACES_ENDPOINT,
+                exc_info=True,
+            )
+    return len(spans)
@@ -1,21 +1,33 @@
-from datetime import datetime
+import re
+from datetime import datetime, timedelta
 from enum import Enum
-from functools import partial
-from typing import Optional, Tuple, List
+from pathlib import Path
+from typing import Optional, List
 
-import asyncpg
-import requests
-from cachetools import TTLCache, cached
 from pydantic import BaseModel
 
 from .config import Settings
 
+SQL_DIRECTORY = Path(__file__).parent / "scoring" / "sql"
+
 
 class Period(BaseModel):
     from_date: datetime
     to_date: datetime
 
 
+DURATION_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_duration(duration: str) -> timedelta:
+    """Parse a duration such as "12h", "7d" or "2w"."""
+    match = re.fullmatch(r"(\d+)([hdw])", duration.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {duration}")
+    value, unit = match.groups()
+    return timedelta(**{DURATION_UNITS[unit]: int(value)})
+
+
 class LogLevel(int, Enum):
     CRITICAL = 50
     FATAL = CRITICAL
@@ -35,16 +47,6 @@ class GithubRelease(BaseModel):
     prerelease: bool
 
 
-# Cache requests to GitHub to avoid reaching rate limiting.
-@cached(cache=TTLCache(maxsize=1, ttl=600))
-def get_github_release(owner: str, repository: str, release: str) -> GithubRelease:
-    uri = f"https://api.github.com/repos/{owner}/{repository}/releases/{release}"
-    response = requests.get(uri)
-    response.raise_for_status()
-
-    return GithubRelease.parse_raw(response.text)
-
-
 def get_latest_release(
     releases_dict: List,
     is_prerelease: bool = False,
@@ -79,33 +81,33 @@ def get_latest_release(
                 return release
 
 
-# Cache requests to GitHub to avoid reaching rate limiting.
-@cached(cache=TTLCache(maxsize=1, ttl=600))
-def get_latest_github_releases(
-    owner: str, repository: str
-) -> Tuple[GithubRelease, Optional[GithubRelease], Optional[GithubRelease]]:
-    uri = f"https://api.github.com/repos/{owner}/{repository}/releases"
-    response = requests.get(uri)
-    response.raise_for_status()
-    result = response.json()
+def read_sql_file(filename: str) -> str:
+    with open(SQL_DIRECTORY / filename) as fd:
+        return fd.read()
 
-    latest_release: GithubRelease = get_latest_release(result, is_prerelease=False)
-    previous_release: Optional[GithubRelease] = get_latest_release(
-        result, released_before=latest_release
-    )
-    prerelease: Optional[GithubRelease] = get_latest_release(result, is_prerelease=True)
 
-    return latest_release, previous_release, prerelease
+async def database_connection(settings: Settings):
+    # Imported here so that the commands without a database do not load the driver
+    import asyncpg
 
+    return await asyncpg.connect(
+        user=settings.DATABASE_USER,
+        password=settings.DATABASE_PASSWORD,
+        database=settings.DATABASE_DATABASE,
+        host=settings.DATABASE_HOST,
+        port=settings.DATABASE_PORT,
+    )
 
-get_latest_github_release = partial(get_github_release, release="latest")
 
+async def database_pool(settings: Settings, min_size: int = 1, max_size: int = 1):
+    import asyncpg
 
-async def database_connection(settings: Settings):
-    return await asyncpg.connect(
+    return await asyncpg.create_pool(
         user=settings.DATABASE_USER,
         password=settings.DATABASE_PASSWORD,
         database=settings.DATABASE_DATABASE,
         host=settings.DATABASE_HOST,
         port=settings.DATABASE_PORT,
+        min_size=min_size,
+        max_size=max_size,
     )
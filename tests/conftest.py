@@ -0,0 +1,31 @@
+import contextlib
+import uuid
+
+import pytest
+
+from aleph_scoring.config import settings
+from aleph_scoring.utils import database_connection
+
+
+@contextlib.asynccontextmanager
+async def connect_to_new_schema():
+    """Connection to a new schema of the database of the settings, dropped
+    afterwards. Skips the test when the database is not reachable."""
+    try:
+        conn = await database_connection(settings)
+    except OSError:
+        pytest.skip("The database is not reachable")
+    schema = f"test_{uuid.uuid4().hex}"
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        await conn.execute(f"SET search_path TO {schema}")
+        yield conn
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+
+
+@pytest.fixture
+def database_schema():
+    """`async with database_schema() as conn:` runs the block in a new schema."""
+    return connect_to_new_schema
@@ -0,0 +1,158 @@
+import datetime as dt
+import json
+
+import pytest
+
+from aleph_scoring.metrics.models import CcnMetrics, CrnMetrics, MetricsPost, NodeMetrics
+from aleph_scoring.scoring.archive import (
+    MetricsArchive,
+    compute_archive_scores,
+    compute_archive_scores_for_periods,
+    load_version_classifiers,
+)
+from aleph_scoring.utils import Period
+
+START = dt.datetime(2023, 4, 15)
+
+
+def node_metrics(hour: int) -> NodeMetrics:
+    measured_at = (START + dt.timedelta(hours=hour)).replace(tzinfo=dt.timezone.utc)
+    return NodeMetrics(
+        server="127.0.0.1",
+        server_asn=1,
+        server_as_name="Aleph.im",
+        ccn=[
+            CcnMetrics(
+                measured_at=measured_at.timestamp(),
+                node_id="ccn-1",
+                url="http://127.0.0.1:4024/",
+                asn=1,
+                as_name="Aleph.im",
+                version="v0.4.7",
+                base_latency=0.1,
+                base_latency_ipv4=0.1,
+                metrics_latency=0.2,
+                aggregate_latency=0.3,
+                file_download_latency=0.4,
+                txs_total=0,
+                pending_messages=0,
+                eth_height_remaining=0,
+            )
+        ],
+        crn=[
+            CrnMetrics(
+                measured_at=measured_at.timestamp(),
+                node_id=f"crn-{hour % 2}",
+                url="https://aleph.sh/",
+                asn=hour % 2,
+                as_name="Aleph.im",
+                version="0.2.5",
+                base_latency=0.2,
+                base_latency_ipv4=0.2,
+                diagnostic_vm_latency=0.5,
+                full_check_latency=None,
+            )
+        ],
+    )
+
+
+def write_software_versions(tmp_path):
+    (tmp_path / "software_versions.json").write_text(
+        json.dumps(
+            [
+                {
+                    "software": "pyaleph",
+                    "name": "v0.4.7",
+                    "released_on": "2023-03-21T11:31:26",
+                    "replaced_on": None,
+                    "prerelease": False,
+                },
+                {
+                    "software": "aleph-vm",
+                    "name": "0.2.5",
+                    "released_on": "2022-10-06T20:58:31",
+                    "replaced_on": None,
+                    "prerelease": False,
+                },
+            ]
+        )
+    )
+
+
+def test_archive_scoring(tmp_path, caplog):
+    write_software_versions(tmp_path)
+    (tmp_path / "round-0.json").write_text(node_metrics(0).json(indent=4))
+    with (tmp_path / "rounds.jsonl").open("w") as fd:
+        for hour in (1, 2):
+            fd.write(MetricsPost(tags=["mainnet"], metrics=node_metrics(hour)).json() + "\n")
+
+    archive = MetricsArchive(tmp_path)
+    classifiers = load_version_classifiers(tmp_path / "software_versions.json")
+    period = Period(from_date=START, to_date=START + dt.timedelta(hours=2))
+
+    scores = compute_archive_scores(archive, period, classifiers)
+    assert "Skipped" not in caplog.text
+    assert [score.node_id for score in scores.ccn] == ["ccn-1"]
+    assert sorted(score.node_id for score in scores.crn) == ["crn-0", "crn-1"]
+    assert scores.ccn[0].version == 1
+    assert scores.ccn[0].measurements.base_latency_score_p25 == 1 - 0.1 / 2
+    assert scores.crn[0].measurements.full_check_latency_score_p25 == 0
+    assert len(archive.load_table("crn")) == 3
+
+    # Only the new files are imported, the scores written next to them are skipped
+    (tmp_path / "round-3.json").write_text(node_metrics(3).json())
+    (tmp_path / "scores.json").write_text(scores.json(indent=4))
+    assert archive.update() == 2
+    assert "Skipped 1 documents" in caplog.text
+    assert archive.update() == 0
+    assert len(archive.load_table("crn")) == 4
+    assert archive.load_table("crn").measured_at.tolist() == sorted(
+        archive.load_table("crn").measured_at.tolist()
+    )
+
+
+def test_archive_multiple_windows(tmp_path):
+    write_software_versions(tmp_path)
+    for hour in range(6):
+        (tmp_path / f"round-{hour}.json").write_text(node_metrics(hour).json())
+
+    to_date = START + dt.timedelta(hours=6)
+    periods = [
+        Period(from_date=to_date - dt.timedelta(hours=hours), to_date=to_date)
+        for hours in (1, 6)
+    ]
+    one_hour, six_hours = compute_archive_scores_for_periods(
+        MetricsArchive(tmp_path),
+        periods,
+        load_version_classifiers(tmp_path / "software_versions.json"),
+    )
+    assert [score.node_id for score in one_hour.crn] == ["crn-1"]
+    assert one_hour.crn[0].measurements.node_version_latest == 1
+    assert sorted(score.node_id for score in six_hours.crn) == ["crn-0", "crn-1"]
+    assert six_hours.ccn[0].measurements.node_version_latest == 6
+
+
+def test_interrupted_archive_update(tmp_path, monkeypatch):
+    for hour in range(2):
+        (tmp_path / f"round-{hour}.json").write_text(node_metrics(hour).json())
+    archive = MetricsArchive(tmp_path)
+    assert archive.update() == 2
+
+    def interrupted_write_index(index):
+        raise KeyboardInterrupt
+
+    (tmp_path / "round-2.json").write_text(node_metrics(2).json())
+    monkeypatch.setattr(archive, "write_index", interrupted_write_index)
+    with pytest.raises(KeyboardInterrupt):
+        archive.update()
+
+    # The index and the arrays of the previous update are used
+    table = archive.load_table("crn")
+    assert len(table) == 2
+    assert len(table.node_ids) == 2
+    monkeypatch.undo()
+    assert archive.update() == 1
+    assert len(archive.load_table("crn")) == 3
+    assert [path.name for path in (tmp_path / ".metrics-cache").iterdir() if path.is_dir()] == [
+        "generation-2"
+    ]
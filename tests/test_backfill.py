@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from aleph_scoring.config import settings
+from aleph_scoring.scoring import backfill
+from aleph_scoring.scoring.backfill import backfill_periods, update_backfill_rollups
+
+
+def test_backfill_periods():
+    periods = backfill_periods(
+        from_date=datetime(2023, 3, 1),
+        to_date=datetime(2023, 3, 4, 12),
+        step=timedelta(days=1),
+        window=timedelta(days=7),
+    )
+
+    assert [period.to_date for period in periods] == [
+        datetime(2023, 3, 1),
+        datetime(2023, 3, 2),
+        datetime(2023, 3, 3),
+        datetime(2023, 3, 4),
+    ]
+    assert all(period.to_date - period.from_date == timedelta(days=7) for period in periods)
+
+
+def test_backfill_rolls_up_the_periods_older_than_the_initial_period(monkeypatch):
+    rolled_up_from = []
+
+    async def update_all_rollups(from_date=None, conn=None):
+        rolled_up_from.append(from_date)
+
+    monkeypatch.setattr(backfill, "update_all_rollups", update_all_rollups)
+    periods = backfill_periods(
+        from_date=datetime.utcnow() - timedelta(weeks=8),
+        to_date=datetime.utcnow(),
+        step=timedelta(days=1),
+        window=timedelta(days=1),
+    )
+    asyncio.run(update_backfill_rollups(periods))
+    asyncio.run(update_backfill_rollups([]))
+
+    assert rolled_up_from == [periods[0].from_date]
+    assert datetime.utcnow() - rolled_up_from[0] > settings.ROLLUP_INITIAL_PERIOD
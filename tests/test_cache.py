@@ -0,0 +1,98 @@
+import asyncio
+import datetime as dt
+import os
+import time
+
+from aleph_scoring.config import ScoringEngine, settings
+from aleph_scoring.scoring import cache, compute
+from aleph_scoring.scoring.cache import (
+    DataWatermark,
+    ScoreCache,
+    aligned_period_end,
+    score_cache_key,
+)
+from aleph_scoring.utils import Period
+
+PERIOD = Period(from_date=dt.datetime(2023, 4, 15), to_date=dt.datetime(2023, 4, 16))
+WATERMARK = DataWatermark(
+    latest_post_time=dt.datetime(2023, 4, 15, 23), post_count=42, software_versions_checksum="0"
+)
+
+
+def test_score_cache_key():
+    key = score_cache_key("crn", PERIOD, WATERMARK)
+
+    assert key == score_cache_key("crn", PERIOD, WATERMARK)
+    assert key != score_cache_key("ccn", PERIOD, WATERMARK)
+    assert key != score_cache_key("crn", PERIOD, WATERMARK._replace(post_count=43))
+    assert key != score_cache_key(
+        "crn", PERIOD, WATERMARK._replace(software_versions_checksum="1")
+    )
+
+
+def test_score_cache_get_put(tmp_path):
+    cache = ScoreCache(tmp_path, max_entries=10, max_age=dt.timedelta(days=1))
+
+    assert cache.get("key") is None
+    cache.put("key", [{"node_id": "node-1", "total_score": 0.5}])
+    assert cache.get("key") == [{"node_id": "node-1", "total_score": 0.5}]
+    assert cache.get("other-key") is None
+
+
+def test_score_cache_eviction(tmp_path):
+    cache = ScoreCache(tmp_path, max_entries=2, max_age=dt.timedelta(days=1))
+    now = time.time()
+
+    for index, key in enumerate(("a", "b")):
+        cache.put(key, [])
+        # Make the access times distinct, before the creation of the next entry
+        os.utime(cache.entry_path(key), (now - 10 + index, now - 10))
+    # Only the times of the files are read
+    cache.entry_path("b").write_text("not JSON")
+    os.utime(cache.entry_path("b"), (now - 9, now - 10))
+    assert cache.get("a") == []
+    cache.put("c", [])
+
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert cache.get("a") == []
+    assert not cache.entry_path("b").exists()
+    assert cache.get("c") == []
+
+    expired_cache = ScoreCache(tmp_path, max_entries=2, max_age=dt.timedelta(seconds=5))
+    assert expired_cache.get("a") is None
+    assert expired_cache.evict() == 1
+    assert [path.name for path in tmp_path.glob("*.json")] == [cache.entry_path("c").name]
+
+
+def test_aligned_period_end(monkeypatch):
+    monkeypatch.setattr(settings, "SCORE_PERIOD_ALIGNMENT", dt.timedelta(hours=1))
+    assert aligned_period_end(dt.datetime(2023, 4, 15, 10, 37, 12)) == dt.datetime(
+        2023, 4, 15, 10
+    )
+    assert aligned_period_end(dt.datetime(2023, 4, 15, 10)) == dt.datetime(2023, 4, 15, 10)
+
+
+def test_repeated_runs_use_the_cached_scores(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SCORE_CACHE_DIRECTORY", tmp_path)
+    monkeypatch.setattr(settings, "SCORING_ENGINE", ScoringEngine.SQL)
+    computed_periods = []
+
+    async def query_data_watermark(conn):
+        return WATERMARK
+
+    async def query_crn_measurements(conn, period):
+        computed_periods.append(period)
+        for item in []:
+            yield item
+
+    monkeypatch.setattr(cache, "query_data_watermark", query_data_watermark)
+    monkeypatch.setattr(compute, "query_crn_measurements", query_crn_measurements)
+
+    # Two runs a few minutes apart, with the default end of the period
+    for now in (dt.datetime(2023, 4, 15, 10, 37), dt.datetime(2023, 4, 15, 10, 52)):
+        to_date = aligned_period_end(now)
+        period = Period(from_date=to_date - settings.SCORE_METRICS_PERIOD, to_date=to_date)
+        assert asyncio.run(compute.compute_crn_scores(period, conn=object())) == []
+
+    assert len(computed_periods) == 1
+    assert len(list(tmp_path.glob("*.json"))) == 1
@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+import datetime as dt
+import time
+
+import pytest
+
+from aleph_scoring.config import settings
+from aleph_scoring.daemon import Daemon, Job, ScoringJob, run_job, scoring_executor
+from aleph_scoring.scoring.models import NodeScores
+
+
+async def noop():
+    pass
+
+
+def test_job_next_run():
+    job = Job("scoring", dt.timedelta(seconds=60), noop)
+    # On time: next multiple of the interval
+    assert job.next_run(started=130, finished=150) == (180, 0)
+    # Three runs missed: one run right away, the others skipped
+    assert job.next_run(started=130, finished=300) == (300, 2)
+
+    measurements = Job("measurements", dt.timedelta(seconds=60), noop, catch_up=False)
+    assert measurements.next_run(started=130, finished=300) == (360, 3)
+
+    with pytest.raises(ValueError):
+        Job("scoring", dt.timedelta(0), noop)
+
+
+def test_run_job_never_overlaps():
+    running = []
+    overlaps = []
+
+    async def slow_run():
+        overlaps.append(len(running))
+        running.append(1)
+        await asyncio.sleep(0.03)
+        running.pop()
+
+    job = Job("slow", dt.timedelta(seconds=0.01), slow_run)
+
+    async def run():
+        stopping = asyncio.Event()
+        task = asyncio.ensure_future(run_job(job, stopping))
+        await asyncio.sleep(0.2)
+        stopping.set()
+        await task
+
+    asyncio.run(run())
+    assert job.runs >= 3
+    assert job.missed > 0
+    assert set(overlaps) == {0}
+
+
+def test_daemon_lets_running_jobs_finish():
+    finished = []
+
+    async def long_run():
+        await asyncio.sleep(0.1)
+        finished.append(True)
+
+    async def never_ending_run():
+        await asyncio.sleep(3600)
+
+    daemon = Daemon(
+        [
+            Job("long", dt.timedelta(hours=1), long_run),
+            Job("stuck", dt.timedelta(hours=1), never_ending_run),
+        ]
+    )
+
+    async def run():
+        asyncio.get_running_loop().call_later(0.02, daemon.stop)
+        await daemon.run(shutdown_timeout=dt.timedelta(seconds=0.5))
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
+    assert finished == [True]
+    assert [job.runs for job in daemon.jobs] == [1, 0]
+
+
+class FakePool:
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield None
+
+
+def busy_scores(period):
+    """Scores computed with a second of CPU work."""
+    deadline = time.process_time() + 1
+    while time.process_time() < deadline:
+        pass
+    return NodeScores(ccn=[], crn=[])
+
+
+def test_scoring_does_not_delay_the_probes(monkeypatch):
+    monkeypatch.setattr(settings, "SYNC_SOFTWARE_VERSIONS", False)
+    monkeypatch.setattr(settings, "PARTITIONED_MEASUREMENTS", False)
+
+    async def query_data_watermark(conn):
+        return "watermark"
+
+    monkeypatch.setattr("aleph_scoring.daemon.query_data_watermark", query_data_watermark)
+
+    async def run():
+        lags = []
+        with scoring_executor() as executor:
+            job = ScoringJob(FakePool(), None, None, executor=executor, score=busy_scores)
+            scoring = asyncio.ensure_future(job())
+            # Probes made while the scores are computed
+            while not scoring.done():
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+            await scoring
+        return job, lags
+
+    job, lags = asyncio.run(asyncio.wait_for(run(), timeout=30))
+    assert job.last_watermark == "watermark"
+    assert len(lags) > 10
+    assert max(lags) < 0.1
@@ -0,0 +1,122 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from aleph_scoring.metrics.models import CrnMetrics
+from aleph_scoring.scoring.engine import (
+    ANNOTATIONS,
+    MetricsTable,
+    SoftwareVersion,
+    VersionClassifier,
+    aggregate,
+    compute_scores,
+    group_percentiles,
+    score_metrics_table,
+)
+from aleph_scoring.scoring.metric_scores import CRN_METRICS
+
+
+@pytest.fixture
+def classifier():
+    # Same releases as test_software_versions_function.sql
+    return VersionClassifier(
+        [
+            SoftwareVersion("0.2.5", dt.datetime(2022, 10, 6, 20, 58, 31), None, False),
+            SoftwareVersion(
+                "0.2.4",
+                dt.datetime(2022, 7, 27, 8, 55, 17),
+                dt.datetime(2022, 10, 6, 20, 58, 31),
+                False,
+            ),
+            SoftwareVersion("0.3.0-rc1", dt.datetime(2022, 11, 1), None, True),
+        ]
+    )
+
+
+def crn_metrics(node_id, measured_at, base_latency, version="0.2.5", asn=1):
+    return CrnMetrics(
+        measured_at=measured_at.replace(tzinfo=dt.timezone.utc).timestamp(),
+        node_id=node_id,
+        url="https://aleph.sh",
+        asn=asn,
+        as_name="Aleph.im",
+        version=version,
+        base_latency=base_latency,
+        base_latency_ipv4=base_latency,
+        diagnostic_vm_latency=0.5,
+        full_check_latency=1.0,
+    )
+
+
+def test_group_percentiles_matches_percentile_disc():
+    values = np.array([4.0, 1.0, 3.0, 2.0, 10.0, 20.0])
+    groups = np.array([0, 0, 0, 0, 2, 2])
+    percentiles = group_percentiles(values, groups, 3, [0.25, 0.5, 0.95])
+
+    assert percentiles[0.25].tolist()[0] == 1.0
+    assert percentiles[0.5].tolist()[0] == 2.0
+    assert percentiles[0.95].tolist()[0] == 4.0
+    assert np.isnan(percentiles[0.25][1])
+    assert percentiles[0.25][2] == 10.0
+
+
+def test_version_classifier(classifier):
+    dates = [
+        dt.datetime(2021, 3, 30),  # Before 0.2.5 was released
+        dt.datetime(2023, 4, 15),  # 0.2.5 is the latest
+        dt.datetime(2022, 10, 10),  # 0.2.4 was replaced a few days before
+        dt.datetime(2022, 12, 1),  # 0.2.4 was replaced more than 2 weeks before
+        dt.datetime(2022, 12, 1),
+        dt.datetime(2022, 12, 1),
+        dt.datetime(2022, 12, 1),
+    ]
+    names = ["", "0.2.5", "0.2.4", "0.3.0-rc1", "unknown"]
+    codes = np.array([1, 1, 2, 2, 3, 4, 0])
+    measured_at = np.array([d.replace(tzinfo=dt.timezone.utc).timestamp() for d in dates])
+
+    annotations = classifier.annotate(names, codes, measured_at)
+    assert [ANNOTATIONS[code] for code in annotations] == [
+        "other",
+        "latest",
+        "outdated",
+        "obsolete",
+        "prerelease",
+        "unknown",
+        "missing",
+    ]
+
+
+def test_aggregate_and_score(classifier):
+    now = dt.datetime(2023, 4, 15)
+    table = MetricsTable.from_node_metrics(
+        [
+            crn_metrics("a", now, 0.2),
+            crn_metrics("a", now, 0.4),
+            crn_metrics("a", now, None, version=None),
+            crn_metrics("b", now, 0.1, asn=2),
+        ],
+        metrics=CRN_METRICS,
+    )
+    aggregates = aggregate(table, "crn", classifier)
+    assert aggregates.node_ids.tolist() == ["a", "b"]
+
+    node_a = {name: values[0] for name, values in aggregates.fields.items()}
+    assert node_a["base_latency_score_p25"] == pytest.approx(1 - 0.2 / 2)
+    # The missing value counts as 100 seconds
+    assert node_a["base_latency_score_p95"] == 0
+    assert node_a["node_version_latest"] == 2
+    assert node_a["node_version_missing"] == 1
+    assert node_a["total_nodes"] == 2
+    assert node_a["nodes_with_identical_asn"] == 1
+
+    scores = compute_scores("crn", aggregates.fields)
+    # Too many measurements without version
+    assert scores["version"][0] == 0
+    assert scores["total_score"][0] == 0
+    assert scores["decentralization"][1] == pytest.approx(0.25)
+
+    node_scores = score_metrics_table(table, "crn", classifier)
+    assert [score.node_id for score in node_scores] == ["a", "b"]
+    assert node_scores[1].version == 1
+    assert node_scores[1].total_score == pytest.approx(scores["total_score"][1])
@@ -0,0 +1,201 @@
+import datetime as dt
+import json
+from pathlib import Path
+
+import pyarrow.parquet as pq
+from typer.testing import CliRunner
+
+from aleph_scoring import export
+from aleph_scoring.__main__ import app
+from aleph_scoring.config import settings
+from aleph_scoring.export import (
+    SCHEMAS,
+    ExportWriter,
+    compact_export,
+    compact_partition,
+    export_node_metrics,
+    export_node_scores,
+    load_export,
+)
+from aleph_scoring.metrics.models import CcnMetrics, CrnMetrics, NodeMetrics
+from aleph_scoring.scoring.models import CcnMeasurements, CrnMeasurements, NodeScores
+from aleph_scoring.scoring.synthetic import (
+    SyntheticDataset,
+    generate_posts,
+    software_version_records,
+)
+from aleph_scoring.utils import Period
+
+END = dt.datetime(2023, 4, 15)
+
+
+def node_metrics(measured_at: dt.datetime, nodes: int = 3) -> NodeMetrics:
+    timestamp = measured_at.replace(tzinfo=dt.timezone.utc).timestamp()
+    return NodeMetrics(
+        round_id=f"round-{timestamp:.0f}",
+        server="127.0.0.1",
+        server_asn=1,
+        server_as_name="AS-TEST",
+        ccn=[
+            CcnMetrics(measured_at=timestamp, node_id="ccn-0", url="http://ccn", txs_total=10)
+        ],
+        crn=[
+            CrnMetrics(
+                measured_at=timestamp,
+                node_id=f"crn-{index}",
+                url=f"http://crn-{index}",
+                base_latency=0.1 * index,
+            )
+            for index in reversed(range(nodes))
+        ],
+    )
+
+
+def writer(tmp_path) -> ExportWriter:
+    return ExportWriter(tmp_path, batch_rows=1000, flush_interval=3600)
+
+
+def test_schemas_cover_the_models():
+    assert set(CcnMetrics.__fields__) <= set(SCHEMAS["ccn_metrics"].names)
+    assert set(CrnMetrics.__fields__) <= set(SCHEMAS["crn_metrics"].names)
+    for node_type, measurements in (("ccn", CcnMeasurements), ("crn", CrnMeasurements)):
+        names = set(SCHEMAS[f"{node_type}_scores"].names)
+        assert set(measurements.__fields__) <= names
+        assert {"node_id", "total_score", "from_date", "to_date"} <= names
+
+
+def test_writer_batches_rows(tmp_path):
+    exporter = writer(tmp_path)
+    export_node_metrics(node_metrics(END - dt.timedelta(hours=1)), exporter)
+    export_node_metrics(node_metrics(END + dt.timedelta(hours=1)), exporter)
+    assert not list(tmp_path.rglob("*.parquet"))
+    assert exporter.buffered_rows() == 8
+
+    paths = exporter.flush()
+    assert sorted(path.relative_to(tmp_path).parent.as_posix() for path in paths) == [
+        "ccn_metrics/date=2023-04-14",
+        "ccn_metrics/date=2023-04-15",
+        "crn_metrics/date=2023-04-14",
+        "crn_metrics/date=2023-04-15",
+    ]
+    assert exporter.buffered_rows() == 0
+
+    full = ExportWriter(tmp_path, batch_rows=4, flush_interval=3600)
+    export_node_metrics(node_metrics(END), full)
+    assert full.buffered_rows() == 0
+
+
+def test_load_export_reads_the_selected_days_and_columns(tmp_path):
+    exporter = writer(tmp_path)
+    for hours in (-25, -1, 1):
+        export_node_metrics(node_metrics(END + dt.timedelta(hours=hours)), exporter)
+    exporter.flush()
+
+    table = load_export(
+        "crn_metrics",
+        columns=["node_id", "measured_at", "base_latency"],
+        from_date=END - dt.timedelta(hours=2),
+        to_date=END,
+        directory=tmp_path,
+    )
+    assert table.column_names == ["node_id", "measured_at", "base_latency"]
+    assert table.num_rows == 3
+    assert set(table.column("measured_at").to_pylist()) == {
+        (END - dt.timedelta(hours=1)).replace(tzinfo=dt.timezone.utc)
+    }
+    assert load_export("crn_metrics", directory=tmp_path).num_rows == 9
+
+
+def test_compaction_merges_the_past_days(tmp_path):
+    exporter = writer(tmp_path)
+    for hours in (-3, -2, -1, 1):
+        export_node_metrics(node_metrics(END + dt.timedelta(hours=hours)), exporter)
+        exporter.flush()
+    before = load_export("crn_metrics", directory=tmp_path).sort_by("node_id")
+
+    assert compact_export(tmp_path, before=END.date()) == 2
+    (compacted,) = (tmp_path / "crn_metrics" / "date=2023-04-14").glob("*.parquet")
+    assert len(list((tmp_path / "crn_metrics" / "date=2023-04-15").glob("*.parquet"))) == 1
+    assert not list(tmp_path.rglob(".*"))
+    assert pq.read_table(compacted).column("node_id").to_pylist() == [
+        f"crn-{index}" for index in range(3) for _ in range(3)
+    ]
+    assert load_export("crn_metrics", directory=tmp_path).sort_by("node_id").equals(before)
+    assert compact_export(tmp_path, before=END.date()) == 0
+
+
+def test_compaction_removes_the_files_left_by_an_interrupted_one(tmp_path, monkeypatch):
+    exporter = writer(tmp_path)
+    partition = tmp_path / "crn_metrics" / "date=2023-04-14"
+    for hours in (-2, -1):
+        export_node_metrics(node_metrics(END + dt.timedelta(hours=hours)), exporter)
+        exporter.flush()
+    leftovers = {path: path.read_bytes() for path in partition.glob("*.parquet")}
+
+    compacted = compact_partition(partition, "crn_metrics")
+    for path, content in leftovers.items():
+        path.write_bytes(content)
+
+    # List the compacted file first, before the files it replaces
+    glob = Path.glob
+    monkeypatch.setattr(
+        Path, "glob", lambda self, pattern: iter(sorted(glob(self, pattern), reverse=True))
+    )
+    assert compact_partition(partition, "crn_metrics") is None
+    assert list(partition.glob("*.parquet")) == [compacted]
+
+
+def test_export_scores(tmp_path):
+    scores = NodeScores(
+        ccn=[],
+        crn=[
+            {
+                "node_id": "crn-0",
+                "total_score": 0.5,
+                "performance": 0.9,
+                "version": 1.0,
+                "decentralization": 0.75,
+                "measurements": {
+                    **{field: 0 for field in CrnMeasurements.__fields__},
+                    "total_nodes": 4,
+                    "full_check_latency_score_p95": 0.3,
+                },
+            }
+        ],
+    )
+    exporter = writer(tmp_path)
+    export_node_scores(Period(from_date=END - dt.timedelta(days=1), to_date=END), scores, exporter)
+    exporter.flush()
+
+    (row,) = load_export("crn_scores", directory=tmp_path).to_pylist()
+    assert row["node_id"] == "crn-0"
+    assert row["to_date"] == END.replace(tzinfo=dt.timezone.utc)
+    assert row["total_nodes"] == 4
+    assert row["full_check_latency_score_p95"] == 0.3
+    assert row["date"] == END.date()
+
+
+def test_compute_scores_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SCORE_CACHE_DIRECTORY", None)
+    monkeypatch.setattr(settings, "EXPORT_DATAFRAME", True)
+    monkeypatch.setattr(settings, "EXPORT_DIRECTORY", tmp_path / "export")
+    monkeypatch.setattr(export, "_writer", None)
+    dataset = SyntheticDataset(ccn_nodes=2, crn_nodes=3, rounds_per_day=4, days=1)
+    with (tmp_path / "rounds.jsonl").open("w") as fd:
+        for post in generate_posts(dataset, END):
+            fd.write(post.content + "\n")
+    (tmp_path / "software_versions.json").write_text(
+        json.dumps(
+            [json.loads(record.json()) for record in software_version_records(dataset.period(END))]
+        )
+    )
+
+    result = CliRunner().invoke(
+        app,
+        ["compute-scores", "--metrics-directory", str(tmp_path), "--to-date", END.isoformat()],
+    )
+    assert result.exit_code == 0, result.output
+
+    for node_type, nodes in (("ccn", 2), ("crn", 3)):
+        table = load_export(f"{node_type}_scores", directory=tmp_path / "export")
+        assert table.num_rows == nodes
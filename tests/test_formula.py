@@ -0,0 +1,118 @@
+import json
+
+import numpy as np
+import pytest
+
+from aleph_scoring.scoring.formula import (
+    DEFAULT_FORMULA,
+    FormulaSpec,
+    compile_formula,
+    load_formula,
+)
+
+
+def random_fields(factors, size=200, seed=0):
+    rng = np.random.default_rng(seed)
+    fields = {factor: rng.uniform(0, 1, size) for factor in factors}
+    # Some nodes have a null factor
+    fields[factors[0]][:10] = 0
+    for annotation in ("latest", "prerelease", "outdated", "obsolete", "other", "missing"):
+        fields[f"node_version_{annotation}"] = rng.integers(0, 20, size)
+    fields["node_version_missing"][:20] = 0
+    fields["total_nodes"] = np.full(size, 50)
+    fields["nodes_with_identical_asn"] = rng.integers(1, 50, size)
+    return fields
+
+
+def reference_scores(fields, factors):
+    """Hand-written formulas that the default spec replaces."""
+    performance = np.prod([fields[factor] for factor in factors], axis=0) ** (1 / len(factors))
+    known = sum(
+        fields[f"node_version_{annotation}"]
+        for annotation in ("latest", "prerelease", "outdated", "obsolete", "other")
+    )
+    missing = fields["node_version_missing"]
+    total = known + missing
+    valid = (
+        fields["node_version_latest"]
+        + fields["node_version_outdated"]
+        + fields["node_version_prerelease"]
+    )
+    version = np.where(
+        (total == 0) | (missing > known / 5), 0.0, valid / np.maximum(total, 1)
+    )
+    decentralization = (1 - fields["nodes_with_identical_asn"] / fields["total_nodes"]) ** 2
+    return {
+        "total_score": (performance * version) ** (1 / 2),
+        "performance": performance,
+        "version": version,
+        "decentralization": decentralization,
+    }
+
+
+@pytest.mark.parametrize(
+    "node_type, factors",
+    [
+        (
+            "crn",
+            [
+                "base_latency_score_p25",
+                "base_latency_score_p95",
+                "diagnostic_vm_latency_score_p25",
+                "full_check_latency_score_p25",
+            ],
+        ),
+        (
+            "ccn",
+            [
+                "base_latency_score_p25",
+                "base_latency_score_p95",
+                "metrics_latency_score_p25",
+                "metrics_latency_score_p95",
+                "aggregate_latency_score_p25",
+                "aggregate_latency_score_p95",
+            ],
+        ),
+    ],
+)
+def test_default_formula_matches_reference(node_type, factors):
+    fields = random_fields(factors)
+    scores = compile_formula(DEFAULT_FORMULA, node_type)(fields)
+    expected = reference_scores(fields, factors)
+
+    for name, values in expected.items():
+        np.testing.assert_allclose(scores[name], values, rtol=1e-12, atol=1e-15)
+
+
+def test_formula_file(tmp_path):
+    spec = DEFAULT_FORMULA.dict()
+    spec["crn"]["performance_factors"] = [
+        {"field": "base_latency_score_p25", "weight": 3},
+        {"field": "full_check_latency_score_p25", "weight": 1},
+    ]
+    spec["version_weight"] = 0
+    path = tmp_path / "formula.json"
+    path.write_text(json.dumps(spec))
+
+    score = compile_formula(load_formula(path), "crn")
+    fields = random_fields(["base_latency_score_p25", "full_check_latency_score_p25"])
+    scores = score(fields)
+
+    expected_performance = (
+        fields["base_latency_score_p25"] ** 0.75 * fields["full_check_latency_score_p25"] ** 0.25
+    )
+    np.testing.assert_allclose(scores["performance"], expected_performance, rtol=1e-12)
+    # The total score only depends on the performance
+    np.testing.assert_allclose(scores["total_score"], expected_performance, rtol=1e-12)
+
+
+def test_formula_validation():
+    spec = DEFAULT_FORMULA.dict()
+    spec["valid_versions"] = ["latest", "newest"]
+    with pytest.raises(ValueError):
+        FormulaSpec.parse_obj(spec)
+
+    spec = DEFAULT_FORMULA.dict()
+    spec["ccn"]["performance_factors"] = [{"field": "base_latency_score_p25", "weight": 0}]
+    with pytest.raises(ValueError):
+        FormulaSpec.parse_obj(spec)
@@ -0,0 +1,123 @@
+import asyncio
+import datetime as dt
+
+from aiohttp import web
+
+from aleph_scoring.config import settings
+from aleph_scoring.ingest import PostRow, ingest_posts, iter_api_posts, parse_post
+
+
+def api_post(item_hash, time, post_type=None):
+    return {
+        "item_hash": item_hash,
+        "address": settings.ALLOWED_METRICS_SENDER,
+        "type": post_type or settings.ALEPH_POST_TYPE_METRICS,
+        "channel": "aleph-scoring",
+        "time": time,
+        "content": {"tags": ["mainnet"], "metrics": {"ccn": [], "crn": []}},
+    }
+
+
+def test_parse_post():
+    row = parse_post(api_post("a", 1681516800.0))
+    assert row.item_hash == "a"
+    assert row.owner == settings.ALLOWED_METRICS_SENDER
+    assert row.creation_datetime == dt.datetime(2023, 4, 15, tzinfo=dt.timezone.utc)
+    assert '"metrics"' in row.content
+
+    message = {
+        "item_hash": "b",
+        "type": "POST",
+        "channel": "aleph-scoring",
+        "content": {
+            "address": settings.ALLOWED_METRICS_SENDER,
+            "type": settings.ALEPH_POST_TYPE_METRICS,
+            "time": 1681516800.0,
+            "content": {"metrics": {}},
+        },
+    }
+    assert parse_post(message).content == '{"metrics": {}}'
+
+    assert parse_post(api_post("c", 1681516800.0, post_type="other")) is None
+    assert parse_post({"item_hash": "d", "content": "not a post"}) is None
+
+
+class FakeCopyConnection:
+    def __init__(self):
+        self.posts = {}
+        self.batches = []
+
+    async def copy_posts(self, rows):
+        self.batches.append(len(rows))
+        new_rows = [row for row in rows if row.item_hash not in self.posts]
+        self.posts.update((row.item_hash, row) for row in rows)
+        return len(new_rows)
+
+
+def test_ingest_posts_dedupes_and_batches(monkeypatch):
+    conn = FakeCopyConnection()
+
+    async def copy_posts(_conn, source, rows):
+        assert source == "files"
+        assert all(isinstance(row, PostRow) for row in rows)
+        return await conn.copy_posts(rows)
+
+    monkeypatch.setattr("aleph_scoring.ingest.copy_posts", copy_posts)
+
+    async def items():
+        for index in range(5):
+            yield api_post(f"post-{index}", 1681516800.0 + index)
+        # Duplicates
+        yield api_post("post-0", 1681516800.0)
+        yield api_post("post-4", 1681516804.0)
+
+    stats = asyncio.run(ingest_posts(conn, "files", items(), batch_size=2))
+
+    assert stats.read == 7
+    assert stats.inserted == 5
+    assert sorted(conn.posts) == [f"post-{index}" for index in range(5)]
+
+
+def test_iter_api_posts_pages():
+    posts = [api_post(f"post-{index}", 1681516800.0 + index) for index in range(5)]
+    requests = []
+
+    async def posts_handler(request):
+        requests.append(dict(request.query))
+        page = int(request.query["page"])
+        page_size = int(request.query["pagination"])
+        return web.json_response(
+            {
+                "posts": posts[(page - 1) * page_size: page * page_size],
+                "pagination_page": page,
+                "pagination_per_page": page_size,
+                "pagination_total": len(posts),
+            }
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/v0/posts.json", posts_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            return [
+                post
+                async for post in iter_api_posts(
+                    f"http://127.0.0.1:{port}",
+                    since=dt.datetime(2023, 4, 15),
+                    page_size=2,
+                )
+            ]
+        finally:
+            await runner.cleanup()
+
+    received = asyncio.run(run())
+
+    assert [post["item_hash"] for post in received] == [post["item_hash"] for post in posts]
+    assert len(requests) == 3
+    assert requests[0]["types"] == settings.ALEPH_POST_TYPE_METRICS
+    assert float(requests[0]["startDate"]) == 1681516800.0
@@ -0,0 +1,61 @@
+import asyncio
+import datetime as dt
+from contextlib import asynccontextmanager
+
+from aleph_scoring.scoring import query_crn_measurements
+from aleph_scoring.scoring.models import CrnMeasurements
+from aleph_scoring.utils import Period
+
+
+class FakeCursorConnection:
+    """Connection that only supports streaming queries in a transaction."""
+
+    def __init__(self, records):
+        self.records = records
+        self.in_transaction = False
+        self.prefetch = None
+
+    @asynccontextmanager
+    async def _transaction(self):
+        self.in_transaction = True
+        yield
+        self.in_transaction = False
+
+    def transaction(self):
+        return self._transaction()
+
+    def cursor(self, query, *args, prefetch):
+        assert self.in_transaction, "Cursors require a transaction"
+        self.prefetch = prefetch
+
+        async def records():
+            for record in self.records:
+                yield record
+
+        return records()
+
+
+def crn_record(node_id):
+    record = {name: 0 for name in CrnMeasurements.__fields__}
+    record.update(node_id=node_id, asn=1, total_nodes=2, base_latency_score_p25=0.5)
+    return record
+
+
+def test_query_crn_measurements_streams_records():
+    conn = FakeCursorConnection([crn_record("a"), crn_record("b")])
+    period = Period(from_date=dt.datetime(2023, 4, 15), to_date=dt.datetime(2023, 4, 16))
+
+    async def collect():
+        return [item async for item in query_crn_measurements(conn, period)]
+
+    measurements = asyncio.run(collect())
+
+    assert [node_id for node_id, _ in measurements] == ["a", "b"]
+    assert conn.prefetch > 0
+    assert not conn.in_transaction
+    node_a = measurements[0][1]
+    assert isinstance(node_a, CrnMeasurements)
+    assert node_a.total_nodes == 2
+    assert node_a.base_latency_score_p25 == 0.5
+    # Only the fields of the model are kept
+    assert set(node_a.dict()) == set(CrnMeasurements.__fields__)
@@ -0,0 +1,100 @@
+import asyncio
+import datetime as dt
+
+import pytest
+
+from aleph_scoring.scoring import migrations
+from aleph_scoring.scoring.migrations import (
+    MIGRATIONS,
+    AppliedMigration,
+    Migration,
+    migrate,
+    pending_migrations,
+    sequential_scans,
+)
+
+
+def applied(migration: Migration, checksum=None) -> AppliedMigration:
+    return AppliedMigration(
+        version=migration.version,
+        name=migration.name,
+        checksum=checksum or migration.checksum(),
+        applied_at=dt.datetime(2023, 4, 15),
+    )
+
+
+def test_migrations_are_ordered_and_readable():
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions))
+    for migration in MIGRATIONS:
+        assert all(sql.strip() for sql in migration.sql())
+
+
+def test_pending_migrations():
+    assert pending_migrations(MIGRATIONS, {}) == list(MIGRATIONS)
+
+    all_applied = {migration.version: applied(migration) for migration in MIGRATIONS}
+    assert pending_migrations(MIGRATIONS, all_applied) == []
+
+    # A repeatable migration is applied again when its SQL changes
+    function = next(migration for migration in MIGRATIONS if migration.repeatable)
+    changed = {**all_applied, function.version: applied(function, checksum="previous")}
+    assert pending_migrations(MIGRATIONS, changed) == [function]
+
+    # A versioned migration must not change
+    table = next(migration for migration in MIGRATIONS if not migration.repeatable)
+    changed = {**all_applied, table.version: applied(table, checksum="previous")}
+    with pytest.raises(ValueError):
+        pending_migrations(MIGRATIONS, changed)
+
+
+def test_sequential_scans():
+    plan = {
+        "Node Type": "Hash Join",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "software_versions"},
+            {
+                "Node Type": "Nested Loop",
+                "Plans": [
+                    {"Node Type": "Index Scan", "Relation Name": "posts"},
+                    {"Node Type": "Function Scan"},
+                ],
+            },
+        ],
+    }
+    assert list(sequential_scans(plan)) == ["software_versions"]
+
+
+def test_repeatable_migration_replaces_the_view(database_schema, monkeypatch):
+    read_sql_file = migrations.read_sql_file
+
+    def read_changed_sql_file(filename):
+        sql = read_sql_file(filename)
+        if filename == "software_version_intervals.sql":
+            sql = sql.replace(
+                "intervals.annotation\n", "intervals.annotation,\n       1 as revision\n"
+            )
+        return sql
+
+    async def run():
+        async with database_schema() as conn:
+            await migrate(conn)
+            monkeypatch.setattr(migrations, "read_sql_file", read_changed_sql_file)
+            reapplied = await migrate(conn)
+
+            await conn.execute(
+                "INSERT INTO software_versions (software, name, released_on) "
+                "VALUES ('aleph-vm', '0.2.5', '2022-10-06')"
+            )
+            revisions = await conn.fetch("SELECT revision FROM software_version_intervals")
+            indexes = await conn.fetch(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = 'software_version_intervals' AND schemaname = current_schema"
+            )
+            return reapplied, revisions, indexes
+
+    reapplied, revisions, indexes = asyncio.run(run())
+    assert [migration.name for migration in reapplied] == ["software_version_intervals"]
+    # The trigger refreshed the new view
+    assert [record["revision"] for record in revisions] == [1, 1]
+    assert [record["indexname"] for record in indexes] == ["software_version_intervals_lookup"]
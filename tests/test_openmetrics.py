@@ -0,0 +1,83 @@
+import asyncio
+import urllib.request
+
+import pytest
+
+from aleph_scoring.config import settings
+from aleph_scoring.openmetrics import (
+    CONTENT_TYPE,
+    EVENT_LOOP_LAG,
+    PUBLICATIONS,
+    Counter,
+    Gauge,
+    Histogram,
+    render_metrics,
+    start_metrics_server,
+    watch_event_loop_lag,
+)
+
+
+def test_render_metrics():
+    registry = []
+    probes = Counter("probes", "Probes.", labels=("probe",), registry=registry)
+    in_flight = Gauge("in_flight", "In flight.", registry=registry)
+    latency = Histogram(
+        "latency_seconds", "Latency.", labels=("probe",), buckets=(0.1, 1), registry=registry
+    )
+    Gauge("age_seconds", "Age.", function=lambda: None, registry=registry)
+
+    probes.inc('with "quotes"')
+    probes.inc('with "quotes"', amount=2)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, "base")
+
+    assert render_metrics(registry).splitlines() == [
+        "# TYPE probes counter",
+        "# HELP probes Probes.",
+        'probes_total{probe="with \\"quotes\\""} 3.0',
+        "# TYPE in_flight gauge",
+        "# HELP in_flight In flight.",
+        "in_flight 1.0",
+        "# TYPE latency_seconds histogram",
+        "# HELP latency_seconds Latency.",
+        'latency_seconds_bucket{probe="base",le="0.1"} 2.0',
+        'latency_seconds_bucket{probe="base",le="1.0"} 3.0',
+        'latency_seconds_bucket{probe="base",le="+Inf"} 4.0',
+        'latency_seconds_count{probe="base"} 4.0',
+        'latency_seconds_sum{probe="base"} 3.65',
+        "# TYPE age_seconds gauge",
+        "# HELP age_seconds Age.",
+        "# EOF",
+    ]
+    with pytest.raises(ValueError):
+        probes.inc()
+
+
+def test_watch_event_loop_lag(monkeypatch):
+    monkeypatch.setattr(settings, "OPENMETRICS_PORT", 0)
+    count = EVENT_LOOP_LAG.count()
+
+    async def run():
+        async with watch_event_loop_lag(interval=0.01):
+            async with watch_event_loop_lag(interval=0.01):
+                await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert EVENT_LOOP_LAG.count() > count
+
+
+def test_metrics_server():
+    PUBLICATIONS.inc("scores", "published")
+    port = start_metrics_server(port=0, host="127.0.0.1")
+
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert response.headers["Content-Type"] == CONTENT_TYPE
+        body = response.read().decode()
+
+    assert 'aleph_scoring_publications_total{kind="scores",outcome="published"}' in body
+    assert body.endswith("# EOF\n")
+    # Started once per process
+    assert start_metrics_server(port=0, host="127.0.0.1") == port
@@ -0,0 +1,120 @@
+import asyncio
+import datetime as dt
+import time
+from contextlib import asynccontextmanager
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics.models import NodeMetrics
+from aleph_scoring.openmetrics import PUBLICATIONS
+from aleph_scoring.outbox import (
+    Outbox,
+    OutboxKind,
+    drain_outbox,
+    enqueue_metrics,
+    enqueue_scores,
+    retry_delay,
+)
+from aleph_scoring.scoring.models import NodeScores
+from aleph_scoring.utils import Period
+
+PERIOD = Period(from_date=dt.datetime(2023, 4, 14), to_date=dt.datetime(2023, 4, 15))
+
+
+@asynccontextmanager
+async def fake_client():
+    yield None
+
+
+class FakePublisher:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.published = []
+
+    async def __call__(self, client, entry):
+        if entry.id in self.failing:
+            raise ConnectionError("API server unavailable")
+        self.published.append(entry.id)
+        return f"hash-{entry.id}"
+
+
+def drain(outbox, publish):
+    return asyncio.run(drain_outbox(outbox, client_factory=fake_client, publish=publish))
+
+
+def test_enqueue_and_drain(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    metrics_id = enqueue_metrics(
+        NodeMetrics(server="127.0.0.1", server_asn=1, server_as_name="LOCAL", ccn=[], crn=[]),
+        outbox,
+    )
+    scores_id = enqueue_scores(PERIOD, NodeScores(ccn=[], crn=[]), outbox)
+
+    entries = outbox.claim(limit=10)
+    assert [entry.kind for entry in entries] == [OutboxKind.METRICS, OutboxKind.SCORES]
+    assert entries[1].payload["scores"] == {"ccn": [], "crn": []}
+    # Claimed entries are not due again before the end of the lease
+    assert outbox.claim(limit=10) == []
+    outbox.release([metrics_id, scores_id])
+
+    publisher = FakePublisher()
+    assert drain(outbox, publisher) == 2
+    assert publisher.published == [metrics_id, scores_id]
+    assert outbox.pending() == 0
+    assert drain(outbox, publisher) == 0
+
+
+def test_failed_scores_block_later_scores_only(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    first_scores = outbox.add(OutboxKind.SCORES, {})
+    second_scores = outbox.add(OutboxKind.SCORES, {})
+    metrics = outbox.add(OutboxKind.METRICS, {})
+
+    publisher = FakePublisher(failing={first_scores})
+    assert drain(outbox, publisher) == 1
+    assert publisher.published == [metrics]
+    # The second scores wait for the retry of the first ones
+    assert drain(outbox, publisher) == 0
+    assert outbox.pending() == 2
+
+    # The API server is back and the retry is due
+    publisher.failing.clear()
+    outbox.release([first_scores])
+    assert drain(outbox, publisher) == 2
+    assert publisher.published == [metrics, first_scores, second_scores]
+
+
+def test_scores_that_always_fail_stop_blocking_after_the_last_attempt(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 2)
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    bad_scores = outbox.add(OutboxKind.SCORES, {})
+    next_scores = outbox.add(OutboxKind.SCORES, {})
+    abandoned = PUBLICATIONS.value("scores", "abandoned")
+
+    publisher = FakePublisher(failing={bad_scores})
+    assert drain(outbox, publisher) == 0
+    outbox.release([bad_scores])
+    # Last attempt: the entry fails for good and the next scores are published
+    assert drain(outbox, publisher) == 1
+    assert publisher.published == [next_scores]
+    assert outbox.pending() == 0
+    assert outbox.failed() == 1
+    assert PUBLICATIONS.value("scores", "abandoned") == abandoned + 1
+
+    outbox.release([bad_scores])
+    assert outbox.claim(limit=10) == []
+
+
+def test_retry_delay(monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_RETRY_DELAY", dt.timedelta(seconds=30))
+    monkeypatch.setattr(settings, "OUTBOX_MAX_RETRY_DELAY", dt.timedelta(minutes=5))
+    assert [retry_delay(attempts) for attempts in range(1, 6)] == [30, 60, 120, 240, 300]
+
+
+def test_purge(tmp_path):
+    outbox = Outbox(tmp_path / "outbox.sqlite3")
+    published = outbox.add(OutboxKind.METRICS, {})
+    outbox.add(OutboxKind.METRICS, {})
+    outbox.mark_published(published, "hash")
+
+    assert outbox.purge(published_before=time.time() + 1) == 1
+    assert outbox.pending() == 1
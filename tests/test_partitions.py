@@ -0,0 +1,101 @@
+import asyncio
+import datetime as dt
+import json
+
+from aleph_scoring.config import PartitionInterval, settings
+from aleph_scoring.scoring.partitions import (
+    create_partitioned_table,
+    create_partitions,
+    list_partitions,
+    partitions_between,
+    read_measurements_query,
+    sync_measurements,
+)
+from aleph_scoring.utils import read_sql_file
+
+UTC = dt.timezone.utc
+
+
+def test_daily_partitions():
+    partitions = partitions_between(
+        dt.datetime(2023, 4, 15, 12), dt.datetime(2023, 4, 17), PartitionInterval.DAY
+    )
+
+    assert [partition.name for partition in partitions] == [
+        "node_measurements_20230415",
+        "node_measurements_20230416",
+    ]
+    assert partitions[0].from_date == dt.datetime(2023, 4, 15)
+    assert partitions[0].to_date == partitions[1].from_date
+    assert partitions[1].to_date == dt.datetime(2023, 4, 17)
+
+
+def test_weekly_partitions():
+    # 2023-04-15 is a Saturday, the partitions start on Mondays
+    partitions = partitions_between(
+        dt.datetime(2023, 4, 15), dt.datetime(2023, 4, 18), PartitionInterval.WEEK
+    )
+
+    assert [(partition.from_date, partition.to_date) for partition in partitions] == [
+        (dt.datetime(2023, 4, 10), dt.datetime(2023, 4, 17)),
+        (dt.datetime(2023, 4, 17), dt.datetime(2023, 4, 24)),
+    ]
+
+
+def test_read_measurements_query(monkeypatch):
+    query = read_measurements_query("query_crn_measurements.template.sql")
+    assert "FROM posts" in query
+    assert "/* measurement source */" not in query
+
+    monkeypatch.setattr(settings, "PARTITIONED_MEASUREMENTS", True)
+    query = read_measurements_query("query_crn_measurements.template.sql")
+    assert "FROM node_measurements" in query
+    assert "FROM posts" not in query
+
+
+async def insert_metrics_post(conn, item_hash: str, created_at: dt.datetime) -> None:
+    measured_at = dt.datetime(2023, 4, 15, 9, tzinfo=UTC).timestamp()
+    await conn.execute(
+        "INSERT INTO posts (item_hash, owner, type, content, creation_datetime) "
+        "VALUES ($1, $2, $3, $4, $5)",
+        item_hash,
+        settings.ALLOWED_METRICS_SENDER,
+        settings.ALEPH_POST_TYPE_METRICS,
+        json.dumps(
+            {"metrics": {"ccn": [], "crn": [{"node_id": "crn-0", "measured_at": measured_at}]}}
+        ),
+        created_at,
+    )
+
+
+def test_sync_measurements_copies_the_posts_indexed_late(database_schema):
+    async def run():
+        async with database_schema() as conn:
+            await conn.execute(read_sql_file("posts_table.sql"))
+            await create_partitioned_table(conn)
+            await create_partitions(
+                conn, dt.datetime(2023, 4, 14), dt.datetime(2023, 4, 17), PartitionInterval.DAY
+            )
+            await conn.execute(
+                "CREATE TABLE node_measurements_default PARTITION OF node_measurements DEFAULT"
+            )
+            partitions = await list_partitions(conn)
+
+            await insert_metrics_post(conn, "first", dt.datetime(2023, 4, 15, 10, tzinfo=UTC))
+            await insert_metrics_post(conn, "second", dt.datetime(2023, 4, 15, 12, tzinfo=UTC))
+            copied = [await sync_measurements(conn)]
+            # Indexed after the second post was copied
+            await insert_metrics_post(conn, "late", dt.datetime(2023, 4, 15, 11, tzinfo=UTC))
+            copied.append(await sync_measurements(conn))
+            copied.append(await sync_measurements(conn))
+            item_hashes = await conn.fetch("SELECT item_hash FROM node_measurements")
+            return partitions, copied, item_hashes
+
+    partitions, copied, item_hashes = asyncio.run(run())
+    assert [partition.name for partition in partitions] == [
+        "node_measurements_20230414",
+        "node_measurements_20230415",
+        "node_measurements_20230416",
+    ]
+    assert copied == [2, 1, 0]
+    assert sorted(record["item_hash"] for record in item_hashes) == ["first", "late", "second"]
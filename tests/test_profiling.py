@@ -0,0 +1,88 @@
+import datetime as dt
+import json
+import time
+
+from typer.testing import CliRunner
+
+from aleph_scoring.__main__ import app
+from aleph_scoring.config import settings
+from aleph_scoring.profiling import folded_stacks_path, phase, profile_run
+from aleph_scoring.scoring.synthetic import (
+    SyntheticDataset,
+    generate_posts,
+    software_version_records,
+)
+
+END = dt.datetime(2023, 4, 15)
+
+
+def busy(seconds: float) -> list:
+    allocations = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        allocations.append(bytearray(1024))
+    return allocations
+
+
+def test_profile_run(tmp_path):
+    report_path = tmp_path / "profile.json"
+    with profile_run("test", report_path, cpu=True, sampling_interval=0.001):
+        with phase("outer"):
+            with phase("inner"):
+                kept = busy(0.1)
+        with phase("inner"):
+            pass
+    # No profiled run
+    with phase("ignored"):
+        pass
+
+    report = json.loads(report_path.read_text())
+    assert report["command"] == "test"
+    assert [(entry["name"], entry["calls"]) for entry in report["phases"]] == [
+        ("outer", 1),
+        ("inner", 2),
+    ]
+    outer, inner = report["phases"]
+    assert outer["seconds"] >= inner["seconds"] >= 0.1
+    assert outer["memory_peak_bytes"] >= len(kept) * 1024
+    assert inner["memory_peak_bytes"] >= len(kept) * 1024
+    assert report["memory"]["by_module"][0]["module"] == __name__
+
+    functions = {entry["function"]: entry for entry in report["cpu"]["functions"]}
+    assert functions[f"{__name__}:busy"]["total"] > 0
+    assert f"{__name__}:busy" in folded_stacks_path(report_path).read_text()
+
+
+def test_compute_scores_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SCORE_CACHE_DIRECTORY", None)
+    dataset = SyntheticDataset(ccn_nodes=3, crn_nodes=5, rounds_per_day=4, days=1)
+    with (tmp_path / "rounds.jsonl").open("w") as fd:
+        for post in generate_posts(dataset, END):
+            fd.write(post.content + "\n")
+    (tmp_path / "software_versions.json").write_text(
+        json.dumps(
+            [json.loads(record.json()) for record in software_version_records(dataset.period(END))]
+        )
+    )
+
+    report_path = tmp_path / "profile.json"
+    result = CliRunner().invoke(
+        app,
+        [
+            "compute-scores",
+            "--metrics-directory",
+            str(tmp_path),
+            "--to-date",
+            END.isoformat(),
+            "--output",
+            str(tmp_path / "scores.json"),
+            "--profile",
+            str(report_path),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    report = json.loads(report_path.read_text())
+    assert report["command"] == "compute-scores"
+    assert [entry["name"] for entry in report["phases"]] == ["scoring_queries", "serialization"]
+    assert "cpu" not in report
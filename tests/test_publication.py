@@ -0,0 +1,196 @@
+import asyncio
+import datetime as dt
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics.models import CrnMetrics, NodeMetrics
+from aleph_scoring.publication import (
+    decode_scores_detail,
+    encode_scores_detail,
+    metrics_post_content,
+    publish_compact_scores,
+    publish_scores,
+    rebuild_scores,
+    score_delta,
+    score_summaries,
+)
+from aleph_scoring.scoring.models import (
+    CompactNodeScoresPost,
+    CrnMeasurements,
+    CrnScore,
+    NodeScores,
+    NodeScoresPost,
+)
+from aleph_scoring.utils import Period
+
+PERIOD = Period(from_date=dt.datetime(2023, 4, 14), to_date=dt.datetime(2023, 4, 15))
+
+
+def crn_score(node_id: str, total_score: float) -> CrnScore:
+    return CrnScore(
+        node_id=node_id,
+        total_score=total_score,
+        performance=0.9,
+        version=1.0,
+        decentralization=0.75,
+        measurements=CrnMeasurements(
+            total_nodes=4,
+            nodes_with_identical_asn=1,
+            base_latency_score_p25=0.95,
+            base_latency_score_p95=0.8,
+            node_version_latest=20,
+            node_version_outdated=4,
+            node_version_obsolete=0,
+            node_version_missing=0,
+            node_version_other=0,
+            node_version_prerelease=0,
+            diagnostic_vm_latency_score_p25=0.9,
+            diagnostic_vm_latency_score_p95=0.5,
+            full_check_latency_score_p25=0.85,
+            full_check_latency_score_p95=0.3,
+        ),
+    )
+
+
+NODE_SCORES = NodeScores(
+    ccn=[], crn=[crn_score(f"node-{index}", index / 100) for index in range(50)]
+)
+
+
+def test_scores_detail_roundtrip():
+    detail = encode_scores_detail(PERIOD, NODE_SCORES)
+    window = decode_scores_detail(detail)
+
+    assert window.period == PERIOD
+    assert window.scores == NODE_SCORES
+    full_post = NodeScoresPost(tags=["mainnet"], period=PERIOD, scores=NODE_SCORES).json()
+    assert len(detail) < len(full_post) / 2
+
+
+class FakeClient:
+    def __init__(self):
+        self.stored = []
+        self.posts = []
+
+    async def create_store(self, file_content, storage_engine, channel):
+        self.stored.append(file_content)
+        return SimpleNamespace(content=SimpleNamespace(item_hash="detail-hash")), "processed"
+
+    async def create_post(self, post_content, post_type, channel):
+        self.posts.append((post_type, json.loads(json.dumps(post_content))))
+        return SimpleNamespace(item_hash=f"post-{len(self.posts)}"), "processed"
+
+
+def test_publish_compact_scores():
+    client = FakeClient()
+    asyncio.run(publish_compact_scores(client, NODE_SCORES, PERIOD))
+
+    (detail,) = client.stored
+    ((_, content),) = client.posts
+    post = CompactNodeScoresPost.parse_obj(content)
+    assert post.detail.item_hash == "detail-hash"
+    assert post.detail.size == len(detail)
+    assert post.period == PERIOD
+    assert [score.total_score for score in post.scores.crn] == [
+        score.total_score for score in NODE_SCORES.crn
+    ]
+    assert all("measurements" not in score for score in content["scores"]["crn"])
+
+
+def test_metrics_post_content_drops_missing_values(monkeypatch):
+    node_metrics = NodeMetrics(
+        server="127.0.0.1",
+        server_asn=1,
+        server_as_name="LOCAL",
+        ccn=[],
+        crn=[
+            CrnMetrics(
+                measured_at=1681516800.0,
+                node_id="node-0",
+                url="https://node-0.example/",
+                asn=None,
+                as_name=None,
+                version="0.2.5",
+                days_outdated=None,
+                base_latency=0.1,
+                base_latency_ipv4=None,
+                diagnostic_vm_latency=None,
+                full_check_latency=None,
+            )
+        ],
+    )
+    (node,) = metrics_post_content(node_metrics)["metrics"]["crn"]
+    assert node["asn"] is None
+    assert node["full_check_latency"] is None
+
+    monkeypatch.setattr(settings, "COMPACT_SCORES_POSTS", True)
+    (node,) = metrics_post_content(node_metrics)["metrics"]["crn"]
+    assert node == {
+        "measured_at": 1681516800.0,
+        "node_id": "node-0",
+        "url": "https://node-0.example/",
+        "version": "0.2.5",
+        "base_latency": 0.1,
+    }
+
+
+def test_score_delta():
+    previous = score_summaries(NODE_SCORES)
+    current = NodeScores(
+        ccn=[],
+        crn=[crn_score("node-0", 0.0005), crn_score("node-1", 0.5)]
+        + [crn_score(f"node-{index}", index / 100) for index in range(2, 49)]
+        + [crn_score("node-new", 0.2)],
+    )
+    changed, removed = score_delta(previous, score_summaries(current), threshold=0.001)
+
+    assert [score.node_id for score in changed.crn] == ["node-1", "node-new"]
+    assert removed.crn == ["node-49"]
+    assert changed.ccn == removed.ccn == []
+
+
+def test_publish_score_deltas(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DELTA_SCORES_POSTS", True)
+    monkeypatch.setattr(settings, "PUBLISHED_SCORES_DIRECTORY", tmp_path)
+    client = FakeClient()
+
+    def publish(node_scores):
+        return asyncio.run(publish_scores(client, node_scores, PERIOD))
+
+    # First publication: full checkpoint
+    checkpoint, _ = publish(NODE_SCORES)
+    # Small changes only: nothing is published
+    small_changes = [
+        crn_score(score.node_id, score.total_score + 0.0005) for score in NODE_SCORES.crn
+    ]
+    assert publish(NodeScores(ccn=[], crn=small_changes)) is None
+    # Two deltas
+    crn = [crn_score(score.node_id, score.total_score) for score in NODE_SCORES.crn]
+    crn[3] = crn_score("node-3", 0.9)
+    publish(NodeScores(ccn=[], crn=crn))
+    publish(NodeScores(ccn=[], crn=crn[:-1]))
+
+    assert [post_type for post_type, _ in client.posts] == [
+        settings.ALEPH_POST_TYPE_SCORES,
+        settings.ALEPH_POST_TYPE_SCORES_DELTA,
+        settings.ALEPH_POST_TYPE_SCORES_DELTA,
+    ]
+    (_, full), (_, first_delta), (_, second_delta) = client.posts
+    assert first_delta["previous"] == checkpoint.item_hash
+    assert second_delta["previous"] == "post-2"
+    assert [score["node_id"] for score in first_delta["scores"]["crn"]] == ["node-3"]
+
+    rebuilt = rebuild_scores(checkpoint.item_hash, full, [second_delta, first_delta])
+    assert {score.node_id: score.total_score for score in rebuilt.crn} == {
+        score.node_id: score.total_score for score in crn[:-1]
+    }
+    with pytest.raises(ValueError):
+        rebuild_scores(checkpoint.item_hash, full, [second_delta])
+
+    # The checkpoint interval elapsed: full scores again
+    monkeypatch.setattr(settings, "SCORE_CHECKPOINT_INTERVAL", dt.timedelta(0))
+    publish(NodeScores(ccn=[], crn=crn))
+    assert client.posts[-1][0] == settings.ALEPH_POST_TYPE_SCORES
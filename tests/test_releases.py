@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import datetime as dt
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+from aleph_scoring.config import settings
+from aleph_scoring.releases import (
+    COUNT_CHANGED_VERSIONS_SQL,
+    UPSERT_VERSIONS_SQL,
+    ReleaseCache,
+    fetch_releases,
+    get_latest_github_releases,
+    software_versions,
+    sync_software_versions,
+)
+from aleph_scoring.utils import GithubRelease
+
+ETAG = '"releases-v1"'
+
+
+def github_release(tag_name, published_at, prerelease=False):
+    return {
+        "tag_name": tag_name,
+        "name": tag_name,
+        "created_at": published_at,
+        "published_at": published_at,
+        "prerelease": prerelease,
+        "body": "Release notes",
+    }
+
+
+# Most recent first, like the GitHub API
+RELEASES = [
+    github_release("v0.5.0-rc2", "2023-04-14T16:50:26Z", prerelease=True),
+    github_release("v0.5.0-rc1", "2023-03-28T13:16:11Z", prerelease=True),
+    github_release("v0.4.7", "2023-03-21T11:31:26Z"),
+    github_release("v0.4.6", "2023-03-20T17:19:44Z"),
+]
+
+
+async def serve_releases(requests, run):
+    async def releases_handler(request):
+        requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304)
+        return web.json_response(RELEASES, headers={"ETag": ETAG})
+
+    app = web.Application()
+    app.router.add_get("/repos/aleph-im/pyaleph/releases", releases_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await run(f"http://127.0.0.1:{port}")
+    finally:
+        await runner.cleanup()
+
+
+def test_fetch_releases_revalidates_with_etag(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RELEASE_CACHE_DIRECTORY", tmp_path)
+    cache = ReleaseCache(tmp_path)
+    requests = []
+
+    async def run(api_url):
+        monkeypatch.setattr(settings, "GITHUB_API_URL", api_url)
+        async with aiohttp.ClientSession() as session:
+            first = await fetch_releases(session, "aleph-im", "pyaleph", cache)
+            # Fresh cache: no request
+            second = await fetch_releases(session, "aleph-im", "pyaleph", cache)
+            # Expired cache: conditional request, answered with 304
+            monkeypatch.setattr(settings, "RELEASE_CACHE_MAX_AGE", dt.timedelta(0))
+            third = await fetch_releases(session, "aleph-im", "pyaleph", cache)
+        return first, second, third
+
+    first, second, third = asyncio.run(serve_releases(requests, run))
+
+    assert [release.tag_name for release in first] == [release["tag_name"] for release in RELEASES]
+    assert first == second == third
+    assert len(requests) == 2
+    assert "If-None-Match" not in requests[0]
+    assert requests[1]["If-None-Match"] == ETAG
+    assert cache.get("aleph-im", "pyaleph").etag == ETAG
+
+
+def test_cached_releases_survive_restarts_and_outages(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RELEASE_CACHE_DIRECTORY", tmp_path)
+    requests = []
+
+    async def run(api_url):
+        monkeypatch.setattr(settings, "GITHUB_API_URL", api_url)
+        return await get_latest_github_releases("aleph-im", "pyaleph")
+
+    latest, previous, prerelease = asyncio.run(serve_releases(requests, run))
+    assert (latest.tag_name, previous.tag_name, prerelease.tag_name) == (
+        "v0.4.7",
+        "v0.4.6",
+        "v0.5.0-rc2",
+    )
+
+    # The server is gone, the expired cache of the previous run is used
+    monkeypatch.setattr(settings, "RELEASE_CACHE_MAX_AGE", dt.timedelta(0))
+    monkeypatch.setattr(settings, "GITHUB_API_URL", "http://127.0.0.1:9")
+    assert asyncio.run(get_latest_github_releases("aleph-im", "pyaleph"))[0] == latest
+
+
+def test_software_versions():
+    releases = [GithubRelease.parse_obj(release) for release in RELEASES]
+    records = {record.name: record for record in software_versions("pyaleph", releases)}
+
+    # Same rows as test_software_versions_function.sql
+    utc = dt.timezone.utc
+    assert records["v0.5.0-rc2"].replaced_on is None
+    assert records["v0.5.0-rc1"].replaced_on == dt.datetime(2023, 4, 14, 16, 50, 26, tzinfo=utc)
+    assert records["v0.4.7"].replaced_on is None
+    assert records["v0.4.6"].replaced_on == dt.datetime(2023, 3, 21, 11, 31, 26, tzinfo=utc)
+    assert records["v0.4.6"].released_on == dt.datetime(2023, 3, 20, 17, 19, 44, tzinfo=utc)
+    assert records["v0.5.0-rc1"].prerelease
+
+
+class FakeConnection:
+    """Records the statements, with `changed` versions differing from the table."""
+
+    def __init__(self, changed: int):
+        self.changed = changed
+        self.statements: List[str] = []
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def fetchval(self, query, *args):
+        self.statements.append(query)
+        return self.changed
+
+    async def execute(self, query, *args):
+        self.statements.append(query)
+        self.arguments = args
+
+
+def test_sync_software_versions_writes_the_changes_in_one_statement():
+    releases = [GithubRelease.parse_obj(release) for release in RELEASES]
+    records = software_versions("pyaleph", releases)
+
+    unchanged = FakeConnection(changed=0)
+    assert asyncio.run(sync_software_versions(unchanged, records)) == 0
+    # Nothing is written, the intervals view is not refreshed
+    assert unchanged.statements == [COUNT_CHANGED_VERSIONS_SQL]
+
+    changed = FakeConnection(changed=2)
+    assert asyncio.run(sync_software_versions(changed, records)) == 2
+    assert changed.statements == [COUNT_CHANGED_VERSIONS_SQL, UPSERT_VERSIONS_SQL]
+    software, names, released_on, replaced_on, prerelease = changed.arguments
+    assert names == [record.name for record in records]
+    assert all(date.tzinfo is None for date in released_on)
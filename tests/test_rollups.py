@@ -0,0 +1,129 @@
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from aleph_scoring.scoring.metric_scores import CRN_METRICS
+from aleph_scoring.scoring.rollups import (
+    NodeRollup,
+    asn_distribution,
+    truncate_to_hour,
+    update_rollups,
+)
+from aleph_scoring.scoring.sketch import DDSketch
+
+
+def percentile_disc(values, q):
+    values = sorted(values)
+    return values[max(int(-(-q * len(values) // 1)), 1) - 1]
+
+
+@pytest.mark.parametrize("q", [0.25, 0.5, 0.8, 0.95])
+def test_sketch_quantile_relative_error(q):
+    rng = random.Random(42)
+    values = [rng.lognormvariate(-1, 1) for _ in range(5000)]
+
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    expected = percentile_disc(values, q)
+    assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+
+def test_sketch_merge():
+    first, second, both = DDSketch(), DDSketch(), DDSketch()
+    for value in (0.1, 0.2, 0.3, 0):
+        first.add(value)
+        both.add(value)
+    for value in (0.4, 0.5, 100.0):
+        second.add(value)
+        both.add(value)
+
+    first.merge(DDSketch.from_dict(second.to_dict()))
+    assert first.count == 7
+    assert first.zero_count == 1
+    assert first.bins == both.bins
+
+
+def test_rollup_counts_missing_values():
+    rollup = NodeRollup(metrics=CRN_METRICS, relative_accuracy=0.01)
+    rollup.add([0.1, None, 1.0], version="0.2.5", asn=1)
+    rollup.add([0.2, None, None], version=None, asn=1)
+
+    assert rollup.samples == 2
+    assert rollup.missing == {
+        "base_latency": 0,
+        "diagnostic_vm_latency": 2,
+        "full_check_latency": 1,
+    }
+    assert rollup.versions == Counter({"0.2.5": 1, "": 1})
+    assert rollup.percentile("diagnostic_vm_latency", 0.25, 100.0) == pytest.approx(
+        100.0, rel=0.01
+    )
+
+
+def test_asn_distribution():
+    asn_info = asn_distribution(
+        {
+            "a": Counter({"1": 3}),
+            "b": Counter({"1": 1, "": 2}),
+            "c": Counter({"2": 5}),
+        }
+    )
+    # (a, 1), (b, 1), (b, null) and (c, 2) each count as one node
+    assert asn_info["a"] == {"asn": 1, "total_nodes": 4, "nodes_with_identical_asn": 2}
+    assert asn_info["b"]["asn"] == 1
+    assert asn_info["c"]["nodes_with_identical_asn"] == 1
+
+
+class FakeRollupsConnection:
+    """Rolls up the measurements of `posts`, which the tests can append to."""
+
+    def __init__(self):
+        self.posts = []
+        self.rollups = {}
+
+    async def fetchval(self, query, node_type):
+        return max((hour for _, hour in self.rollups), default=None)
+
+    async def fetch(self, query, sender, post_type, from_date, to_date, node_type, metrics):
+        return [
+            post
+            for post in self.posts
+            if from_date <= truncate_to_hour(post["measured_at"]) < to_date
+        ]
+
+    async def executemany(self, query, rows):
+        for node_type, node_id, hour, samples, *_ in rows:
+            self.rollups[(node_id, hour)] = samples
+
+
+def test_update_rollups_counts_the_late_posts():
+    conn = FakeRollupsConnection()
+    current_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+    def add_post(hours_ago: int) -> None:
+        hour = current_hour - timedelta(hours=hours_ago)
+        conn.posts.append(
+            {
+                "node_id": "crn-0",
+                "measured_at": hour.replace(tzinfo=timezone.utc).timestamp() + 60,
+                "version": "0.2.5",
+                "asn": 1,
+                "metric_values": [0.1, 0.2, 0.3],
+            }
+        )
+
+    add_post(hours_ago=3)
+    add_post(hours_ago=2)
+    asyncio.run(update_rollups(conn, node_type="crn"))
+    assert sorted(conn.rollups.values()) == [1, 1]
+
+    # A post of an hour that was already rolled up reaches the database
+    add_post(hours_ago=3)
+    asyncio.run(update_rollups(conn, node_type="crn"))
+    assert conn.rollups[("crn-0", current_hour - timedelta(hours=3))] == 2
+    assert conn.rollups[("crn-0", current_hour - timedelta(hours=2))] == 1
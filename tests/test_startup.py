@@ -0,0 +1,144 @@
+"""
+The CLI imports the modules of a command when the command runs. These tests
+run the commands in a fresh interpreter and check the modules it loaded.
+"""
+import datetime as dt
+import json
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+from typing import Set
+
+from aleph_scoring.scoring.synthetic import (
+    SyntheticDataset,
+    generate_posts,
+    software_version_records,
+)
+
+# Seconds to import the CLI, about 10 times the time it takes on a laptop
+IMPORT_TIME_BUDGET = 1.5
+
+DATABASE_STACK = {"asyncpg", "numpy", "aleph_scoring.scoring.compute"}
+PROBE_STACK = {"pyasn", "icmplib", "aleph_scoring.metrics"}
+PUBLICATION_STACK = {"aleph.sdk", "eth_account", "aleph_scoring.outbox"}
+
+ROOT = Path(__file__).parent.parent
+END = dt.datetime(2023, 4, 15)
+
+
+def loaded_modules(script: str) -> Set[str]:
+    """Modules loaded by the script, which must end by printing them."""
+    process = subprocess.run(
+        [sys.executable, "-c", textwrap.dedent(script)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(process.stdout.splitlines()[-1]))
+
+
+def test_import_cli():
+    modules = loaded_modules(
+        """
+        import json, sys
+
+        import aleph_scoring.__main__
+        print(json.dumps(sorted(sys.modules)))
+        """
+    )
+    assert not modules & (DATABASE_STACK | PROBE_STACK | PUBLICATION_STACK | {"sentry_sdk"})
+
+
+def test_import_time_budget():
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import time; start = time.perf_counter(); import aleph_scoring.__main__; "
+            "print(time.perf_counter() - start)",
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert float(process.stdout) < IMPORT_TIME_BUDGET
+
+
+def test_measure_does_not_load_the_database_stack(tmp_path):
+    modules = loaded_modules(
+        f"""
+        import json, sys
+
+        from typer.testing import CliRunner
+
+        import aleph_scoring.metrics
+        from aleph_scoring.__main__ import app
+        from aleph_scoring.metrics.models import NodeMetrics
+
+        aleph_scoring.metrics.measure_node_performance_sync = lambda: NodeMetrics(
+            server="127.0.0.1", server_asn=0, server_as_name="", ccn=[], crn=[]
+        )
+        output = {str(tmp_path / "metrics.json")!r}
+        result = CliRunner().invoke(app, ["measure", "--output", output])
+        assert result.exit_code == 0, result.output
+        print(json.dumps(sorted(sys.modules)))
+        """
+    )
+    assert "aleph_scoring.metrics" in modules
+    assert not modules & (DATABASE_STACK | PUBLICATION_STACK)
+    assert (tmp_path / "metrics.json").exists()
+
+
+def test_compute_scores_does_not_load_the_probe_stack(tmp_path):
+    dataset = SyntheticDataset(ccn_nodes=2, crn_nodes=3, rounds_per_day=4, days=1)
+    with (tmp_path / "rounds.jsonl").open("w") as fd:
+        for post in generate_posts(dataset, END):
+            fd.write(post.content + "\n")
+    (tmp_path / "software_versions.json").write_text(
+        json.dumps(
+            [json.loads(record.json()) for record in software_version_records(dataset.period(END))]
+        )
+    )
+    modules = loaded_modules(
+        f"""
+        import json, sys
+
+        from typer.testing import CliRunner
+
+        from aleph_scoring.__main__ import app
+
+        result = CliRunner().invoke(
+            app,
+            [
+                "compute-scores",
+                "--metrics-directory",
+                {str(tmp_path)!r},
+                "--to-date",
+                {END.isoformat()!r},
+                "--output",
+                {str(tmp_path / "scores.json")!r},
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        print(json.dumps(sorted(sys.modules)))
+        """
+    )
+    assert "numpy" in modules
+    # The metrics server is disabled
+    assert not modules & (PROBE_STACK | PUBLICATION_STACK | {"aiohttp.web"})
+    assert (tmp_path / "scores.json").exists()
+
+
+def test_release_sync_does_not_load_numpy():
+    modules = loaded_modules(
+        """
+        import json, sys
+
+        import aleph_scoring.releases
+        print(json.dumps(sorted(sys.modules)))
+        """
+    )
+    assert "numpy" not in modules
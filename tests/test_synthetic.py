@@ -0,0 +1,86 @@
+import asyncio
+import datetime as dt
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from aleph_scoring.metrics.models import MetricsPost
+from aleph_scoring.scoring.benchmark import time_runs
+from aleph_scoring.scoring.migrations import scoring_queries
+from aleph_scoring.scoring.synthetic import (
+    SyntheticDataset,
+    generate_posts,
+    parse_version_mix,
+    software_version_records,
+    synthetic_versions,
+)
+
+END = dt.datetime(2023, 4, 15)
+
+
+def test_generate_posts():
+    dataset = SyntheticDataset(ccn_nodes=3, crn_nodes=5, rounds_per_day=4, days=2, seed=1)
+    posts = list(generate_posts(dataset, END))
+
+    assert len(posts) == 8
+    assert len({post.item_hash for post in posts}) == 8
+    assert posts == list(generate_posts(dataset, END))
+
+    period = dataset.period(END)
+    for post in posts:
+        content = MetricsPost.parse_raw(post.content)
+        assert len(content.metrics.ccn) == 3
+        assert len(content.metrics.crn) == 5
+        for metrics in content.metrics.ccn + content.metrics.crn:
+            measured_at = dt.datetime.utcfromtimestamp(metrics.measured_at)
+            assert period.from_date <= measured_at < period.to_date
+
+
+def test_version_mix():
+    dataset = SyntheticDataset(
+        ccn_nodes=0, crn_nodes=200, days=1, rounds_per_day=1, version_mix={"missing": 1}
+    )
+    (post,) = generate_posts(dataset, END)
+    assert {node["version"] for node in json.loads(post.content)["metrics"]["crn"]} == {None}
+
+    with pytest.raises(ValidationError):
+        SyntheticDataset(version_mix={"recent": 1})
+    with pytest.raises(ValidationError):
+        SyntheticDataset(version_mix={"latest": 0})
+
+    assert parse_version_mix("latest=0.8, missing=0.2") == {"latest": 0.8, "missing": 0.2}
+
+
+def test_synthetic_versions():
+    period = SyntheticDataset(days=7).period(END)
+    versions = synthetic_versions(period)
+
+    assert versions["latest"].released_on <= period.from_date
+    assert versions["latest"].replaced_on is None
+    assert versions["outdated"].replaced_on <= period.from_date
+    assert versions["obsolete"].replaced_on + dt.timedelta(days=14) <= period.from_date
+    assert versions["other"].released_on > period.to_date
+    assert {row.software for row in software_version_records(period)} == {"aleph-vm", "pyaleph"}
+
+
+def test_scoring_queries_period():
+    period = SyntheticDataset(days=3).period(END)
+    for _, sql, args in scoring_queries(period):
+        assert "/* measurement source */" not in sql
+        if len(args) > 2:
+            assert args[2:4] == (period.from_date, period.to_date)
+
+
+def test_time_runs():
+    calls = []
+
+    async def run():
+        calls.append(1)
+        return 12
+
+    timing = asyncio.run(time_runs("query", run, runs=3))
+    assert len(calls) == 3
+    assert timing.rows == 12
+    assert len(timing.durations) == 3
+    assert timing.median == sorted(timing.durations)[1]
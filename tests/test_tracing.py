@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+from aleph_scoring.config import settings
+from aleph_scoring.metrics import measure_http_latency
+from aleph_scoring.tracing import (
+    ROUND_ID_ATTRIBUTE,
+    StatusCode,
+    export_spans,
+    new_round_id,
+    start_round,
+    start_span,
+    trace_configs,
+)
+
+
+async def serve(run):
+    received = []
+
+    async def login(request):
+        return web.Response(status=401)
+
+    async def slow(request):
+        await asyncio.sleep(1)
+        return web.Response()
+
+    async def traces(request):
+        received.append(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_get("/about/login", login)
+    app.router.add_get("/slow", slow)
+    app.router.add_post("/v1/traces", traces)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        await run(f"http://127.0.0.1:{port}")
+    finally:
+        await runner.cleanup()
+    return received
+
+
+def attributes(span):
+    return {
+        attribute["key"]: list(attribute["value"].values())[0]
+        for attribute in span["attributes"]
+    }
+
+
+def test_round_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "TRACES_FILE", tmp_path / "traces.jsonl")
+    round_id = new_round_id()
+
+    async def run(url):
+        monkeypatch.setattr(settings, "TRACES_ENDPOINT", f"{url}/v1/traces")
+        async with aiohttp.ClientSession(trace_configs=trace_configs()) as session:
+            with start_round(round_id):
+                with start_span("crn", attributes={"node.id": "node-0"}):
+                    await measure_http_latency(
+                        session, f"{url}/about/login", expected_status=401, probe="base_latency"
+                    )
+                    await measure_http_latency(
+                        session, f"{url}/slow", timeout_seconds=0.05, probe="full_check_latency"
+                    )
+        assert await export_spans() == 4
+
+    (posted,) = asyncio.run(serve(run))
+    (line,) = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert json.loads(line) == posted
+
+    (resource_spans,) = posted["resourceSpans"]
+    (scope_spans,) = resource_spans["scopeSpans"]
+    spans = {span["name"]: span for span in scope_spans["spans"]}
+    assert set(spans) == {"measurement_round", "crn", "base_latency", "full_check_latency"}
+    assert {span["traceId"] for span in spans.values()} == {round_id}
+    assert all(attributes(span)[ROUND_ID_ATTRIBUTE] == round_id for span in spans.values())
+
+    assert "parentSpanId" not in spans["measurement_round"]
+    assert spans["crn"]["parentSpanId"] == spans["measurement_round"]["spanId"]
+    probe = spans["base_latency"]
+    assert probe["parentSpanId"] == spans["crn"]["spanId"]
+    assert probe["status"]["code"] == StatusCode.OK
+    assert attributes(probe)["http.status_code"] == "401"
+    assert attributes(probe)["net.family"] == "any"
+    events = [event["name"] for event in probe["events"]]
+    assert events.index("connection_create_start") < events.index("response_headers_received")
+
+    timed_out = spans["full_check_latency"]
+    assert timed_out["status"] == {"code": StatusCode.ERROR, "message": "timeout"}
+
+
+def test_tracing_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "TRACES_FILE", None)
+    monkeypatch.setattr(settings, "TRACES_ENDPOINT", None)
+
+    with start_round(new_round_id()), start_span("crn") as span:
+        span.set_attribute("node.id", "node-0")
+
+    assert trace_configs() == []
+    assert asyncio.run(export_spans()) == 0
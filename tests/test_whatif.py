@@ -0,0 +1,96 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from aleph_scoring.metrics.models import CrnMetrics
+from aleph_scoring.scoring.engine import (
+    MetricsTable,
+    SoftwareVersion,
+    VersionClassifier,
+    score_metrics_table,
+)
+from aleph_scoring.scoring.formula import DEFAULT_FORMULA
+from aleph_scoring.scoring.metric_scores import CRN_METRICS
+from aleph_scoring.scoring.whatif import Scenario, run_scenarios, score_ranks
+
+NOW = dt.datetime(2023, 4, 15)
+CLASSIFIER = VersionClassifier(
+    [SoftwareVersion("0.2.5", dt.datetime(2022, 10, 6, 20, 58, 31), None, False)]
+)
+
+
+def crn_metrics(node_id, base_latency, full_check_latency):
+    return CrnMetrics(
+        measured_at=NOW.replace(tzinfo=dt.timezone.utc).timestamp(),
+        node_id=node_id,
+        url="https://aleph.sh",
+        asn=1,
+        as_name="Aleph.im",
+        version="0.2.5",
+        base_latency=base_latency,
+        base_latency_ipv4=base_latency,
+        diagnostic_vm_latency=0.5,
+        full_check_latency=full_check_latency,
+    )
+
+
+@pytest.fixture
+def table():
+    return MetricsTable.from_node_metrics(
+        [
+            crn_metrics("a", 0.1, 3.0),
+            crn_metrics("b", 0.5, 1.0),
+            crn_metrics("c", 1.5, 0.5),
+        ],
+        metrics=CRN_METRICS,
+    )
+
+
+def test_score_ranks():
+    assert score_ranks(np.array([0.5, 0.9, 0.0, 0.7])).tolist() == [3, 1, 4, 2]
+
+
+def test_unchanged_scenario(table):
+    (report,) = run_scenarios(
+        table, "crn", CLASSIFIER, [Scenario(name="same")], baseline_formula=DEFAULT_FORMULA
+    )
+
+    assert report.nodes == 3
+    assert report.max_absolute_score_delta == 0
+    assert report.max_absolute_rank_change == 0
+    assert report.dropped_to_zero == report.rose_from_zero == 0
+
+
+def test_scenarios(table):
+    baseline = {
+        score.node_id: score.total_score
+        for score in score_metrics_table(table, "crn", CLASSIFIER)
+    }
+    scenarios = [
+        # Ignore the full check latency, that penalizes node a
+        Scenario(name="no-full-check", weights={"full_check_latency_score_p25": 0}),
+        # Stricter base latency score, node c gets 0
+        Scenario(
+            name="strict-latency",
+            metric_scores={"base_latency_score_p25": {"divisor": 1}},
+        ),
+    ]
+    no_full_check, strict_latency = run_scenarios(
+        table, "crn", CLASSIFIER, scenarios, baseline_formula=DEFAULT_FORMULA
+    )
+
+    assert no_full_check.name == "no-full-check"
+    changes = {change.node_id: change for change in no_full_check.largest_changes}
+    assert changes["a"].total_score == pytest.approx(baseline["a"])
+    assert changes["a"].new_total_score > changes["a"].total_score
+    assert changes["a"].rank > 1
+    assert changes["a"].new_rank == 1
+    assert no_full_check.rose_from_zero == 0
+
+    assert strict_latency.dropped_to_zero == 1
+    changes = {change.node_id: change for change in strict_latency.largest_changes}
+    assert changes["c"].new_total_score == 0
+    assert changes["b"].new_total_score == pytest.approx(
+        baseline["b"] * ((1 - 0.5) / (1 - 0.5 / 2)) ** (1 / 8)
+    )